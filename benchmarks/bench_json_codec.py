@@ -0,0 +1,75 @@
+"""
+Compares the encode and decode throughput of the JSON codecs with the per-object
+serialize_objects_to_single_json / deserialize_single_json_to_objects path, on generated posts.
+
+Usage: python3 benchmarks/bench_json_codec.py [--sizes 1000,10000,100000]
+
+A day of posts from every subreddit is in the hundreds of thousands; --sizes 1000000 needs a few GiB of memory.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from datetime import date as Date
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+from common.models import RedditPost  # noqa: E402
+from common.utils import deserialize_single_json_to_objects  # noqa: E402
+from common.utils import get_json_codec  # noqa: E402
+from common.utils import serialize_objects_to_single_json  # noqa: E402
+
+
+def generate_posts(num_posts: int) -> list[RedditPost]:
+    return [
+        RedditPost(
+            post_id=f"p{i}",
+            title=f"Post title number {i}",
+            body="Some body text " * 10,
+            subreddit="benchmark",
+            upvote_ratio=0.9,
+            upvotes=i % 100,
+            downvotes_estimated=i % 10,
+            awards=0,
+            created_utc=1690502400.0 + i,
+            extracted_utc=1690588800.0,
+            comment_count=i % 10,
+            date=Date(2023, 7, 28),
+        )
+        for i in range(num_posts)
+    ]
+
+
+def time_per_post(function, num_posts: int) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = function()
+    return (time.perf_counter() - start) * 1e6 / num_posts, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    args = parser.parse_args()
+
+    for num_posts in map(int, args.sizes.split(",")):
+        posts = generate_posts(num_posts)
+        print(f"{num_posts} posts")
+
+        encode_us, json_string = time_per_post(lambda: serialize_objects_to_single_json(posts), num_posts)
+        decode_us, _ = time_per_post(lambda: deserialize_single_json_to_objects(json_string, RedditPost), num_posts)
+        print(f"  {'per-object':>10}: encode {encode_us:.2f} us/post, decode {decode_us:.2f} us/post")
+
+        for codec_name in ("stdlib", "orjson"):
+            codec = get_json_codec(codec_name)
+            encode_us, data = time_per_post(lambda: codec.encode(posts), num_posts)
+            decode_us, _ = time_per_post(lambda: codec.decode(data, RedditPost), num_posts)
+            print(
+                f"  {codec_name:>10}: encode {encode_us:.2f} us/post, decode {decode_us:.2f} us/post, "
+                f"{len(data) / num_posts:.0f} bytes/post",
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Times get_subreddit_metrics_list_from_metrics_df on a generated metrics DataFrame, with and
+without pydantic validation, against the previous row-by-row iterrows() conversion.
+
+Usage: python3 benchmarks/bench_metrics_conversion.py [--subreddits 50000] [--without-posts 0.2]
+
+--without-posts is the fraction of subreddits that have no posts, and are filled in with
+empty metrics.
+"""
+from __future__ import annotations
+
+import argparse
+import copy
+import os
+import sys
+import time
+from datetime import date as Date
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+for env_var in (
+    "REDDIT_CLIENT_ID",
+    "REDDIT_CLIENT_SECRET",
+    "SUBREDDITS",
+    "HUGGINGFACE_TOKEN",
+    "GCS_RAW_BUCKET_NAME",
+    "GCS_TRANSFORMED_BUCKET_NAME",
+    "BIGQUERY_DATASET_ID",
+    "BIGQUERY_TABLE_ID",
+):
+    os.environ.setdefault(env_var, "benchmark")
+
+from common.models import SubredditMetrics  # noqa: E402
+from transform import get_subreddit_metrics_list_from_metrics_df  # noqa: E402
+
+
+def generate_metrics_df(subreddits: list[str]) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "subreddit": subreddits,
+            "upvotes": [i % 1000 for i in range(len(subreddits))],
+            "downvotes_estimated": [i % 100 for i in range(len(subreddits))],
+            "sentiment_score": [(i % 200) / 100 - 1 for i in range(len(subreddits))],
+            "topics": [["sample-topic"] for _ in subreddits],
+            "upvote_ratio": [0.9] * len(subreddits),
+            "posts": [i % 50 + 1 for i in range(len(subreddits))],
+        },
+    )
+
+
+def convert_with_iterrows(metrics_df: pd.DataFrame, date: Date, all_subreddits: set[str]) -> list[SubredditMetrics]:
+    """The row-by-row conversion that get_subreddit_metrics_list_from_metrics_df replaced"""
+    subreddits_with_no_posts = copy.deepcopy(all_subreddits)
+    subreddit_metrics = []
+    for _, row in metrics_df.iterrows():
+        subreddit_metrics.append(
+            SubredditMetrics(
+                date=date,
+                subreddit=row.subreddit,
+                upvotes=row.upvotes,
+                downvotes=row.downvotes_estimated,
+                upvote_ratio=row.upvote_ratio,
+                posts=row.posts,
+                sentiment_score=row.sentiment_score,
+                topics=row.topics,
+                transformed_utc=datetime.utcnow().timestamp(),
+            ),
+        )
+        subreddits_with_no_posts.remove(row.subreddit)
+    for subreddit in subreddits_with_no_posts:
+        subreddit_metrics.append(
+            SubredditMetrics(
+                date=date,
+                subreddit=subreddit,
+                upvotes=0,
+                downvotes=0,
+                upvote_ratio=1,
+                posts=0,
+                sentiment_score=0,
+                topics=[],
+                transformed_utc=datetime.utcnow().timestamp(),
+            ),
+        )
+    return subreddit_metrics
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subreddits", type=int, default=50000)
+    parser.add_argument("--without-posts", type=float, default=0.2)
+    args = parser.parse_args()
+
+    all_subreddits = [f"subreddit{i}" for i in range(args.subreddits)]
+    num_with_posts = int(len(all_subreddits) * (1 - args.without_posts))
+    metrics_df = generate_metrics_df(all_subreddits[:num_with_posts])
+    date = Date(2023, 7, 28)
+
+    conversions = {
+        "iterrows": lambda: convert_with_iterrows(metrics_df, date, set(all_subreddits)),
+        "validated": lambda: get_subreddit_metrics_list_from_metrics_df(metrics_df, date, set(all_subreddits)),
+        "constructed": lambda: get_subreddit_metrics_list_from_metrics_df(
+            metrics_df,
+            date,
+            set(all_subreddits),
+            validate=False,
+        ),
+    }
+    for name, convert in conversions.items():
+        start = time.perf_counter()
+        metrics_list = convert()
+        seconds = time.perf_counter() - start
+        print(f"{name:>11}: {len(metrics_list)} subreddits in {seconds:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compares the PRAW listing path of RedditClient against the raw JSON listing path,
+offline, on generated listing pages: CPU time per post and number of requests.
+
+Usage: python3 benchmarks/bench_reddit_listing.py [--posts 5000] [--without-awards]
+
+--without-awards drops total_awards_received from the listing JSON, which makes
+PRAW fetch every Submission lazily when the attribute is read.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+from common.reddit_client import RedditClient  # noqa: E402
+
+
+def generate_posts(num_posts: int, with_awards: bool) -> list[dict]:
+    newest_created_utc = datetime(2023, 7, 28, 23).timestamp()
+    posts = []
+    for i in range(num_posts):
+        post = {
+            "id": f"p{i}",
+            "name": f"t3_p{i}",
+            "title": f"Post title number {i}",
+            "selftext": "Some body text " * 10,
+            "subreddit": "benchmark",
+            "upvote_ratio": 0.9,
+            "ups": i % 100,
+            "downs": 0,
+            "num_comments": i % 10,
+            "created_utc": newest_created_utc - i * 10,
+        }
+        if with_awards:
+            post["total_awards_received"] = 0
+        posts.append(post)
+    return posts
+
+
+class FakePrawCore:
+    """Stands in for the prawcore session of a Reddit instance, counting requests"""
+
+    def __init__(self, posts: list[dict]):
+        self.posts = posts
+        self.id_to_index = {post["id"]: i for i, post in enumerate(posts)}
+        self.num_requests = 0
+
+    def _listing(self, posts: list[dict]) -> dict:
+        after = posts[-1]["name"] if posts else None
+        return {
+            "kind": "Listing",
+            "data": {"after": after, "children": [{"kind": "t3", "data": dict(post)} for post in posts]},
+        }
+
+    def request(self, method, path, params=None, **kwargs):
+        self.num_requests += 1
+        params = params or {}
+        if path.startswith("comments/"):
+            post = dict(self.posts[self.id_to_index[path.split("/")[1]]], total_awards_received=0)
+            return [self._listing([post]), self._listing([])]
+
+        start = 0
+        if params.get("after"):
+            start = self.id_to_index[params["after"].removeprefix("t3_")] + 1
+        end = start + int(params.get("limit", 100))
+        return self._listing(self.posts[start:end])
+
+
+def run(posts: list[dict], raw_listings: bool) -> tuple[float, int, int]:
+    reddit_client = RedditClient(
+        reddit_client_id="client_id",
+        reddit_client_secret="client_secret",
+        reddit_user_agent="UserAgent",
+        raw_listings=raw_listings,
+    )
+    fake_core = FakePrawCore(posts)
+    reddit_client.reddit_client._core = fake_core
+
+    start = time.process_time()
+    submissions = reddit_client._fetch_submissions_made_since("benchmark", datetime(2000, 1, 1).date())
+    cpu_seconds = time.process_time() - start
+    return cpu_seconds, len(submissions), fake_core.num_requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--without-awards", action="store_true")
+    args = parser.parse_args()
+
+    posts = generate_posts(args.posts, with_awards=not args.without_awards)
+    for name, raw_listings in (("praw", False), ("raw json", True)):
+        cpu_seconds, num_posts, num_requests = run(posts, raw_listings)
+        print(
+            f"{name:>8}: {num_posts} posts, {num_requests} requests, "
+            f"{cpu_seconds * 1e6 / max(num_posts, 1):.1f} us CPU per post",
+        )
+
+
+if __name__ == "__main__":
+    main()
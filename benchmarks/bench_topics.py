@@ -0,0 +1,95 @@
+"""
+Times compute_common_topics on generated posts against the whole of calculate_subreddit_metrics,
+with an NLP client that answers instantly, and reports the peak memory allocated by topic extraction.
+
+Usage: python3 benchmarks/bench_topics.py [--subreddits 50] [--posts-per-subreddit 2000]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date as Date
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+for env_var in (
+    "REDDIT_CLIENT_ID",
+    "REDDIT_CLIENT_SECRET",
+    "SUBREDDITS",
+    "HUGGINGFACE_TOKEN",
+    "GCS_RAW_BUCKET_NAME",
+    "GCS_TRANSFORMED_BUCKET_NAME",
+    "BIGQUERY_DATASET_ID",
+    "BIGQUERY_TABLE_ID",
+):
+    os.environ.setdefault(env_var, "benchmark")
+
+import transform  # noqa: E402
+from common.nlp_client import AbstractNLPClient  # noqa: E402
+from common.topics import DocumentFrequencyIndex  # noqa: E402
+
+
+class ConstantNLPClient(AbstractNLPClient):
+    def compute_sentiment_scores(self, texts: list[str]) -> list[float]:
+        return [0.0] * len(texts)
+
+
+def generate_posts_df(num_subreddits: int, posts_per_subreddit: int) -> pd.DataFrame:
+    random.seed(0)
+    common_words = [f"word{i}" for i in range(5000)]
+    rows = []
+    for s in range(num_subreddits):
+        subreddit_words = [f"sub{s}term{i}" for i in range(50)]
+        for p in range(posts_per_subreddit):
+            title = " ".join(random.choices(common_words, k=8) + random.choices(subreddit_words, k=2))
+            body = " ".join(random.choices(common_words, k=40) + random.choices(subreddit_words, k=5))
+            rows.append(
+                {
+                    "post_id": f"{s}-{p}",
+                    "title": title,
+                    "body": body,
+                    "subreddit": f"subreddit{s}",
+                    "upvotes": p % 100,
+                    "downvotes_estimated": p % 10,
+                    "date": Date(2023, 7, 28),
+                },
+            )
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subreddits", type=int, default=50)
+    parser.add_argument("--posts-per-subreddit", type=int, default=2000)
+    args = parser.parse_args()
+
+    reddit_posts_df = generate_posts_df(args.subreddits, args.posts_per_subreddit)
+    print(f"{len(reddit_posts_df)} posts in {args.subreddits} subreddits")
+
+    start = time.perf_counter()
+    transform.compute_common_topics(reddit_posts_df, DocumentFrequencyIndex.empty(max_terms=50000))
+    topics_seconds = time.perf_counter() - start
+
+    # Traced separately, as tracing slows down allocations
+    tracemalloc.start()
+    transform.compute_common_topics(reddit_posts_df, DocumentFrequencyIndex.empty(max_terms=50000))
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    transform.calculate_subreddit_metrics(ConstantNLPClient(), reddit_posts_df)
+    metrics_seconds = time.perf_counter() - start
+
+    print(f"compute_common_topics:       {topics_seconds:.3f} s, peak {peak_bytes / 2**20:.1f} MiB")
+    print(f"calculate_subreddit_metrics: {metrics_seconds:.3f} s (including topics)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,30 @@
 from __future__ import annotations
 
 import json
+import uuid
 from abc import ABC
 from abc import abstractmethod
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from typing import Optional
 
 from common import logger
+from common.client_registry import get_bigquery_client
+from common.client_registry import get_gcs_client
+from common.client_registry import table_metadata_cache
 from google.api_core.exceptions import BadRequest
+from google.api_core.exceptions import GoogleAPICallError
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
+from google.cloud import storage
+
+
+# How long a staging table outlives a load that failed before deleting it
+STAGING_TABLE_EXPIRATION = timedelta(hours=1)
+# Prefix of the newline-delimited JSON objects that rows are batch loaded from. Load is only
+# triggered by objects holding a day of data, so these don't trigger it.
+STAGING_OBJECT_PREFIX = "_staging/"
 
 
 class BigQueryInsertError(Exception):
@@ -35,10 +53,46 @@ class BigQueryClient(AbstractBigQueryClient):
     Wrapper class for the Google BigQuery Client.
     Provides an idempotent insert_rows method that will insert non-duplicate rows,
     and update duplicate rows.
+
+    With the "update" upsert strategy, duplicate rows are looked up and updated with an UPDATE
+    job each, and the other rows are streamed in. With the "merge" strategy, all rows are loaded
+    into a staging table with one load job, and applied with a single MERGE job.
+
+    With the "stream" insert mode, rows are sent in the API requests. With the "batch" insert
+    mode, which needs the "merge" strategy, rows are written to staging_bucket_name as
+    newline-delimited JSON, and batch loaded from there into the staging table.
+
+    The process-wide BigQuery and storage clients are used unless clients are given, and table
+    metadata is reused across clients for a few minutes.
     """
 
-    def __init__(self):
-        self.bigquery_client = bigquery.Client()
+    def __init__(
+        self,
+        bigquery_client: Optional[bigquery.Client] = None,
+        upsert_strategy: str = "update",
+        insert_mode: str = "stream",
+        staging_bucket_name: Optional[str] = None,
+        gcs_client: Optional[storage.Client] = None,
+    ):
+        if upsert_strategy not in ("update", "merge"):
+            raise ValueError(f"Invalid upsert strategy {upsert_strategy}")
+        if insert_mode not in ("stream", "batch"):
+            raise ValueError(f"Invalid insert mode {insert_mode}")
+        if insert_mode == "batch" and (upsert_strategy != "merge" or staging_bucket_name is None):
+            raise ValueError("The batch insert mode needs the merge upsert strategy and a staging bucket")
+        self.bigquery_client = bigquery_client or get_bigquery_client()
+        self.upsert_strategy = upsert_strategy
+        self.insert_mode = insert_mode
+        self.staging_bucket_name = staging_bucket_name
+        if insert_mode == "batch":
+            self.gcs_client = gcs_client or get_gcs_client()
+
+    def _get_table(self, project_id: str, dataset_id: str, table_id: str) -> bigquery.Table:
+        table_path = f"{project_id}.{dataset_id}.{table_id}"
+        return table_metadata_cache.get(
+            (self.bigquery_client, table_path),
+            lambda: self.bigquery_client.get_table(table_path),
+        )
 
     def _format_value(self, value):
         if value is None:
@@ -98,6 +152,30 @@ class BigQueryClient(AbstractBigQueryClient):
                 non_duplicate_rows_dicts.append(row_dict)
         return non_duplicate_rows_dicts
 
+    def _get_query_parameter_type(self, field: bigquery.SchemaField) -> str:
+        """Standard SQL type of a column, whose schema may use legacy SQL type names"""
+        legacy_to_standard_type = {"INTEGER": "INT64", "FLOAT": "FLOAT64", "BOOLEAN": "BOOL", "RECORD": "STRUCT"}
+        return legacy_to_standard_type.get(field.field_type, field.field_type)
+
+    def _get_partition_filter(
+        self,
+        table: bigquery.Table,
+        row_dicts: list[dict],
+        key_columns: list[str],
+    ) -> Optional[tuple[str, bigquery.ArrayQueryParameter]]:
+        """
+        Partitioning column of table and a @partition_values parameter holding its values in row_dicts,
+        if table is partitioned on a key column. A filter on the partitioning column by itself
+        is needed for BigQuery to prune partitions.
+        """
+        partitioning_col = table.time_partitioning.field if table.time_partitioning else None
+        if partitioning_col not in key_columns:
+            return None
+        field = next(field for field in table.schema if field.name == partitioning_col)
+        partition_values = sorted({row_dict[partitioning_col] for row_dict in row_dicts}, key=repr)
+        parameter_type = self._get_query_parameter_type(field)
+        return partitioning_col, bigquery.ArrayQueryParameter("partition_values", parameter_type, partition_values)
+
     def _get_duplicate_rows(
         self,
         project_id: str,
@@ -106,23 +184,46 @@ class BigQueryClient(AbstractBigQueryClient):
         row_dicts: list[dict],
         key_columns: list[str],
     ) -> list[dict]:
-        col_to_values: dict[str, list] = {col: [] for col in key_columns}
-        for row_dict in row_dicts:
-            for col in key_columns:
-                col_to_values[col].append(row_dict[col])
-        col_to_values_string: dict[str, str] = {
-            col: ", ".join(f"'{value}'" if type(value) == str else str(value) for value in values)
-            for col, values in col_to_values.items()
-        }
+        """
+        Key columns of the table's rows whose keys match those of row_dicts. Keys are matched as
+        exact tuples passed as a query parameter, and if the table is partitioned on a key column,
+        only the partitions of the rows' keys are scanned.
+        """
+        table = self._get_table(project_id, dataset_id, table_id)
+        col_to_field = {field.name: field for field in table.schema}
+        keys = {tuple(row_dict[col] for col in key_columns) for row_dict in row_dicts}
+        query_parameters = [
+            bigquery.ArrayQueryParameter(
+                "keys",
+                "STRUCT",
+                [
+                    bigquery.StructQueryParameter(
+                        None,
+                        *(
+                            bigquery.ScalarQueryParameter(col, self._get_query_parameter_type(col_to_field[col]), value)
+                            for col, value in zip(key_columns, key)
+                        ),
+                    )
+                    for key in sorted(keys, key=repr)
+                ],
+            ),
+        ]
+        where_statements = [f"({', '.join(key_columns)}) IN UNNEST(@keys)"]
+
+        partition_filter = self._get_partition_filter(table, row_dicts, key_columns)
+        if partition_filter is not None:
+            partitioning_col, partition_values_parameter = partition_filter
+            query_parameters.append(partition_values_parameter)
+            where_statements.insert(0, f"{partitioning_col} IN UNNEST(@partition_values)")
 
-        where_statements = [f"{col} IN ({values})" for col, values in col_to_values_string.items()]
         where_statement = " AND ".join(where_statements)
         query = f"""
-            SELECT *
+            SELECT {", ".join(key_columns)}
             FROM `{project_id}.{dataset_id}.{table_id}`
             WHERE {where_statement};
         """
-        query_results_iter = self.bigquery_client.query(query).result()
+        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+        query_results_iter = self.bigquery_client.query(query, job_config=job_config).result()
         duplicate_row_dicts = [dict(row) for row in query_results_iter]
         return json.loads(json.dumps(duplicate_row_dicts, default=str))
 
@@ -134,7 +235,7 @@ class BigQueryClient(AbstractBigQueryClient):
         row_dicts: list[dict],
     ) -> None:
         table_ref = self.bigquery_client.dataset(dataset_id).table(table_id)
-        table = self.bigquery_client.get_table(table_ref)
+        table = self._get_table(project_id, dataset_id, table_id)
         errors = self.bigquery_client.insert_rows(
             table_ref,
             row_dicts,
@@ -143,6 +244,141 @@ class BigQueryClient(AbstractBigQueryClient):
         if errors:
             raise BigQueryInsertError(errors)
 
+    def _get_load_row_dict(self, row_dict: dict, schema: list[bigquery.SchemaField]) -> dict:
+        """
+        Row as loaded from JSON. Streaming inserts accept epoch seconds for TIMESTAMP columns,
+        but loads need them as timestamp strings.
+        """
+        load_row_dict = {field.name: row_dict[field.name] for field in schema}
+        for field in schema:
+            value = load_row_dict[field.name]
+            if field.field_type == "TIMESTAMP" and isinstance(value, (int, float)):
+                load_row_dict[field.name] = datetime.fromtimestamp(value, timezone.utc).isoformat()
+        return load_row_dict
+
+    def _create_staging_table(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        columns: list[str],
+    ) -> bigquery.Table:
+        """Creates an empty table with the given columns of table_id, which expires if it isn't deleted"""
+        table = self._get_table(project_id, dataset_id, table_id)
+        staging_table = bigquery.Table(
+            f"{project_id}.{dataset_id}.{table_id}_staging_{uuid.uuid4().hex}",
+            schema=[field for field in table.schema if field.name in columns],
+        )
+        staging_table.expires = datetime.now(timezone.utc) + STAGING_TABLE_EXPIRATION
+        return self.bigquery_client.create_table(staging_table)
+
+    def _load_rows_into_staging_table(self, staging_table: bigquery.Table, row_dicts: list[dict]) -> None:
+        job_config = bigquery.LoadJobConfig(
+            schema=staging_table.schema,
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
+        load_row_dicts = [self._get_load_row_dict(row_dict, staging_table.schema) for row_dict in row_dicts]
+        self.bigquery_client.load_table_from_json(load_row_dicts, staging_table, job_config=job_config).result()
+
+    def _batch_load_rows_into_staging_table(self, staging_table: bigquery.Table, row_dicts: list[dict]) -> None:
+        """Writes the rows to the staging bucket, and loads them from there with a batch load job"""
+        job_config = bigquery.LoadJobConfig(
+            schema=staging_table.schema,
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
+        ndjson = "".join(
+            json.dumps(self._get_load_row_dict(row_dict, staging_table.schema)) + "\n" for row_dict in row_dicts
+        )
+        bucket = self.gcs_client.bucket(self.staging_bucket_name)
+        blob = bucket.blob(f"{STAGING_OBJECT_PREFIX}{staging_table.table_id}.json")
+        blob.upload_from_string(ndjson, content_type="application/x-ndjson")
+        try:
+            source_uri = f"gs://{self.staging_bucket_name}/{blob.name}"
+            self.bigquery_client.load_table_from_uri(source_uri, staging_table, job_config=job_config).result()
+        finally:
+            try:
+                blob.delete()
+            except NotFound:
+                pass
+
+    def _get_merge_query(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        staging_table_id: str,
+        columns: list[str],
+        key_columns: list[str],
+        partitioning_col: Optional[str] = None,
+    ) -> str:
+        """
+        If partitioning_col is given, only the target partitions in @partition_values are matched,
+        so that the MERGE scans the partitions of the staged rows rather than the whole table
+        """
+        on_statements = [f"target.{col} = source.{col}" for col in key_columns]
+        if partitioning_col is not None:
+            on_statements.insert(0, f"target.{partitioning_col} IN UNNEST(@partition_values)")
+        on_statement = " AND ".join(on_statements)
+        set_statement = ", ".join(f"{col} = source.{col}" for col in columns)
+        columns_statement = ", ".join(columns)
+        values_statement = ", ".join(f"source.{col}" for col in columns)
+        return f"""
+            MERGE `{project_id}.{dataset_id}.{table_id}` AS target
+            USING `{project_id}.{dataset_id}.{staging_table_id}` AS source
+            ON {on_statement}
+            WHEN MATCHED THEN
+                UPDATE SET {set_statement}
+            WHEN NOT MATCHED THEN
+                INSERT ({columns_statement}) VALUES ({values_statement});
+        """
+
+    def _merge_rows(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        row_dicts: list[dict],
+        key_columns: list[str],
+    ) -> None:
+        # MERGE fails if a table row matches several staged rows, so only the last row of each key is kept
+        key_to_row_dict = {tuple(row_dict[col] for col in key_columns): row_dict for row_dict in row_dicts}
+        row_dicts = list(key_to_row_dict.values())
+        if len(row_dicts) == 0:
+            return
+        columns = list(row_dicts[0])
+
+        try:
+            staging_table = self._create_staging_table(project_id, dataset_id, table_id, columns)
+            try:
+                if self.insert_mode == "batch":
+                    self._batch_load_rows_into_staging_table(staging_table, row_dicts)
+                else:
+                    self._load_rows_into_staging_table(staging_table, row_dicts)
+                partition_filter = self._get_partition_filter(
+                    self._get_table(project_id, dataset_id, table_id),
+                    row_dicts,
+                    key_columns,
+                )
+                query = self._get_merge_query(
+                    project_id=project_id,
+                    dataset_id=dataset_id,
+                    table_id=table_id,
+                    staging_table_id=staging_table.table_id,
+                    columns=[field.name for field in staging_table.schema],
+                    key_columns=key_columns,
+                    partitioning_col=partition_filter[0] if partition_filter else None,
+                )
+                job_config = bigquery.QueryJobConfig(
+                    query_parameters=[partition_filter[1]] if partition_filter else [],
+                )
+                self.bigquery_client.query(query, job_config=job_config).result()
+            finally:
+                self.bigquery_client.delete_table(staging_table, not_found_ok=True)
+        except GoogleAPICallError as e:
+            raise BigQueryInsertError(e) from e
+
     def insert_rows(
         self,
         project_id: str,
@@ -151,6 +387,16 @@ class BigQueryClient(AbstractBigQueryClient):
         row_dicts: list[dict],
         enforce_unique_on: list[str],
     ) -> None:
+        if self.upsert_strategy == "merge":
+            self._merge_rows(
+                project_id=project_id,
+                dataset_id=dataset_id,
+                table_id=table_id,
+                row_dicts=row_dicts,
+                key_columns=enforce_unique_on,
+            )
+            return
+
         duplicate_row_dicts = self._get_duplicate_rows(
             project_id=project_id,
             dataset_id=dataset_id,
@@ -166,12 +412,17 @@ class BigQueryClient(AbstractBigQueryClient):
         if len(duplicate_row_dicts) + len(non_duplicate_row_dicts) > len(row_dicts):
             logger.warning("Pre-existing duplicate rows were found. Consider running a deduplication script.")
 
-        if duplicate_row_dicts:
+        # The table's rows are updated with the values of the incoming rows with the same keys
+        duplicate_keys = {tuple(row_dict[col] for col in enforce_unique_on) for row_dict in duplicate_row_dicts}
+        updated_row_dicts = [
+            row_dict for row_dict in row_dicts if tuple(row_dict[col] for col in enforce_unique_on) in duplicate_keys
+        ]
+        if updated_row_dicts:
             self._update_rows(
                 project_id=project_id,
                 dataset_id=dataset_id,
                 table_id=table_id,
-                row_dicts=duplicate_row_dicts,
+                row_dicts=updated_row_dicts,
                 key_columns=enforce_unique_on,
             )
         if non_duplicate_row_dicts:
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable
+from typing import Generic
+from typing import Hashable
+from typing import TypeVar
+
+from google.cloud import storage
+
+
+T = TypeVar("T")
+
+# How long bucket and table metadata is reused before it is fetched again
+METADATA_TTL_SECONDS = 300.0
+
+
+class ClientRegistry:
+    """
+    Clients created on first use and reused by every later request the process serves,
+    so warm instances skip creating clients, opening connections and refreshing credentials
+    """
+
+    def __init__(self):
+        self._name_to_client: dict[str, object] = {}
+        # Reentrant, so creating a client can get the clients it is built from
+        self._lock = threading.RLock()
+
+    def get(self, name: str, create: Callable[[], T]) -> T:
+        with self._lock:
+            if name not in self._name_to_client:
+                self._name_to_client[name] = create()
+            return self._name_to_client[name]  # type: ignore
+
+    def clear(self) -> None:
+        with self._lock:
+            self._name_to_client.clear()
+
+
+class TTLCache(Generic[T]):
+    """Values loaded on first use, and loaded again once they are older than ttl_seconds"""
+
+    def __init__(self, ttl_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._key_to_entry: dict[Hashable, tuple[float, T]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load: Callable[[], T]) -> T:
+        now = self.clock()
+        with self._lock:
+            entry = self._key_to_entry.get(key)
+        if entry is not None and now - entry[0] < self.ttl_seconds:
+            return entry[1]
+        # Loaded without holding the lock, so a slow load doesn't block other keys
+        value = load()
+        with self._lock:
+            self._key_to_entry[key] = (now, value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._key_to_entry.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._key_to_entry.clear()
+
+
+client_registry = ClientRegistry()
+bucket_metadata_cache: TTLCache = TTLCache(METADATA_TTL_SECONDS)
+table_metadata_cache: TTLCache = TTLCache(METADATA_TTL_SECONDS)
+
+
+def get_gcs_client() -> storage.Client:
+    return client_registry.get("gcs", storage.Client)
+
+
+def get_bigquery_client():
+    from google.cloud import bigquery  # Only the load stage installs BigQuery
+
+    return client_registry.get("bigquery", bigquery.Client)
@@ -5,15 +5,63 @@ import os
 REDDIT_CLIENT_ID = os.environ["REDDIT_CLIENT_ID"]
 REDDIT_CLIENT_SECRET = os.environ["REDDIT_CLIENT_SECRET"]
 REDDIT_USER_AGENT = "UniversitySubreddits"
+REDDIT_CLIENT_BACKEND = os.environ.get("REDDIT_CLIENT_BACKEND", "praw")  # "praw" or "async"
+REDDIT_RAW_LISTINGS = os.environ.get("REDDIT_RAW_LISTINGS", "false").lower() == "true"
+REDDIT_REQUESTS_PER_MINUTE = int(os.environ.get("REDDIT_REQUESTS_PER_MINUTE", "90"))
+
+# Listing cache is disabled unless a directory is set. Cloud Run's filesystem is in memory,
+# so REDDIT_CACHE_MAX_BYTES counts against the instance's memory limit.
+REDDIT_CACHE_DIR = os.environ.get("REDDIT_CACHE_DIR")
+REDDIT_CACHE_MODE = os.environ.get("REDDIT_CACHE_MODE", "revalidate")  # "revalidate", "record" or "replay"
+REDDIT_CACHE_FRESH_SECONDS = float(os.environ.get("REDDIT_CACHE_FRESH_SECONDS", "3600"))
+REDDIT_CACHE_MAX_AGE_SECONDS = float(os.environ.get("REDDIT_CACHE_MAX_AGE_SECONDS", str(2 * 24 * 3600)))
+REDDIT_CACHE_MAX_BYTES = int(os.environ.get("REDDIT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
 
 SUBREDDITS = os.environ["SUBREDDITS"].split(",")
+EXTRACT_MAX_WORKERS = int(os.environ.get("EXTRACT_MAX_WORKERS", "8"))
+EXTRACT_STREAMING = os.environ.get("EXTRACT_STREAMING", "false").lower() == "true"
 
 GCS_RAW_BUCKET_NAME = os.environ["GCS_RAW_BUCKET_NAME"]
 GCS_TRANSFORMED_BUCKET_NAME = os.environ["GCS_TRANSFORMED_BUCKET_NAME"]
+# Format objects are written in, "json" or "parquet". Objects in either format are read.
+STORAGE_FORMAT = os.environ.get("STORAGE_FORMAT", "json")
+# "stdlib" writes the same bytes as always, "orjson" writes compact JSON faster
+JSON_CODEC = os.environ.get("JSON_CODEC", "stdlib")
+# Compression of JSON objects, "none", "gzip" or "zstd". Compressed objects of either kind are read.
+STORAGE_COMPRESSION = os.environ.get("STORAGE_COMPRESSION", "none")
 
 BIGQUERY_PROJECT_ID = "university-subreddits"
 BIGQUERY_DATASET_ID = os.environ["BIGQUERY_DATASET_ID"]
 BIGQUERY_TABLE_ID = os.environ["BIGQUERY_TABLE_ID"]
+# "update" runs an UPDATE job per existing row, "merge" upserts all rows with one MERGE job
+BIGQUERY_UPSERT_STRATEGY = os.environ.get("BIGQUERY_UPSERT_STRATEGY", "update")
+# "stream" sends rows in API requests, "batch" loads them from GCS_TRANSFORMED_BUCKET_NAME.
+# "batch" needs the "merge" upsert strategy.
+BIGQUERY_INSERT_MODE = os.environ.get("BIGQUERY_INSERT_MODE", "stream")
+# Transformed objects downloaded at once when loading several days
+LOAD_MAX_WORKERS = int(os.environ.get("LOAD_MAX_WORKERS", "8"))
+# Days a single /load_range or /load_objects call can load, as they are upserted with one job
+LOAD_MAX_DAYS = int(os.environ.get("LOAD_MAX_DAYS", "31"))
 
 HUGGINGFACE_TOKEN = os.environ["HUGGINGFACE_TOKEN"]
 HUGGINGFACE_MODEL = "finiteautomata/bertweet-base-sentiment-analysis"
+HUGGINGFACE_BATCH_SIZE = int(os.environ.get("HUGGINGFACE_BATCH_SIZE", "32"))
+HUGGINGFACE_MAX_CONCURRENT_REQUESTS = int(os.environ.get("HUGGINGFACE_MAX_CONCURRENT_REQUESTS", "4"))
+
+# "local" runs HUGGINGFACE_MODEL in-process on CPU instead of calling the inference API
+NLP_BACKEND = os.environ.get("NLP_BACKEND", "huggingface")  # "huggingface", "local" or "google"
+LOCAL_NLP_BATCH_SIZE = int(os.environ.get("LOCAL_NLP_BATCH_SIZE", "32"))
+LOCAL_NLP_QUANTIZE = os.environ.get("LOCAL_NLP_QUANTIZE", "false").lower() == "true"
+GOOGLE_NLP_MAX_CONCURRENT_REQUESTS = int(os.environ.get("GOOGLE_NLP_MAX_CONCURRENT_REQUESTS", "16"))
+GOOGLE_NLP_REQUESTS_PER_MINUTE = int(os.environ.get("GOOGLE_NLP_REQUESTS_PER_MINUTE", "600"))
+
+TOPICS_PER_SUBREDDIT = int(os.environ.get("TOPICS_PER_SUBREDDIT", "5"))
+TOPICS_VOCABULARY_SIZE = int(os.environ.get("TOPICS_VOCABULARY_SIZE", "50000"))
+# Days a single /reaggregate call can reaggregate, as it runs within one request
+REAGGREGATE_MAX_DAYS = int(os.environ.get("REAGGREGATE_MAX_DAYS", "31"))
+
+# Sentiment scores are cached in memory for the lifetime of the instance, and on disk if a path is set
+SENTIMENT_CACHE_MEMORY_ENTRIES = int(os.environ.get("SENTIMENT_CACHE_MEMORY_ENTRIES", "100000"))
+SENTIMENT_CACHE_PATH = os.environ.get("SENTIMENT_CACHE_PATH")
+SENTIMENT_CACHE_MAX_AGE_SECONDS = float(os.environ.get("SENTIMENT_CACHE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+SENTIMENT_CACHE_MAX_ENTRIES = int(os.environ.get("SENTIMENT_CACHE_MAX_ENTRIES", "1000000"))
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+from urllib.parse import urlparse
+
+import requests
+from common.rate_limiter import RateLimiter
+from requests.structures import CaseInsensitiveDict
+
+
+LISTING_PATH_PATTERN = re.compile(r"/r/([^/]+)/new(?:\.json)?/?")
+ACCESS_TOKEN_PATH = "/api/v1/access_token"
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class ListingCache:
+    """
+    On-disk cache of Reddit listing pages, keyed by subreddit and query string.
+    Entries older than max_age_seconds are evicted, then the oldest entries
+    until the cache fits in max_bytes.
+
+    The size of the cache is tracked as entries are put, so the directory is only scanned
+    once the cache outgrows max_bytes or eviction_interval_seconds have passed since the last scan.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_age_seconds: float,
+        max_bytes: int,
+        eviction_interval_seconds: float = 60,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.eviction_interval_seconds = eviction_interval_seconds
+        self._eviction_lock = threading.Lock()
+        self._total_bytes = 0
+        self._last_eviction_time = 0.0
+
+    def _get_path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._get_path(key)
+        try:
+            entry = json.loads(path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if time.time() - entry["stored_at"] > self.max_age_seconds:
+            path.unlink(missing_ok=True)
+            return None
+        return entry
+
+    def put(self, key: str, etag: Optional[str], headers: dict, body: str) -> None:
+        entry = {"stored_at": time.time(), "etag": etag, "headers": headers, "body": body}
+        path = self._get_path(key)
+        # Write to a temporary file first so that concurrent readers never see a partial entry
+        with tempfile.NamedTemporaryFile("w", dir=self.directory, suffix=".tmp", delete=False) as file:
+            json.dump(entry, file)
+        try:
+            replaced_bytes = path.stat().st_size
+        except FileNotFoundError:
+            replaced_bytes = 0
+        os.replace(file.name, path)
+
+        with self._eviction_lock:
+            self._total_bytes += os.path.getsize(path) - replaced_bytes
+            should_evict = (
+                self._total_bytes > self.max_bytes
+                or time.time() - self._last_eviction_time > self.eviction_interval_seconds
+            )
+        if should_evict:
+            self.evict()
+
+    def touch(self, key: str) -> None:
+        """Marks an entry as fresh after the server confirmed it is unchanged"""
+        entry = self.get(key)
+        if entry is not None:
+            self.put(key, entry["etag"], entry["headers"], entry["body"])
+
+    def evict(self) -> None:
+        """Scans the whole directory, which also corrects the tracked size for entries other processes put"""
+        with self._eviction_lock:
+            now = time.time()
+            self._last_eviction_time = now
+            entries = []
+            for path in self.directory.glob("*.json"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.max_age_seconds:
+                    path.unlink(missing_ok=True)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total_bytes -= size
+            self._total_bytes = total_bytes
+
+
+def is_access_token_request(request: requests.PreparedRequest) -> bool:
+    return request.url is not None and urlparse(request.url).path == ACCESS_TOKEN_PATH
+
+
+class RateLimitedSession(requests.Session):
+    """requests session that waits for rate_limiter before every API request it sends"""
+
+    def __init__(self, rate_limiter: Optional[RateLimiter] = None):
+        super().__init__()
+        self.rate_limiter = rate_limiter
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        # The OAuth token request is not counted against the API quota
+        if self.rate_limiter is not None and not is_access_token_request(request):
+            self.rate_limiter.acquire()
+        return super().send(request, **kwargs)
+
+
+class CachingSession(RateLimitedSession):
+    """
+    requests session that serves Reddit listing pages from a ListingCache.
+
+    Modes:
+    - "revalidate": pages younger than fresh_seconds are served from the cache, older ones are
+      revalidated with If-None-Match and served from the cache if Reddit answers 304 Not Modified.
+    - "record": every page is fetched from Reddit and stored.
+    - "replay": pages are only served from the cache, and a miss raises CacheMissError. The OAuth
+      token request is answered locally, so a replayed run needs no network at all.
+
+    Only requests that reach Reddit wait for rate_limiter, so pages served from the cache are not throttled.
+    """
+
+    def __init__(
+        self,
+        cache: ListingCache,
+        mode: str = "revalidate",
+        fresh_seconds: float = 0,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        super().__init__(rate_limiter)
+        if mode not in ("revalidate", "record", "replay"):
+            raise ValueError(f"Invalid cache mode {mode}")
+        self.cache = cache
+        self.mode = mode
+        self.fresh_seconds = fresh_seconds
+
+    def _get_cache_key(self, request: requests.PreparedRequest) -> Optional[str]:
+        if request.method != "GET" or request.url is None:
+            return None
+        url = urlparse(request.url)
+        match = LISTING_PATH_PATTERN.fullmatch(url.path)
+        if match is None:
+            return None
+        subreddit = match.group(1).lower()
+        # Sorted, so the same parameters in a different order share an entry
+        query = urlencode(sorted(parse_qsl(url.query)))
+        return f"{subreddit}?{query}"
+
+    def _build_response(self, request: requests.PreparedRequest, status_code: int, headers: dict, body: str):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = body.encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url or ""
+        response.request = request
+        return response
+
+    def _store(self, cache_key: str, response: requests.Response) -> None:
+        headers = {"Content-Type": response.headers.get("Content-Type", "application/json")}
+        self.cache.put(cache_key, response.headers.get("ETag"), headers, response.text)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if self.mode == "replay" and is_access_token_request(request):
+            token = {"access_token": "replay", "token_type": "bearer", "expires_in": 86400, "scope": "*"}
+            return self._build_response(request, 200, {"Content-Type": "application/json"}, json.dumps(token))
+
+        cache_key = self._get_cache_key(request)
+        if cache_key is None:
+            return super().send(request, **kwargs)
+
+        entry = self.cache.get(cache_key) if self.mode != "record" else None
+        if self.mode == "replay":
+            if entry is None:
+                raise CacheMissError(f"No cached page for {cache_key}")
+            return self._build_response(request, 200, entry["headers"], entry["body"])
+
+        if entry is not None:
+            if time.time() - entry["stored_at"] < self.fresh_seconds:
+                return self._build_response(request, 200, entry["headers"], entry["body"])
+            if entry["etag"]:
+                request.headers["If-None-Match"] = entry["etag"]
+
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(cache_key)
+            return self._build_response(request, 200, entry["headers"], entry["body"])
+        if response.status_code == 200:
+            self._store(cache_key, response)
+        return response
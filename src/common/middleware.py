@@ -5,9 +5,12 @@ import logging
 from datetime import date as Date
 from datetime import datetime
 from typing import Callable
+from typing import Optional
+from typing import Union
 
 from common.utils import get_date
 from common.utils import get_default_date_for_extract_call
+from common.utils import is_daily_object_key
 from fastapi import Request
 from fastapi import Response
 
@@ -33,24 +36,52 @@ class LoggingMiddleware:
         await self.set_body(request, body)
         return body
 
-    async def _get_date_to_proceess_for_extract(self, request) -> Date:
-        if "date" in request.query_params:
-            date_string = request.query_params["date"]
+    def _parse_date(self, date_string: str) -> Union[Date, str]:
+        """A malformed date is logged as given, so that the handler can reject it with a 400"""
+        try:
             return datetime.strptime(date_string, "%d/%m/%Y").date()
+        except ValueError:
+            return date_string
+
+    async def _get_date_to_proceess_for_extract(self, request) -> Union[Date, str]:
+        if "start_date" in request.query_params and "end_date" in request.query_params:
+            start_date_string = request.query_params["start_date"]
+            end_date_string = request.query_params["end_date"]
+            start_date = self._parse_date(start_date_string)
+            end_date = self._parse_date(end_date_string)
+            return f"{start_date}..{end_date}"
+        elif "date" in request.query_params:
+            date_string = request.query_params["date"]
+            return self._parse_date(date_string)
         else:
             return get_default_date_for_extract_call()
 
-    async def _get_date_to_proceess_for_transform_or_load(self, request) -> Date:
+    async def _get_date_to_proceess_for_transform_or_load(self, request) -> Union[Date, str]:
         # Workaround for not being able to call request.body() multiple times
         # during the lifetime of a request.
         # https://github.com/tiangolo/fastapi/issues/394#issuecomment-883524819
         await self.set_body(request, await request.body())
         event = json.loads(await self.get_body(request))
+        if "object_keys" in event:  # Several transformed objects loaded at once
+            object_dates = [self._get_object_date(object_key) for object_key in event["object_keys"]]
+            dates = sorted(date for date in object_dates if date is not None)
+            return f"{dates[0]}..{dates[-1]}" if dates else "no days"
         object_id = event["message"]["attributes"]["objectId"]
-        date_to_process = get_date(object_id)
-        return date_to_process
+        return self._get_object_date(object_id) or object_id
+
+    def _get_object_date(self, object_key: str) -> Optional[Date]:
+        """
+        None for keys that don't hold a day of data, including daily keys of impossible dates,
+        so that the handler can reject them with a 400
+        """
+        if not is_daily_object_key(object_key):
+            return None
+        try:
+            return get_date(object_key)
+        except ValueError:
+            return None
 
-    async def _get_date_to_process(self, request: Request) -> Date:
+    async def _get_date_to_process(self, request: Request) -> Union[Date, str]:
         if request.method == "GET":
             return await self._get_date_to_proceess_for_extract(request)
         elif request.method == "POST":
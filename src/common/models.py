@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from datetime import date as Date
+from typing import Dict
 from typing import List
 
 from pydantic import BaseModel
@@ -38,3 +39,27 @@ class SubredditMetrics(AbstractModel):
     transformed_utc: float
     sentiment_score: float
     topics: List[str]
+
+
+class PostSentiment(AbstractModel):
+    """Sentiment score of a post's title, NaN if it could not be scored"""
+
+    post_id: str
+    subreddit: str
+    sentiment_score: float
+
+
+class SubredditWatermark(AbstractModel):
+    """Newest post extracted from a subreddit, made on date"""
+
+    subreddit: str
+    post_id: str
+    created_utc: float
+
+
+class DocumentFrequencies(AbstractModel):
+    """Number of posts containing each term, over the posts of every counted date"""
+
+    num_documents: int
+    counted_dates: List[Date]
+    document_frequencies: Dict[str, int]
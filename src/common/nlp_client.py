@@ -1,14 +1,22 @@
 from __future__ import annotations
 
+import functools
 import json
+import random
+import threading
+import time
 from abc import ABC
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from typing import Union
 
 import requests
+from common.rate_limiter import RateLimiter
 from google.api_core.exceptions import InvalidArgument
+from google.api_core.exceptions import ResourceExhausted
 from google.cloud import language_v1
+from requests.adapters import HTTPAdapter
 
 
 class InferenceRateLimitException(Exception):
@@ -19,6 +27,40 @@ class InferenceException(Exception):
     pass
 
 
+def get_backoff_delay(attempt: int, base_seconds: float, max_seconds: float) -> float:
+    """Exponential backoff with full jitter for the given (0-based) retry attempt"""
+    return random.uniform(0, min(max_seconds, base_seconds * 2**attempt))
+
+
+def compute_integrated_sentiment_score(label_scores: list[dict]) -> float:
+    """
+    Integrates the POS, NEU and NEG scores of a text, given as [{"label": ..., "score": ...}, ...],
+    into one score between -1 and 1
+    """
+    scores = {
+        "NEU": None,
+        "POS": None,
+        "NEG": None,
+    }
+
+    if any(type(res) == str for res in label_scores):
+        raise InferenceException(f"HuggingFace returned an exception: {label_scores}")
+
+    for res in label_scores:
+        label = res["label"]
+        if label in scores:
+            scores[label] = res["score"]
+        else:
+            raise InferenceException(f"Invalid label for HuggingFace response: {res}")
+
+    if any(score is None for score in scores.values()):
+        raise InferenceException(f"Response returned from HuggingFace has a missing score: {label_scores}")
+
+    neu_score, pos_score, neg_score = scores.values()
+    integrated_sentiment_score = (pos_score - neg_score) / (1 - neu_score)  # type: ignore
+    return integrated_sentiment_score
+
+
 class AbstractNLPClient(ABC):
     @abstractmethod
     def compute_sentiment_scores(self, texts: list[str]) -> list[Union[float, None]]:
@@ -26,72 +68,218 @@ class AbstractNLPClient(ABC):
 
 
 class GoogleNLPClient(AbstractNLPClient):
-    def __init__(self) -> None:
-        self.language_client = language_v1.LanguageServiceClient()
+    """
+    Analyzes the sentiment of each text with the Cloud Natural Language API, with up to
+    max_concurrent_requests texts in flight. Requests are throttled by the rate limiter, if given,
+    and retried with exponential backoff and jitter when the quota is exhausted.
+    """
+
+    def __init__(
+        self,
+        language_client: Optional[language_v1.LanguageServiceClient] = None,
+        max_concurrent_requests: int = 16,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_retries: int = 5,
+        backoff_base_seconds: float = 1.0,
+        backoff_max_seconds: float = 60.0,
+    ) -> None:
+        self.language_client = language_client or language_v1.LanguageServiceClient()
+        self.max_concurrent_requests = max_concurrent_requests
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+
+    def _analyze_sentiment(self, document: dict):
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                return self.language_client.analyze_sentiment(
+                    request={"document": document},
+                )
+            except ResourceExhausted:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(get_backoff_delay(attempt, self.backoff_base_seconds, self.backoff_max_seconds))
 
     def _compute_sentiment_score(self, text: str) -> Union[float, None]:
         type_ = language_v1.Document.Type.PLAIN_TEXT
         document = {"type_": type_, "content": text}
         try:
-            response = self.language_client.analyze_sentiment(
-                request={"document": document},
-            )
+            response = self._analyze_sentiment(document)
         except InvalidArgument:  # Text is in a different language
             return None
         sentiment = response.document_sentiment
         return sentiment.score
 
     def compute_sentiment_scores(self, texts: list[str]) -> list[Union[float, None]]:
-        return [self._compute_sentiment_score(text) for text in texts]
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_requests) as executor:
+            return list(executor.map(self._compute_sentiment_score, texts))
 
 
 class HuggingFaceNLPClient(AbstractNLPClient):
-    def __init__(self, model: str, api_token: str) -> None:
+    """
+    Sends texts to the HuggingFace inference API in batches of batch_size, with up to
+    max_concurrent_requests batches in flight over a pooled keep-alive session.
+    Batches that are rate limited, or sent while the model is loading, are retried with
+    exponential backoff and jitter.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        api_token: str,
+        batch_size: int = 32,
+        max_concurrent_requests: int = 4,
+        max_retries: int = 5,
+        backoff_base_seconds: float = 1.0,
+        backoff_max_seconds: float = 60.0,
+    ) -> None:
         self.api_token = api_token
         self.inference_url = f"https://api-inference.huggingface.co/models/{model}"
+        self.batch_size = batch_size
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
 
-    def _parse_huggingface_response_into_float(self, response: list[dict]) -> float:
-        scores = {
-            "NEU": None,
-            "POS": None,
-            "NEG": None,
-        }
-
-        if any(type(res) == str for res in response):
-            raise InferenceException(f"HuggingFace returned an exception: {response}")
-
-        for res in response:
-            label = res["label"]
-            if label in scores:
-                scores[label] = res["score"]
-            else:
-                raise InferenceException(f"Invalid label for HuggingFace response: {res}")
-
-        if any(score is None for score in scores.values()):
-            raise InferenceException(f"Response returned from HuggingFace has a missing score: {response}")
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max_concurrent_requests))
+        self.session.headers.update(
+            {
+                "Authorization": f"Bearer {self.api_token}",
+                "Content-Type": "application/json",
+            },
+        )
 
-        neu_score, pos_score, neg_score = scores.values()
-        integrated_sentiment_score = (pos_score - neg_score) / (1 - neu_score)  # type: ignore
-        return integrated_sentiment_score
+    def _parse_huggingface_response_into_float(self, response: list[dict]) -> float:
+        return compute_integrated_sentiment_score(response)
 
     def _parse_huggingface_responses_into_floats(self, responses: list[list[dict]]) -> list[Optional[float]]:
         return [self._parse_huggingface_response_into_float(response) for response in responses]
 
+    def _is_model_loading(self, response: requests.Response) -> bool:
+        if response.status_code != 503:
+            return False
+        try:
+            body = response.json()
+        except ValueError:
+            return False
+        return isinstance(body, dict) and "loading" in str(body.get("error", ""))
+
+    def _get_retry_delay(self, attempt: int, response: requests.Response) -> float:
+        delay = get_backoff_delay(attempt, self.backoff_base_seconds, self.backoff_max_seconds)
+        if self._is_model_loading(response):
+            # HuggingFace estimates how long the model takes to load
+            estimated_time = response.json().get("estimated_time", 0)
+            delay = max(delay, min(estimated_time, self.backoff_max_seconds))
+        return delay
+
     def _request_for_sentiments(self, texts: list[str]) -> list[list[dict]]:
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "Content-Type": "application/json",
-        }
-        response = requests.post(
-            url=self.inference_url,
-            headers=headers,
-            data=json.dumps(texts).encode("utf-8"),
-        )
+        for attempt in range(self.max_retries + 1):
+            response = self.session.post(
+                url=self.inference_url,
+                data=json.dumps(texts).encode("utf-8"),
+            )
+            should_retry = response.status_code == 429 or self._is_model_loading(response)
+            if not should_retry:
+                return response.json()
+            if attempt < self.max_retries:
+                time.sleep(self._get_retry_delay(attempt, response))
+
         if response.status_code == 429:
             raise InferenceRateLimitException()
-        return response.json()
+        raise InferenceException(f"HuggingFace model is still loading after {self.max_retries} retries")
 
-    def compute_sentiment_scores(self, texts: list[str]) -> list[Optional[float]]:
+    def _compute_sentiment_scores_of_batch(self, texts: list[str]) -> list[Optional[float]]:
         responses = self._request_for_sentiments(texts)
-        sentiment_scores = self._parse_huggingface_responses_into_floats(responses)
-        return sentiment_scores
+        return self._parse_huggingface_responses_into_floats(responses)
+
+    def compute_sentiment_scores(self, texts: list[str]) -> list[Optional[float]]:
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            end = start + self.batch_size
+            batches.append(texts[start:end])
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_requests) as executor:
+            scores_of_each_batch = executor.map(self._compute_sentiment_scores_of_batch, batches)
+            return [score for scores in scores_of_each_batch for score in scores]
+
+
+local_inference_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def load_local_sentiment_model(model: str, quantize: bool) -> tuple:
+    """
+    Loads the tokenizer and model once per process, so that every LocalNLPClient
+    of a worker shares the same warm model
+    """
+    import torch
+    from transformers import AutoModelForSequenceClassification
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model)
+    sequence_classifier = AutoModelForSequenceClassification.from_pretrained(model)
+    sequence_classifier.eval()
+    if quantize:
+        sequence_classifier = torch.ao.quantization.quantize_dynamic(
+            sequence_classifier,
+            {torch.nn.Linear},
+            dtype=torch.qint8,
+        )
+    return tokenizer, sequence_classifier
+
+
+class LocalNLPClient(AbstractNLPClient):
+    """
+    Runs the sentiment model in-process on CPU. Requires the local-nlp extra.
+
+    Texts are sorted by length before being split into batches of batch_size, so that each
+    batch is only padded to the length of its own longest text.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        batch_size: int = 32,
+        quantize: bool = False,
+        max_length: int = 128,
+    ) -> None:
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer, self.model = load_local_sentiment_model(model, quantize)
+
+    def _compute_label_scores_of_batch(self, texts: list[str]) -> list[list[dict]]:
+        import torch
+
+        inputs = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="pt",
+        )
+        with torch.inference_mode():
+            probabilities = torch.softmax(self.model(**inputs).logits, dim=-1).tolist()
+
+        id2label = self.model.config.id2label
+        return [
+            [{"label": id2label[label_id], "score": score} for label_id, score in enumerate(text_probabilities)]
+            for text_probabilities in probabilities
+        ]
+
+    def compute_sentiment_scores(self, texts: list[str]) -> list[Optional[float]]:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        scores: list[Optional[float]] = [None] * len(texts)
+
+        # The model already uses every core, so concurrent callers take turns
+        with local_inference_lock:
+            for start in range(0, len(order), self.batch_size):
+                end = start + self.batch_size
+                batch_indices = order[start:end]
+                label_scores = self._compute_label_scores_of_batch([texts[i] for i in batch_indices])
+                for i, text_label_scores in zip(batch_indices, label_scores):
+                    scores[i] = compute_integrated_sentiment_score(text_label_scores)
+        return scores
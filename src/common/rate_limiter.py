@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Mapping
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Thread-safe request budget shared by every worker of a client.
+
+    Until the API reports its quota, request start times are spaced evenly so that no more
+    than `requests_per_minute` requests are started in any minute. Once update_from_headers
+    has seen Reddit's X-Ratelimit-Remaining and X-Ratelimit-Reset headers, the remaining
+    quota is instead spread evenly over the rest of the rate limit window.
+    """
+
+    def __init__(self, requests_per_minute: float):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive")
+        self.interval = 60 / requests_per_minute
+        self._lock = threading.Lock()
+        self._last_request_time = 0.0
+        self._next_request_time = 0.0
+        self._remaining: Optional[float] = None
+        self._reset_time: Optional[float] = None
+
+        self.num_requests = 0
+        self.num_delayed_requests = 0
+        self.seconds_waited = 0.0
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Updates the remaining quota from the rate limit headers of a response"""
+        remaining = headers.get("x-ratelimit-remaining")
+        reset = headers.get("x-ratelimit-reset")
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            self._remaining = float(remaining)
+            self._reset_time = time.monotonic() + float(reset)
+            # The slot after the last request may have been reserved with a stale interval
+            rescheduled_request_time = self._last_request_time + self._get_interval(self._last_request_time)
+            self._next_request_time = min(self._next_request_time, rescheduled_request_time)
+
+    def _get_earliest_request_time(self, now: float) -> float:
+        if self._remaining is None or self._reset_time is None or now >= self._reset_time:
+            return max(now, self._next_request_time)
+        if self._remaining < 1:
+            # Quota is used up until the window resets, from which on the slots stay spaced,
+            # so that the waiting requests don't all start at once and use up the next window
+            return max(self._reset_time, self._next_request_time)
+        return max(now, self._next_request_time)
+
+    def _get_interval(self, request_time: float) -> float:
+        if self._remaining is None or self._reset_time is None or request_time >= self._reset_time:
+            return self.interval
+        if self._remaining < 1:
+            return self.interval
+        return (self._reset_time - request_time) / self._remaining
+
+    def reserve(self) -> float:
+        """
+        Reserves the next request slot and returns the number of seconds to wait before using it
+        """
+        with self._lock:
+            now = time.monotonic()
+            request_time = self._get_earliest_request_time(now)
+            self._last_request_time = request_time
+            self._next_request_time = request_time + self._get_interval(request_time)
+            if self._remaining is not None:
+                self._remaining -= 1
+
+            delay = request_time - now
+            self.num_requests += 1
+            if delay > 0:
+                self.num_delayed_requests += 1
+                self.seconds_waited += delay
+            return delay
+
+    def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        """
+        Counters of the requests made through the limiter. seconds_waited is summed over
+        all workers, so it can exceed the wall-clock time of a concurrent run.
+        """
+        with self._lock:
+            return {
+                "requests": self.num_requests,
+                "delayed_requests": self.num_delayed_requests,
+                "seconds_waited": self.seconds_waited,
+            }
@@ -1,15 +1,122 @@
 from __future__ import annotations
 
+import asyncio
+import threading
 from abc import ABC
 from abc import abstractmethod
+from contextlib import asynccontextmanager
 from datetime import date as Date
 from datetime import datetime
+from datetime import timedelta
+from typing import AsyncIterator
+from typing import Optional
 
+import httpx
+import requests
 from common import logger
+from common.http_cache import CachingSession
+from common.http_cache import ListingCache
+from common.http_cache import RateLimitedSession
+from common.models import SubredditWatermark
+from common.rate_limiter import RateLimiter
 from praw import Reddit
+from praw.models import Submission
 from prawcore.exceptions import Forbidden
 
 
+def filter_submissions_made_on_date(submissions: list[dict], date: Date) -> list[dict]:
+    """Removes submissions not made on date"""
+    return [
+        submission for submission in submissions if datetime.utcfromtimestamp(submission["created_utc"]).date() == date
+    ]
+
+
+def bucket_submissions_by_date(
+    submissions: list[dict],
+    start_date: Date,
+    end_date: Date,
+) -> dict[Date, list[dict]]:
+    """
+    Splits submissions into one bucket per date from start_date to end_date inclusive.
+    Every date in the range gets a bucket, and submissions outside the range are dropped.
+    """
+    num_days = (end_date - start_date).days + 1
+    date_to_submissions: dict[Date, list[dict]] = {start_date + timedelta(days=i): [] for i in range(num_days)}
+    for submission in submissions:
+        created_date = datetime.utcfromtimestamp(submission["created_utc"]).date()
+        if created_date in date_to_submissions:
+            date_to_submissions[created_date].append(submission)
+    return date_to_submissions
+
+
+def filter_submissions_newer_than_watermark(
+    submissions: list[dict],
+    watermark: Optional[SubredditWatermark],
+) -> list[dict]:
+    """
+    Removes submissions that were already extracted according to watermark.
+    Submissions made in the same second as the watermark are kept, since their order is ambiguous.
+    """
+    if watermark is None:
+        return submissions
+    return [
+        submission
+        for submission in submissions
+        if submission["created_utc"] >= watermark.created_utc and submission["id"] != watermark.post_id
+    ]
+
+
+def should_fetch_more_pages(
+    last_submission: dict,
+    date: Date,
+    watermark: Optional[SubredditWatermark] = None,
+) -> bool:
+    """
+    Whether a newest-first listing walk should continue past a page ending with last_submission:
+    stops once it reaches submissions made before date, or submissions already extracted.
+    """
+    if watermark is not None and last_submission["created_utc"] <= watermark.created_utc:
+        return False
+    last_submission_created_datetime = datetime.utcfromtimestamp(last_submission["created_utc"])
+    return last_submission_created_datetime.date() >= date
+
+
+def parse_listing_into_submissions(listing: dict) -> list[dict]:
+    """
+    Converts the JSON of a Reddit listing page into the submission dicts returned by
+    AbstractRedditClient.fetch_submissions_made_on_date
+    """
+    extracted_utc = datetime.utcnow().timestamp()
+    return [
+        {
+            "id": post["id"],
+            "title": post["title"],
+            "body": post["selftext"],
+            "subreddit_display_name": post["subreddit"],
+            "upvote_ratio": post["upvote_ratio"],
+            "ups": post["ups"],
+            "downs": post["downs"],
+            "total_awards_received": post.get("total_awards_received", 0),
+            "num_comments": post["num_comments"],
+            "created_utc": post["created_utc"],
+            "extracted_utc": extracted_utc,
+        }
+        for post in (child["data"] for child in listing["data"]["children"])
+    ]
+
+
+INFO_BATCH_SIZE = 100  # Maximum number of ids per request to Reddit's info endpoint
+
+
+def batch_post_ids_into_fullnames(post_ids: list[str]) -> list[list[str]]:
+    fullnames = [f"t3_{post_id}" for post_id in post_ids]
+    batches = []
+    for start in range(0, len(fullnames), INFO_BATCH_SIZE):
+        end = start + INFO_BATCH_SIZE
+        batches.append(fullnames[start:end])
+    return batches
+
+
 class AbstractRedditClient(ABC):
     """
     Wrapper class for the PRAW client to access the Reddit API.
@@ -19,6 +126,46 @@ class AbstractRedditClient(ABC):
     def fetch_submissions_made_on_date(self, subreddit: str, date: Date) -> list[dict]:
         pass
 
+    @abstractmethod
+    def fetch_submissions_by_ids(self, post_ids: list[str]) -> list[dict]:
+        """
+        Fetches the current state of already extracted submissions, INFO_BATCH_SIZE ids per request.
+        Submissions that no longer exist are left out.
+        """
+        pass
+
+    def fetch_submissions_made_between_dates(
+        self,
+        subreddit: str,
+        start_date: Date,
+        end_date: Date,
+    ) -> dict[Date, list[dict]]:
+        """
+        Fetches the submissions made from start_date to end_date inclusive, bucketed by date.
+        Fetches each date separately unless a subclass can do it in a single pass.
+        """
+        num_days = (end_date - start_date).days + 1
+        dates = [start_date + timedelta(days=i) for i in range(num_days)]
+        return {date: self.fetch_submissions_made_on_date(subreddit, date) for date in dates}
+
+    def fetch_submissions_newer_than_watermark(
+        self,
+        subreddit: str,
+        watermark: Optional[SubredditWatermark],
+        since_date: Date,
+    ) -> list[dict]:
+        """
+        Fetches the submissions made on or after since_date that were not extracted yet according to watermark.
+        Fetches each date separately unless a subclass can stop paging at the watermark.
+        """
+        date_to_submissions = self.fetch_submissions_made_between_dates(
+            subreddit,
+            start_date=since_date,
+            end_date=datetime.utcnow().date(),
+        )
+        submissions = [submission for submissions in date_to_submissions.values() for submission in submissions]
+        return filter_submissions_newer_than_watermark(submissions, watermark)
+
 
 class RedditClient(AbstractRedditClient):
     def __init__(
@@ -26,72 +173,384 @@ class RedditClient(AbstractRedditClient):
         reddit_client_id: str,
         reddit_client_secret: str,
         reddit_user_agent: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        raw_listings: bool = False,
+        listing_cache: Optional[ListingCache] = None,
+        listing_cache_mode: str = "revalidate",
+        listing_cache_fresh_seconds: float = 0,
     ):
-        self.reddit_client = Reddit(
-            client_id=reddit_client_id,
-            client_secret=reddit_client_secret,
-            user_agent=reddit_user_agent,
+        """
+        If raw_listings is set, listing pages are parsed straight from their JSON
+        instead of being objectified into PRAW Submission objects.
+        If listing_cache is set, listing pages go through it (see CachingSession for the modes).
+        Every request waits for rate_limiter in the session, once it is known to reach Reddit,
+        so pages served from listing_cache are not throttled.
+        """
+        self._reddit_kwargs = {
+            "client_id": reddit_client_id,
+            "client_secret": reddit_client_secret,
+            "user_agent": reddit_user_agent,
+        }
+        self._local = threading.local()
+        self.rate_limiter = rate_limiter
+        self.raw_listings = raw_listings
+        self.listing_cache = listing_cache
+        self.listing_cache_mode = listing_cache_mode
+        self.listing_cache_fresh_seconds = listing_cache_fresh_seconds
+
+    @property
+    def reddit_client(self) -> Reddit:
+        """PRAW is not thread-safe, so every thread gets its own Reddit instance"""
+        if not hasattr(self._local, "reddit_client"):
+            session = self._create_session()
+            session.hooks["response"].append(self._update_rate_limiter)
+            self._local.reddit_client = Reddit(
+                **self._reddit_kwargs,
+                requestor_kwargs={"session": session},
+            )
+        return self._local.reddit_client
+
+    def _create_session(self) -> requests.Session:
+        if self.listing_cache is None:
+            return RateLimitedSession(self.rate_limiter)
+        return CachingSession(
+            cache=self.listing_cache,
+            mode=self.listing_cache_mode,
+            fresh_seconds=self.listing_cache_fresh_seconds,
+            rate_limiter=self.rate_limiter,
         )
 
+    def _update_rate_limiter(self, response: requests.Response, *args, **kwargs) -> None:
+        if self.rate_limiter is not None:
+            self.rate_limiter.update_from_headers(response.headers)
+
     def _remove_submissions_not_on_date(
         self,
         submissions: list[dict],
         date: Date,
     ) -> list[dict]:
         """Removes submissions not made on date"""
+        return filter_submissions_made_on_date(submissions, date)
+
+    def _fetch_listing_page_as_praw_objects(self, subreddit: str, after: Optional[str]) -> list[dict]:
+        post_generator = self.reddit_client.subreddit(subreddit).new(
+            limit=100,
+            params={"after": after},
+        )
+        return [self._convert_praw_submission_to_dict(post) for post in post_generator]
+
+    def _convert_praw_submission_to_dict(self, post: Submission) -> dict:
+        return {
+            "id": post.id,
+            "title": post.title,
+            "body": post.selftext,
+            "subreddit_display_name": post.subreddit.display_name,
+            "upvote_ratio": post.upvote_ratio,
+            "ups": post.ups,
+            "downs": post.downs,
+            "total_awards_received": post.total_awards_received,
+            "num_comments": post.num_comments,
+            "created_utc": post.created_utc,
+            "extracted_utc": datetime.utcnow().timestamp(),
+        }
+
+    def _fetch_listing_page_as_json(self, subreddit: str, after: Optional[str]) -> list[dict]:
+        """
+        Skips PRAW's objectifier: a missing attribute on a lazy Submission object
+        would cost one more request per post.
+        """
+        listing = self.reddit_client.request(
+            method="GET",
+            path=f"r/{subreddit}/new",
+            params={"limit": 100, "after": after, "raw_json": 1},
+        )
+        return parse_listing_into_submissions(listing)
+
+    def _fetch_listing_page(self, subreddit: str, after: Optional[str]) -> list[dict]:
+        if self.raw_listings:
+            return self._fetch_listing_page_as_json(subreddit, after)
+        return self._fetch_listing_page_as_praw_objects(subreddit, after)
+
+    def _fetch_submissions_made_since(
+        self,
+        subreddit: str,
+        date: Date,
+        watermark: Optional[SubredditWatermark] = None,
+    ) -> list[dict]:
+        """
+        Walks the newest submissions of subreddit until a page ends with a submission made before date,
+        or with a submission that is not newer than watermark.
+        The last page may contain submissions made before date or already extracted.
+        """
+        submissions = []
+        last_post_id = None
+        try:
+            while True:
+                posts = self._fetch_listing_page(subreddit, after=last_post_id)
+                if len(posts) == 0:
+                    break
+                submissions += posts
+
+                last_post = posts[-1]
+                if should_fetch_more_pages(last_post, date, watermark):
+                    last_post_id = f"t3_{last_post['id']}"
+                else:
+                    break
+        except Forbidden:
+            logger.error(
+                f"Couldn't fetch posts due to Forbidden error from subreddit: {subreddit}",
+            )
+            return []
+        return submissions
+
+    def fetch_submissions_made_on_date(self, subreddit: str, date: Date) -> list[dict]:
+        submissions = self._fetch_submissions_made_since(subreddit, date)
+        return self._remove_submissions_not_on_date(submissions, date)
+
+    def fetch_submissions_by_ids(self, post_ids: list[str]) -> list[dict]:
+        submissions = []
+        for fullnames in batch_post_ids_into_fullnames(post_ids):
+            if self.raw_listings:
+                listing = self.reddit_client.request(
+                    method="GET",
+                    path="api/info",
+                    params={"id": ",".join(fullnames), "raw_json": 1},
+                )
+                submissions += parse_listing_into_submissions(listing)
+            else:
+                posts = self.reddit_client.info(fullnames=fullnames)
+                submissions += [self._convert_praw_submission_to_dict(post) for post in posts]
+        return submissions
+
+    def fetch_submissions_made_between_dates(
+        self,
+        subreddit: str,
+        start_date: Date,
+        end_date: Date,
+    ) -> dict[Date, list[dict]]:
+        """Walks the listing of subreddit once for the whole date range"""
+        submissions = self._fetch_submissions_made_since(subreddit, start_date)
+        return bucket_submissions_by_date(submissions, start_date, end_date)
+
+    def fetch_submissions_newer_than_watermark(
+        self,
+        subreddit: str,
+        watermark: Optional[SubredditWatermark],
+        since_date: Date,
+    ) -> list[dict]:
+        """Stops paging as soon as the walk reaches the watermark"""
+        submissions = self._fetch_submissions_made_since(subreddit, since_date, watermark)
+        submissions = filter_submissions_newer_than_watermark(submissions, watermark)
         return [
             submission
             for submission in submissions
-            if datetime.utcfromtimestamp(submission["created_utc"]).date() == date
+            if datetime.utcfromtimestamp(submission["created_utc"]).date() >= since_date
         ]
 
-    def fetch_submissions_made_on_date(self, subreddit: str, date: Date) -> list[dict]:
-        posts_made_on_date = []
+
+class AsyncRedditClient(AbstractRedditClient):
+    """
+    Reddit client that calls the listing JSON endpoints directly over async HTTP.
+    Pages of different subreddits are requested concurrently, so the extract app
+    can await a whole day's fetch without blocking the event loop.
+    """
+
+    def __init__(
+        self,
+        reddit_client_id: str,
+        reddit_client_secret: str,
+        reddit_user_agent: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_concurrent_requests: int = 8,
+        auth_url: str = "https://www.reddit.com/api/v1/access_token",
+        api_url: str = "https://oauth.reddit.com",
+    ):
+        self.reddit_client_id = reddit_client_id
+        self.reddit_client_secret = reddit_client_secret
+        self.reddit_user_agent = reddit_user_agent
+        self.rate_limiter = rate_limiter
+        self.max_concurrent_requests = max_concurrent_requests
+        self.auth_url = auth_url
+        self.api_url = api_url
+
+    @asynccontextmanager
+    async def _open_http_client(self) -> AsyncIterator[httpx.AsyncClient]:
+        """Opens an HTTP client authorized with an application-only OAuth token"""
+        async with httpx.AsyncClient(
+            base_url=self.api_url,
+            headers={"User-Agent": self.reddit_user_agent},
+        ) as http_client:
+            response = await http_client.post(
+                self.auth_url,
+                data={"grant_type": "client_credentials"},
+                auth=(self.reddit_client_id, self.reddit_client_secret),
+            )
+            response.raise_for_status()
+            http_client.headers["Authorization"] = f"bearer {response.json()['access_token']}"
+            yield http_client
+
+    async def _fetch_listing_page(
+        self,
+        http_client: httpx.AsyncClient,
+        semaphore: asyncio.Semaphore,
+        subreddit: str,
+        after: Optional[str],
+    ) -> list[dict]:
+        params: dict[str, int | str] = {"limit": 100, "raw_json": 1}
+        if after is not None:
+            params["after"] = after
+        async with semaphore:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async()
+            response = await http_client.get(f"/r/{subreddit}/new", params=params)
+            if self.rate_limiter is not None:
+                self.rate_limiter.update_from_headers(response.headers)
+        response.raise_for_status()
+        return parse_listing_into_submissions(response.json())
+
+    async def _fetch_submissions_made_since(
+        self,
+        http_client: httpx.AsyncClient,
+        semaphore: asyncio.Semaphore,
+        subreddit: str,
+        date: Date,
+        watermark: Optional[SubredditWatermark] = None,
+    ) -> list[dict]:
+        """
+        Walks the newest submissions of subreddit until a page ends with a submission made before date,
+        or with a submission that is not newer than watermark.
+        The last page may contain submissions made before date or already extracted.
+        """
+        submissions: list[dict] = []
         last_post_id = None
         try:
             while True:
-                post_generator = self.reddit_client.subreddit(subreddit).new(
-                    limit=100,
-                    params={"after": last_post_id},
-                )
-                posts = [
-                    {
-                        "id": post.id,
-                        "title": post.title,
-                        "body": post.selftext,
-                        "subreddit_display_name": post.subreddit.display_name,
-                        "upvote_ratio": post.upvote_ratio,
-                        "ups": post.ups,
-                        "downs": post.downs,
-                        "total_awards_received": post.total_awards_received,
-                        "num_comments": post.num_comments,
-                        "created_utc": post.created_utc,
-                        "extracted_utc": datetime.utcnow().timestamp(),
-                    }
-                    for post in post_generator
-                ]
+                posts = await self._fetch_listing_page(http_client, semaphore, subreddit, last_post_id)
                 if len(posts) == 0:
                     break
-                posts_made_on_date += posts
+                submissions += posts
 
                 last_post = posts[-1]
-                last_post_created_datetime = datetime.utcfromtimestamp(
-                    last_post["created_utc"],
-                )
-                should_fetch_more = last_post_created_datetime.date() >= date
-                if should_fetch_more:
+                if should_fetch_more_pages(last_post, date, watermark):
                     last_post_id = f"t3_{last_post['id']}"
                 else:
                     break
-        except Forbidden:
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 403:
+                raise
             logger.error(
                 f"Couldn't fetch posts due to Forbidden error from subreddit: {subreddit}",
             )
             return []
+        return submissions
 
-        posts_made_on_date = self._remove_submissions_not_on_date(
-            posts_made_on_date,
-            date,
-        )
-        print(len(posts_made_on_date))
-        return posts_made_on_date
+    async def _fetch_submissions_made_on_date(
+        self,
+        http_client: httpx.AsyncClient,
+        semaphore: asyncio.Semaphore,
+        subreddit: str,
+        date: Date,
+    ) -> list[dict]:
+        submissions = await self._fetch_submissions_made_since(http_client, semaphore, subreddit, date)
+        return filter_submissions_made_on_date(submissions, date)
+
+    async def fetch_submissions_for_subreddits(self, subreddits: list[str], date: Date) -> list[list[dict]]:
+        """
+        Fetches the submissions made on date for every subreddit, with the pages of
+        different subreddits in flight at the same time. Results are in the order of subreddits.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        async with self._open_http_client() as http_client:
+            return await asyncio.gather(
+                *(
+                    self._fetch_submissions_made_on_date(http_client, semaphore, subreddit, date)
+                    for subreddit in subreddits
+                ),
+            )
+
+    async def fetch_submissions_made_on_date_async(self, subreddit: str, date: Date) -> list[dict]:
+        submissions_of_each_subreddit = await self.fetch_submissions_for_subreddits([subreddit], date)
+        return submissions_of_each_subreddit[0]
+
+    def fetch_submissions_made_on_date(self, subreddit: str, date: Date) -> list[dict]:
+        return asyncio.run(self.fetch_submissions_made_on_date_async(subreddit, date))
+
+    async def _fetch_submissions_by_fullnames(
+        self,
+        http_client: httpx.AsyncClient,
+        semaphore: asyncio.Semaphore,
+        fullnames: list[str],
+    ) -> list[dict]:
+        async with semaphore:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async()
+            response = await http_client.get("/api/info", params={"id": ",".join(fullnames), "raw_json": 1})
+            if self.rate_limiter is not None:
+                self.rate_limiter.update_from_headers(response.headers)
+        response.raise_for_status()
+        return parse_listing_into_submissions(response.json())
+
+    async def fetch_submissions_by_ids_async(self, post_ids: list[str]) -> list[dict]:
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        async with self._open_http_client() as http_client:
+            submissions_of_each_batch = await asyncio.gather(
+                *(
+                    self._fetch_submissions_by_fullnames(http_client, semaphore, fullnames)
+                    for fullnames in batch_post_ids_into_fullnames(post_ids)
+                ),
+            )
+        return [submission for submissions in submissions_of_each_batch for submission in submissions]
+
+    def fetch_submissions_by_ids(self, post_ids: list[str]) -> list[dict]:
+        return asyncio.run(self.fetch_submissions_by_ids_async(post_ids))
+
+    async def fetch_submissions_made_between_dates_async(
+        self,
+        subreddit: str,
+        start_date: Date,
+        end_date: Date,
+    ) -> dict[Date, list[dict]]:
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        async with self._open_http_client() as http_client:
+            submissions = await self._fetch_submissions_made_since(http_client, semaphore, subreddit, start_date)
+        return bucket_submissions_by_date(submissions, start_date, end_date)
+
+    def fetch_submissions_made_between_dates(
+        self,
+        subreddit: str,
+        start_date: Date,
+        end_date: Date,
+    ) -> dict[Date, list[dict]]:
+        """Walks the listing of subreddit once for the whole date range"""
+        return asyncio.run(self.fetch_submissions_made_between_dates_async(subreddit, start_date, end_date))
+
+    async def fetch_submissions_newer_than_watermark_async(
+        self,
+        subreddit: str,
+        watermark: Optional[SubredditWatermark],
+        since_date: Date,
+    ) -> list[dict]:
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        async with self._open_http_client() as http_client:
+            submissions = await self._fetch_submissions_made_since(
+                http_client,
+                semaphore,
+                subreddit,
+                since_date,
+                watermark,
+            )
+        submissions = filter_submissions_newer_than_watermark(submissions, watermark)
+        return [
+            submission
+            for submission in submissions
+            if datetime.utcfromtimestamp(submission["created_utc"]).date() >= since_date
+        ]
+
+    def fetch_submissions_newer_than_watermark(
+        self,
+        subreddit: str,
+        watermark: Optional[SubredditWatermark],
+        since_date: Date,
+    ) -> list[dict]:
+        """Stops paging as soon as the walk reaches the watermark"""
+        return asyncio.run(self.fetch_submissions_newer_than_watermark_async(subreddit, watermark, since_date))
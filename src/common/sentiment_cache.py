@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Iterable
+from typing import Optional
+
+from common.nlp_client import AbstractNLPClient
+
+
+# SQLite limits the number of parameters of a single statement
+SQLITE_MAX_PARAMETERS = 500
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def get_sentiment_cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class InMemorySentimentCache:
+    """
+    Thread-safe LRU of sentiment scores. A score of None (text the model cannot score)
+    is cached like any other score.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._scores: OrderedDict[str, Optional[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Optional[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    found[key] = self._scores[key]
+        return found
+
+    def put_many(self, scores: dict[str, Optional[float]]) -> None:
+        with self._lock:
+            for key, score in scores.items():
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+
+class SqliteSentimentCache:
+    """
+    Sentiment scores persisted in a SQLite database on local disk. Entries older than
+    max_age_seconds are evicted, then the oldest entries until at most max_entries remain.
+
+    Puts add to an estimate of the number of entries, so the table is only counted once the
+    estimate exceeds max_entries or eviction_interval_seconds have passed since the last eviction.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_age_seconds: float,
+        max_entries: int,
+        eviction_interval_seconds: float = 60,
+    ):
+        self.max_age_seconds = max_age_seconds
+        self.max_entries = max_entries
+        self.eviction_interval_seconds = eviction_interval_seconds
+        self._lock = threading.Lock()
+        # Overestimates when a put replaces existing entries, which only makes eviction run early
+        self._estimated_num_entries = 0
+        self._last_eviction_time = 0.0
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sentiment_scores (key TEXT PRIMARY KEY, score REAL, stored_at REAL)",
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS sentiment_scores_stored_at ON sentiment_scores (stored_at)",
+            )
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Optional[float]]:
+        keys = list(keys)
+        oldest_stored_at = time.time() - self.max_age_seconds
+        found: dict[str, Optional[float]] = {}
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_MAX_PARAMETERS):
+                end = start + SQLITE_MAX_PARAMETERS
+                chunk = keys[start:end]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT key, score FROM sentiment_scores WHERE stored_at >= ? AND key IN ({placeholders})",
+                    [oldest_stored_at, *chunk],
+                )
+                found.update(rows)
+        return found
+
+    def put_many(self, scores: dict[str, Optional[float]]) -> None:
+        stored_at = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO sentiment_scores (key, score, stored_at) VALUES (?, ?, ?)",
+                [(key, score, stored_at) for key, score in scores.items()],
+            )
+            self._estimated_num_entries += len(scores)
+            should_evict = (
+                self._estimated_num_entries > self.max_entries
+                or stored_at - self._last_eviction_time > self.eviction_interval_seconds
+            )
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> None:
+        """Counts the whole table, which also corrects the estimate for entries other processes put"""
+        with self._lock, self._connection:
+            now = time.time()
+            self._last_eviction_time = now
+            self._connection.execute(
+                "DELETE FROM sentiment_scores WHERE stored_at < ?",
+                [now - self.max_age_seconds],
+            )
+            (num_entries,) = self._connection.execute("SELECT COUNT(*) FROM sentiment_scores").fetchone()
+            if num_entries > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM sentiment_scores WHERE key IN "
+                    "(SELECT key FROM sentiment_scores ORDER BY stored_at LIMIT ?)",
+                    [num_entries - self.max_entries],
+                )
+                num_entries = self.max_entries
+            self._estimated_num_entries = num_entries
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class CachingNLPClient(AbstractNLPClient):
+    """
+    Wraps an NLP client so that each distinct (model, normalized text) pair is only scored once.
+    Scores are looked up in the in-memory tier first, then the persistent tier. Only texts missing
+    from both are sent to the wrapped client, and their scores are written back to both tiers.
+    """
+
+    def __init__(
+        self,
+        nlp_client: AbstractNLPClient,
+        model: str,
+        memory_cache: InMemorySentimentCache,
+        persistent_cache: Optional[SqliteSentimentCache] = None,
+    ) -> None:
+        self.nlp_client = nlp_client
+        self.model = model
+        self.memory_cache = memory_cache
+        self.persistent_cache = persistent_cache
+
+        # Shared by concurrent requests, so the counters are only updated under the lock
+        self._stats_lock = threading.Lock()
+        self.num_memory_hits = 0
+        self.num_persistent_hits = 0
+        self.num_misses = 0
+
+    def compute_sentiment_scores(self, texts: list[str]) -> list[Optional[float]]:
+        keys = [get_sentiment_cache_key(self.model, text) for text in texts]
+        key_to_text = dict(zip(keys, texts))
+
+        scores = self.memory_cache.get_many(key_to_text)
+        num_memory_hits = len(scores)
+
+        num_persistent_hits = 0
+        if self.persistent_cache is not None:
+            persistent_scores = self.persistent_cache.get_many(key for key in key_to_text if key not in scores)
+            self.memory_cache.put_many(persistent_scores)
+            num_persistent_hits = len(persistent_scores)
+            scores.update(persistent_scores)
+
+        missing_keys = [key for key in key_to_text if key not in scores]
+        with self._stats_lock:
+            self.num_memory_hits += num_memory_hits
+            self.num_persistent_hits += num_persistent_hits
+            self.num_misses += len(missing_keys)
+        if missing_keys:
+            missing_scores = self.nlp_client.compute_sentiment_scores([key_to_text[key] for key in missing_keys])
+            computed_scores = dict(zip(missing_keys, missing_scores))
+            self.memory_cache.put_many(computed_scores)
+            if self.persistent_cache is not None:
+                self.persistent_cache.put_many(computed_scores)
+            scores.update(computed_scores)
+
+        return [scores[key] for key in keys]
+
+    def stats(self) -> dict:
+        """Counters of the distinct texts looked up in each call, summed over calls"""
+        with self._stats_lock:
+            return {
+                "memory_hits": self.num_memory_hits,
+                "persistent_hits": self.num_persistent_hits,
+                "misses": self.num_misses,
+            }
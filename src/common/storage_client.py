@@ -1,14 +1,47 @@
 from __future__ import annotations
 
+import contextlib
+import itertools
+import uuid
 from abc import ABC
 from abc import abstractmethod
+from typing import ContextManager
+from typing import IO
+from typing import Iterable
+from typing import Optional
+from typing import TYPE_CHECKING
 
+from common.client_registry import bucket_metadata_cache
+from common.client_registry import get_gcs_client
 from common.models import AbstractModel
-from common.utils import deserialize_single_json_to_objects
-from common.utils import serialize_objects_to_single_json
+from common.utils import BinaryWriter
+from common.utils import compress
+from common.utils import COMPRESSIONS
+from common.utils import deserialize_parquet_to_dataframe
+from common.utils import deserialize_parquet_to_objects
+from common.utils import get_json_codec
+from common.utils import is_parquet
+from common.utils import open_compressed_writer
+from common.utils import open_decompressed_reader
+from common.utils import PARQUET_CONTENT_TYPE
+from common.utils import serialize_objects_to_parquet
+from common.utils import write_objects_to_parquet
 from google.api_core.exceptions import NotFound
 from google.cloud import storage
 
+if TYPE_CHECKING:  # pandas is only installed for the stages that use DataFrames
+    import pandas as pd
+
+# Streamed uploads are written under this prefix and only copied to their key once complete.
+# The keys are not daily object keys, so their notifications are ignored by the next stage.
+STREAMED_UPLOAD_PREFIX = "_uploads/"
+
+
+def convert_objects_to_dataframe(objects: list[AbstractModel]) -> pd.DataFrame:
+    import pandas as pd
+
+    return pd.DataFrame([object.__dict__ for object in objects])
+
 
 class AbstractBlobStorageClient(ABC):
     """
@@ -21,9 +54,26 @@ class AbstractBlobStorageClient(ABC):
         objects: list[AbstractModel],
         bucket_name: str,
         object_key: str,
+        if_generation_match: Optional[int] = None,
     ) -> None:
+        """
+        If if_generation_match is given, the upload raises PreconditionFailed unless the stored
+        object is at that generation, or, for generation 0, unless there is no stored object
+        """
         pass
 
+    def upload_stream(
+        self,
+        objects: Iterable[AbstractModel],
+        bucket_name: str,
+        object_key: str,
+    ) -> None:
+        """
+        Uploads objects as they are produced. Clients that can't stream
+        collect all the objects first.
+        """
+        self.upload(list(objects), bucket_name, object_key)
+
     @abstractmethod
     def download(
         self,
@@ -33,33 +83,198 @@ class AbstractBlobStorageClient(ABC):
     ) -> list[AbstractModel]:
         pass
 
+    @abstractmethod
+    def download_with_generation(
+        self,
+        model_type: type[AbstractModel],
+        bucket_name: str,
+        object_key: str,
+    ) -> tuple[list[AbstractModel], int]:
+        """Downloads objects along with the generation of the object they were stored in"""
+        pass
+
+    def download_dataframe(
+        self,
+        model_type: type[AbstractModel],
+        bucket_name: str,
+        object_key: str,
+    ) -> pd.DataFrame:
+        """
+        Downloads objects into a DataFrame with a column per field. Clients that store
+        objects in a columnar format skip creating an object per row.
+        """
+        objects = self.download(model_type, bucket_name, object_key)
+        return convert_objects_to_dataframe(objects)
+
 
 class GoogleCloudStorageClient(AbstractBlobStorageClient):
-    def __init__(self):
-        self.gcs_client = storage.Client()
+    def __init__(
+        self,
+        upload_chunk_size: int = 8 * 1024 * 1024,
+        storage_format: str = "json",
+        json_codec: str = "stdlib",
+        compression: str = "none",
+        gcs_client: Optional[storage.Client] = None,
+    ):
+        """
+        upload_chunk_size must be a multiple of 256 KiB. storage_format is the format objects
+        are uploaded in, "json" or "parquet". Objects in either format can be downloaded.
+        json_codec is the codec JSON is encoded with, "stdlib" or "orjson". compression is
+        "none", "gzip" or "zstd", and is stored as the Content-Encoding of JSON objects, which
+        are decompressed on download. Parquet objects are left as they are, as their pages
+        are already compressed. The process-wide storage client is used unless gcs_client is given,
+        and bucket metadata is reused across clients for a few minutes.
+        """
+        if storage_format not in ("json", "parquet"):
+            raise ValueError(f"Invalid storage format {storage_format}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Invalid compression {compression}")
+        self.gcs_client = gcs_client or get_gcs_client()
+        self.upload_chunk_size = upload_chunk_size
+        self.storage_format = storage_format
+        self.json_codec = get_json_codec(json_codec)
+        self.compression = compression
+
+    def _get_bucket(self, bucket_name: str) -> storage.Bucket:
+        return bucket_metadata_cache.get(
+            (self.gcs_client, bucket_name),
+            lambda: self.gcs_client.get_bucket(bucket_name),
+        )
 
     def upload(
         self,
         objects: list[AbstractModel],
         bucket_name: str,
         object_key: str,
+        if_generation_match: Optional[int] = None,
     ) -> None:
 
-        object_json_string = serialize_objects_to_single_json(objects)
-        bucket = self.gcs_client.get_bucket(bucket_name)
+        bucket = self._get_bucket(bucket_name)
         blob = bucket.blob(object_key)
-        blob.upload_from_string(object_json_string)
+        # An empty list has no model type to derive a Parquet schema from
+        if self.storage_format == "parquet" and objects:
+            data = serialize_objects_to_parquet(objects, type(objects[0]))
+            blob.upload_from_string(
+                data,
+                content_type=PARQUET_CONTENT_TYPE,
+                if_generation_match=if_generation_match,
+            )
+        else:
+            data = self.json_codec.encode(objects)
+            if self.compression != "none":
+                data = compress(data, self.compression)
+                blob.content_encoding = self.compression
+            # Same content type as when uploading the JSON as a string
+            blob.upload_from_string(data, content_type="text/plain", if_generation_match=if_generation_match)
 
-    def download(
+    def upload_stream(
         self,
-        model_type: type[AbstractModel],
+        objects: Iterable[AbstractModel],
         bucket_name: str,
         object_key: str,
-    ) -> list[AbstractModel]:
+    ) -> None:
+        """
+        Uploads objects through a resumable upload as they are produced, so only one chunk is
+        held in memory at a time. Objects are written as newline-delimited JSON, or as Parquet
+        row groups if the storage format is Parquet.
+
+        The objects are streamed to a temporary object, which is copied to object_key only once
+        all of them were written, so an error while producing them leaves object_key unchanged.
+        """
+        bucket = self._get_bucket(bucket_name)
+        temporary_blob = bucket.blob(
+            f"{STREAMED_UPLOAD_PREFIX}{object_key}.{uuid.uuid4().hex}",
+            chunk_size=self.upload_chunk_size,
+        )
+        try:
+            self._write_stream(objects, temporary_blob)
+            bucket.copy_blob(temporary_blob, bucket, object_key)
+        finally:
+            # Closing the upload on an error still finalizes the temporary object
+            with contextlib.suppress(NotFound):
+                temporary_blob.delete()
+
+    def _write_stream(self, objects: Iterable[AbstractModel], blob: storage.Blob) -> None:
+        objects = iter(objects)
+        first_object = next(objects, None)
+        if first_object is not None:
+            objects = itertools.chain([first_object], objects)
 
-        bucket = self.gcs_client.get_bucket(bucket_name)
+        if self.storage_format == "parquet" and first_object is not None:
+            with blob.open("wb", content_type=PARQUET_CONTENT_TYPE) as file:
+                write_objects_to_parquet(objects, type(first_object), file)
+        else:
+            if self.compression != "none":
+                blob.content_encoding = self.compression
+            with blob.open("wb", content_type="application/x-ndjson") as file:
+                with self._open_writer(file) as writer:
+                    for object in objects:
+                        writer.write(self.json_codec.encode_line(object).encode("utf-8"))
+
+    def _open_writer(self, file: IO[bytes]) -> ContextManager[BinaryWriter]:
+        if self.compression == "none":
+            return contextlib.nullcontext(file)
+        return open_compressed_writer(file, self.compression)
+
+    def _download_bytes_and_generation(
+        self,
+        bucket_name: str,
+        object_key: str,
+    ) -> tuple[bytes, int]:
+        bucket = self._get_bucket(bucket_name)
         blob = bucket.get_blob(object_key)
         if blob is None:
             raise NotFound(f"Object {bucket_name}:{object_key} not found")
-        json_string = blob.download_as_text()
-        return deserialize_single_json_to_objects(json_string, model_type)
+        # Pinned to the generation the metadata was read at, so the bytes match the generation
+        if not blob.content_encoding:
+            return blob.download_as_bytes(if_generation_match=blob.generation), blob.generation
+        # The stored bytes are read and decompressed a chunk at a time, rather than
+        # downloading the whole compressed object before decompressing it
+        with blob.open("rb", raw_download=True, if_generation_match=blob.generation) as file:
+            with open_decompressed_reader(file, blob.content_encoding) as decompressed_file:
+                return decompressed_file.read(), blob.generation
+
+    def _download_bytes(
+        self,
+        bucket_name: str,
+        object_key: str,
+    ) -> bytes:
+        data, _ = self._download_bytes_and_generation(bucket_name, object_key)
+        return data
+
+    def _decode(self, data: bytes, model_type: type[AbstractModel]) -> list[AbstractModel]:
+        if is_parquet(data):
+            return deserialize_parquet_to_objects(data, model_type)
+        return self.json_codec.decode(data, model_type)
+
+    def download(
+        self,
+        model_type: type[AbstractModel],
+        bucket_name: str,
+        object_key: str,
+    ) -> list[AbstractModel]:
+
+        data = self._download_bytes(bucket_name, object_key)
+        return self._decode(data, model_type)
+
+    def download_with_generation(
+        self,
+        model_type: type[AbstractModel],
+        bucket_name: str,
+        object_key: str,
+    ) -> tuple[list[AbstractModel], int]:
+
+        data, generation = self._download_bytes_and_generation(bucket_name, object_key)
+        return self._decode(data, model_type), generation
+
+    def download_dataframe(
+        self,
+        model_type: type[AbstractModel],
+        bucket_name: str,
+        object_key: str,
+    ) -> pd.DataFrame:
+
+        data = self._download_bytes(bucket_name, object_key)
+        if is_parquet(data):
+            return deserialize_parquet_to_dataframe(data)
+        return convert_objects_to_dataframe(self.json_codec.decode(data, model_type))
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import random
+import re
+import time
+from datetime import date as Date
+from typing import cast
+from typing import Iterable
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from common.models import DocumentFrequencies
+from common.storage_client import AbstractBlobStorageClient
+from common.utils import get_object_key
+from google.api_core.exceptions import NotFound
+from google.api_core.exceptions import PreconditionFailed
+from scipy import sparse
+
+
+DOCUMENT_FREQUENCY_INDEX_OBJECT_KEY = "_index/document_frequencies.json"
+# Prefix of the objects holding the counts of each date
+DATE_DOCUMENT_FREQUENCIES_PREFIX = "_index/document_frequencies/"
+
+# Tokens of at least three characters
+TOKEN_PATTERN = re.compile(r"[a-z][a-z0-9']+[a-z0-9]")
+
+STOP_WORDS = frozenset(
+    """
+    about above after again against all also am an and any anyone are aren't around as at be because been
+    before being below between both but by can can't cannot could couldn't did didn't do does doesn't doing
+    don't down during each even ever every few for from further get gets getting go going got had hadn't has
+    hasn't have haven't having he her here hers herself him himself his how i i'm i've if in into is isn't
+    it it's its itself just know let's like make many may me might more most much must my myself need no nor
+    not now of off on once one only or other our ours ourselves out over own really same say she should
+    shouldn't so some still such take than that that's the their theirs them themselves then there there's
+    these they they're thing things think this those through to too under until up us use very want was
+    wasn't way we we're were weren't what what's when where which while who whom why will with won't would
+    wouldn't yes yet you you're your yours yourself yourselves
+    """.split(),
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def build_document_term_matrix(
+    texts: Iterable[str],
+    chunk_size: int = 1000,
+) -> tuple[sparse.csr_matrix, np.ndarray]:
+    """
+    Builds a binary sparse matrix with a row per text and a column per term, which is 1
+    where the term occurs in the text. Returns the matrix and the term of each column.
+    Texts are tokenized chunk_size at a time, so that only the term indices of earlier
+    chunks are kept in memory.
+    """
+    term_to_column: dict[str, int] = {}
+    indices_of_each_chunk = []
+    lengths_of_each_chunk = []
+    texts = iter(texts)
+    while chunk := list(itertools.islice(texts, chunk_size)):
+        terms_of_each_text = [set(tokenize(text)) for text in chunk]
+        lengths = np.fromiter(map(len, terms_of_each_text), dtype=np.int64, count=len(chunk))
+        chunk_terms = np.fromiter(itertools.chain.from_iterable(terms_of_each_text), dtype=object, count=lengths.sum())
+        chunk_indices, unique_chunk_terms = pd.factorize(chunk_terms)
+        chunk_columns = np.fromiter(
+            (term_to_column.setdefault(term, len(term_to_column)) for term in unique_chunk_terms),
+            dtype=np.int32,
+            count=len(unique_chunk_terms),
+        )
+        indices_of_each_chunk.append(chunk_columns[chunk_indices])
+        lengths_of_each_chunk.append(lengths)
+
+    lengths = np.concatenate(lengths_of_each_chunk) if lengths_of_each_chunk else np.zeros(0, dtype=np.int64)
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    indices = np.concatenate(indices_of_each_chunk) if indices_of_each_chunk else np.zeros(0, dtype=np.int32)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.int32), indices, indptr),
+        shape=(len(lengths), len(term_to_column)),
+    )
+    terms = np.array(list(term_to_column), dtype=object)
+    return matrix, terms
+
+
+def get_date_document_frequencies_object_key(date: Date) -> str:
+    return f"{DATE_DOCUMENT_FREQUENCIES_PREFIX}{get_object_key(date)}"
+
+
+def get_empty_document_frequencies() -> DocumentFrequencies:
+    return DocumentFrequencies(
+        date=Date.min,
+        num_documents=0,
+        counted_dates=[],
+        document_frequencies={},
+    )
+
+
+def load_document_frequencies(
+    storage_client: AbstractBlobStorageClient,
+    bucket_name: str,
+) -> tuple[DocumentFrequencies, int]:
+    """Stored index and its generation, which is 0 if no index is stored"""
+    try:
+        (document_frequencies,), generation = storage_client.download_with_generation(
+            model_type=DocumentFrequencies,
+            bucket_name=bucket_name,
+            object_key=DOCUMENT_FREQUENCY_INDEX_OBJECT_KEY,
+        )
+    except NotFound:
+        return get_empty_document_frequencies(), 0
+    return cast(DocumentFrequencies, document_frequencies), generation
+
+
+class DocumentFrequencyIndex:
+    """
+    Document frequency of each term over the posts of every transformed date, persisted as a single
+    object and updated with one date at a time, so computing IDF never rescans historical posts.
+    The counts of each date are also stored in an object of their own, so when a date is transformed
+    again, as its posts change, its previous counts are replaced rather than added to.
+    Only the max_terms most frequent terms are kept, to bound the size of the index.
+
+    Updates are kept as pending until saved. Saving applies them to the latest stored index and
+    writes it only if no other transform wrote it in the meantime, retrying otherwise, so
+    concurrent transforms don't lose each other's updates.
+    """
+
+    def __init__(
+        self,
+        document_frequencies: DocumentFrequencies,
+        max_terms: int,
+        storage_client: Optional[AbstractBlobStorageClient] = None,
+        bucket_name: Optional[str] = None,
+    ):
+        self.document_frequencies = document_frequencies
+        self.max_terms = max_terms
+        self.storage_client = storage_client
+        self.bucket_name = bucket_name
+        self.date_to_pending_update: dict[Date, tuple[DocumentFrequencies, Optional[DocumentFrequencies]]] = {}
+
+    @classmethod
+    def load(
+        cls,
+        storage_client: AbstractBlobStorageClient,
+        bucket_name: str,
+        max_terms: int,
+    ) -> DocumentFrequencyIndex:
+        document_frequencies, _ = load_document_frequencies(storage_client, bucket_name)
+        return cls(document_frequencies, max_terms, storage_client, bucket_name)
+
+    @classmethod
+    def empty(cls, max_terms: int) -> DocumentFrequencyIndex:
+        return cls(get_empty_document_frequencies(), max_terms)
+
+    def save(
+        self,
+        storage_client: AbstractBlobStorageClient,
+        bucket_name: str,
+        max_attempts: int = 10,
+    ) -> None:
+        """Applies the pending updates to the stored index, and stores the counts of their dates"""
+        for attempt in range(max_attempts):
+            stored_document_frequencies, generation = load_document_frequencies(storage_client, bucket_name)
+            stored_index = DocumentFrequencyIndex(stored_document_frequencies, self.max_terms)
+            for date_document_frequencies, previous_date_document_frequencies in self.date_to_pending_update.values():
+                stored_index._apply(date_document_frequencies, previous_date_document_frequencies)
+            try:
+                storage_client.upload(
+                    objects=[stored_index.document_frequencies],
+                    bucket_name=bucket_name,
+                    object_key=DOCUMENT_FREQUENCY_INDEX_OBJECT_KEY,
+                    if_generation_match=generation,
+                )
+                break
+            except PreconditionFailed:
+                if attempt == max_attempts - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.1 * 2**attempt))
+
+        for date, (date_document_frequencies, _) in self.date_to_pending_update.items():
+            storage_client.upload(
+                objects=[date_document_frequencies],
+                bucket_name=bucket_name,
+                object_key=get_date_document_frequencies_object_key(date),
+            )
+        self.document_frequencies = stored_index.document_frequencies
+        self.date_to_pending_update = {}
+
+    def _load_date_document_frequencies(self, date: Date) -> Optional[DocumentFrequencies]:
+        if self.storage_client is None or self.bucket_name is None:
+            return None
+        try:
+            (date_document_frequencies,) = self.storage_client.download(
+                model_type=DocumentFrequencies,
+                bucket_name=self.bucket_name,
+                object_key=get_date_document_frequencies_object_key(date),
+            )
+        except NotFound:
+            return None
+        return cast(DocumentFrequencies, date_document_frequencies)
+
+    def update(self, date: Date, terms: np.ndarray, term_document_counts: np.ndarray, num_documents: int) -> None:
+        """Sets the document frequencies of the posts made on date, replacing those it was counted with before"""
+        is_in_documents = term_document_counts > 0
+        date_document_frequencies = DocumentFrequencies(
+            date=date,
+            num_documents=num_documents,
+            counted_dates=[date],
+            document_frequencies=dict(zip(terms[is_in_documents], term_document_counts[is_in_documents].tolist())),
+        )
+        # The pending update is reapplied to the latest stored index on save. Here it is applied
+        # to this index, for computing IDF, replacing an earlier update of the date if there was one.
+        replaced_date_document_frequencies: Optional[DocumentFrequencies]
+        if date in self.date_to_pending_update:
+            replaced_date_document_frequencies, previous_date_document_frequencies = self.date_to_pending_update[date]
+        else:
+            previous_date_document_frequencies = self._load_date_document_frequencies(date)
+            replaced_date_document_frequencies = previous_date_document_frequencies
+        self.date_to_pending_update[date] = (date_document_frequencies, previous_date_document_frequencies)
+        self._apply(date_document_frequencies, replaced_date_document_frequencies)
+
+    def _apply(
+        self,
+        date_document_frequencies: DocumentFrequencies,
+        previous_date_document_frequencies: Optional[DocumentFrequencies],
+    ) -> None:
+        """
+        Adds the counts of a date, after removing its previous counts. Dates counted before the
+        counts of each date were stored have no previous counts to remove, and keep their counts.
+        """
+        date = date_document_frequencies.date
+        term_to_frequency = dict(self.document_frequencies.document_frequencies)
+        num_documents = self.document_frequencies.num_documents
+        if date in self.document_frequencies.counted_dates:
+            if previous_date_document_frequencies is None:
+                return
+            for term, count in previous_date_document_frequencies.document_frequencies.items():
+                remaining_count = term_to_frequency.get(term, 0) - count
+                if remaining_count > 0:
+                    term_to_frequency[term] = remaining_count
+                else:
+                    term_to_frequency.pop(term, None)
+            num_documents -= previous_date_document_frequencies.num_documents
+
+        for term, count in date_document_frequencies.document_frequencies.items():
+            term_to_frequency[term] = term_to_frequency.get(term, 0) + count
+        if len(term_to_frequency) > self.max_terms:
+            term_to_frequency = dict(
+                heapq.nlargest(self.max_terms, term_to_frequency.items(), key=lambda item: item[1]),
+            )
+
+        self.document_frequencies = DocumentFrequencies(
+            date=max(date, self.document_frequencies.date),
+            num_documents=num_documents + date_document_frequencies.num_documents,
+            counted_dates=sorted({*self.document_frequencies.counted_dates, date}),
+            document_frequencies=term_to_frequency,
+        )
+
+    def get_inverse_document_frequencies(self, terms: np.ndarray) -> np.ndarray:
+        """Smoothed IDF, so terms missing from the index get the highest weight rather than infinity"""
+        term_to_frequency = self.document_frequencies.document_frequencies
+        document_frequencies = np.fromiter((term_to_frequency.get(term, 0) for term in terms), float, len(terms))
+        return np.log((1 + self.document_frequencies.num_documents) / (1 + document_frequencies)) + 1
+
+
+def compute_distinctive_terms(
+    document_term_matrix: sparse.csr_matrix,
+    terms: np.ndarray,
+    groups: np.ndarray,
+    inverse_document_frequencies: np.ndarray,
+    num_terms: int,
+    min_document_count: int = 2,
+) -> dict[str, list[str]]:
+    """
+    Ranks the terms of each group of documents by TF-IDF, where TF is the fraction of the group's
+    documents containing the term. Terms in fewer than min_document_count of the group's documents
+    are left out. Returns the num_terms highest ranked terms of each group.
+    """
+    group_names, document_groups = np.unique(groups, return_inverse=True)
+    group_indicator_matrix = sparse.csr_matrix(
+        (np.ones(len(document_groups), dtype=np.int32), (document_groups, np.arange(len(document_groups)))),
+        shape=(len(group_names), len(document_groups)),
+    )
+    group_term_counts = (group_indicator_matrix @ document_term_matrix).tocsr()
+    group_term_counts.data[group_term_counts.data < min_document_count] = 0
+    group_term_counts.eliminate_zeros()
+
+    group_sizes = np.bincount(document_groups, minlength=len(group_names))
+    rows = np.repeat(np.arange(len(group_names)), np.diff(group_term_counts.indptr))
+    scores = group_term_counts.data / group_sizes[rows] * inverse_document_frequencies[group_term_counts.indices]
+
+    group_to_terms = {}
+    for row, group in enumerate(group_names):
+        start, end = group_term_counts.indptr[row], group_term_counts.indptr[row + 1]
+        row_terms = terms[group_term_counts.indices[start:end]]
+        # Highest score first, ties broken alphabetically
+        ranking = np.lexsort((row_terms.astype(str), -scores[start:end]))[:num_terms]
+        group_to_terms[group] = list(row_terms[ranking])
+    return group_to_terms
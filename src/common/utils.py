@@ -1,12 +1,27 @@
 from __future__ import annotations
 
+import functools
+import gzip
+import io
+import itertools
 import json
+import math
+import re
+import typing
+from abc import ABC
+from abc import abstractmethod
 from datetime import date as Date
 from datetime import datetime
 from datetime import timedelta
+from typing import Any
+from typing import Dict
+from typing import IO
+from typing import Iterable
 from typing import List
+from typing import Protocol
 
 from common.models import AbstractModel
+from pydantic import TypeAdapter
 
 
 def serialize_objects_to_single_json(
@@ -24,6 +39,270 @@ def deserialize_single_json_to_objects(
     return [model_type(**object_dict) for object_dict in list_of_object_dicts]
 
 
+@functools.lru_cache(maxsize=None)
+def get_list_adapter(model_type: type) -> TypeAdapter:
+    return TypeAdapter(list[model_type])  # type: ignore
+
+
+def has_non_finite_float(object: AbstractModel) -> bool:
+    return any(type(value) == float and not math.isfinite(value) for value in object.__dict__.values())
+
+
+class JsonCodec(ABC):
+    """
+    Encodes objects as a single JSON array, or as a line of newline-delimited JSON, and decodes
+    either format with one bulk pydantic validation of the parsed objects.
+    """
+
+    @abstractmethod
+    def encode(self, objects: List[AbstractModel]) -> bytes:
+        pass
+
+    @abstractmethod
+    def encode_line(self, object: AbstractModel) -> str:
+        pass
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        pass
+
+    def decode(self, data: bytes, model_type: type[AbstractModel]) -> list[AbstractModel]:
+        if not data.lstrip().startswith(b"["):  # Newline-delimited JSON
+            data = b"[" + b",".join(line for line in data.splitlines() if line.strip()) + b"]"
+        return get_list_adapter(model_type).validate_python(self.loads(data))
+
+
+class StdlibJsonCodec(JsonCodec):
+    """Writes the same bytes as serialize_objects_to_single_json, and one such object per NDJSON line"""
+
+    def encode(self, objects: List[AbstractModel]) -> bytes:
+        # The fields of a model are its __dict__, which is much faster to get than dict(object)
+        return json.dumps([object.__dict__ for object in objects], default=str).encode("utf-8")
+
+    def encode_line(self, object: AbstractModel) -> str:
+        return json.dumps(object.__dict__, default=str) + "\n"
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """
+    Encodes and parses with orjson. orjson writes compact UTF-8 JSON, so its output is not
+    byte-identical to StdlibJsonCodec's. It also writes NaN as null, so objects with
+    non-finite floats are encoded with the standard library instead.
+    """
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+
+    def encode(self, objects: List[AbstractModel]) -> bytes:
+        if any(has_non_finite_float(object) for object in objects):
+            return StdlibJsonCodec().encode(objects)
+        return self.orjson.dumps([object.__dict__ for object in objects])
+
+    def encode_line(self, object: AbstractModel) -> str:
+        if has_non_finite_float(object):
+            return StdlibJsonCodec().encode_line(object)
+        return self.orjson.dumps(object.__dict__, option=self.orjson.OPT_APPEND_NEWLINE).decode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        try:
+            return self.orjson.loads(data)
+        except self.orjson.JSONDecodeError:  # NaN and Infinity are not valid JSON, but json.loads accepts them
+            return json.loads(data)
+
+
+def get_json_codec(name: str) -> JsonCodec:
+    if name == "stdlib":
+        return StdlibJsonCodec()
+    elif name == "orjson":
+        return OrjsonCodec()
+    raise ValueError(f"Invalid JSON codec {name}")
+
+
+PARQUET_MAGIC_BYTES = b"PAR1"
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+
+
+def is_parquet(data: bytes) -> bool:
+    return data[:4] == PARQUET_MAGIC_BYTES
+
+
+def get_arrow_type(annotation: Any):
+    import pyarrow as pa
+
+    origin = typing.get_origin(annotation)
+    if origin in (list, List):
+        (item_annotation,) = typing.get_args(annotation)
+        return pa.list_(get_arrow_type(item_annotation))
+    if origin in (dict, Dict):
+        key_annotation, value_annotation = typing.get_args(annotation)
+        return pa.map_(get_arrow_type(key_annotation), get_arrow_type(value_annotation))
+    annotation_to_arrow_type = {
+        str: pa.string(),
+        int: pa.int64(),
+        float: pa.float64(),
+        bool: pa.bool_(),
+        Date: pa.date32(),
+    }
+    if annotation not in annotation_to_arrow_type:
+        raise TypeError(f"No Arrow type for {annotation}")
+    return annotation_to_arrow_type[annotation]
+
+
+def has_arrow_map_type(annotation: Any) -> bool:
+    origin = typing.get_origin(annotation)
+    if origin in (dict, Dict):
+        return True
+    return origin in (list, List) and has_arrow_map_type(typing.get_args(annotation)[0])
+
+
+def convert_arrow_maps_to_dicts(value: Any, annotation: Any) -> Any:
+    """Arrow reads map columns back as lists of (key, value) tuples, so they are turned back into dicts"""
+    if value is None:
+        return value
+    origin = typing.get_origin(annotation)
+    if origin in (list, List):
+        (item_annotation,) = typing.get_args(annotation)
+        return [convert_arrow_maps_to_dicts(item, item_annotation) for item in value]
+    if origin in (dict, Dict):
+        _, value_annotation = typing.get_args(annotation)
+        return {key: convert_arrow_maps_to_dicts(item, value_annotation) for key, item in value}
+    return value
+
+
+def get_arrow_schema(model_type: type[AbstractModel]):
+    """Arrow schema with a typed column for each field of model_type"""
+    import pyarrow as pa
+
+    return pa.schema(
+        [(name, get_arrow_type(field.annotation)) for name, field in model_type.model_fields.items()],
+    )
+
+
+def write_objects_to_parquet(
+    objects: Iterable[AbstractModel],
+    model_type: type[AbstractModel],
+    file: IO[bytes],
+    row_group_size: int = 10000,
+) -> None:
+    """Writes objects to a zstd-compressed Parquet file, holding one row group in memory at a time"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = get_arrow_schema(model_type)
+    with pq.ParquetWriter(file, schema, compression="zstd") as writer:
+        objects = iter(objects)
+        while row_group := [dict(object) for object in itertools.islice(objects, row_group_size)]:
+            writer.write_table(pa.Table.from_pylist(row_group, schema=schema))
+
+
+def serialize_objects_to_parquet(
+    objects: List[AbstractModel],
+    model_type: type[AbstractModel],
+) -> bytes:
+    file = io.BytesIO()
+    write_objects_to_parquet(objects, model_type, file)
+    return file.getvalue()
+
+
+def deserialize_parquet_to_objects(
+    data: bytes,
+    model_type: type[AbstractModel],
+) -> list[AbstractModel]:
+    import pyarrow.parquet as pq
+
+    rows = pq.read_table(io.BytesIO(data)).to_pylist()
+    annotated_fields = [
+        (name, field.annotation)
+        for name, field in model_type.model_fields.items()
+        if has_arrow_map_type(field.annotation)
+    ]
+    for row in rows:
+        for name, annotation in annotated_fields:
+            row[name] = convert_arrow_maps_to_dicts(row[name], annotation)
+    return [model_type(**row) for row in rows]
+
+
+def deserialize_parquet_to_dataframe(data: bytes):
+    """Reads a Parquet file into a DataFrame column by column, without creating an object per row"""
+    import pyarrow.parquet as pq
+
+    return pq.read_table(io.BytesIO(data)).to_pandas()
+
+
+# Compressions objects can be uploaded with, also stored as the object's Content-Encoding
+COMPRESSIONS = ("none", "gzip", "zstd")
+GZIP_COMPRESSION_LEVEL = 6
+ZSTD_COMPRESSION_LEVEL = 3
+
+
+class BinaryWriter(Protocol):
+    """Binary stream the compressed writers share, which gzip and zstandard don't implement IO[bytes] for"""
+
+    def write(self, data: bytes, /) -> int:
+        ...
+
+    def __enter__(self) -> BinaryWriter:
+        ...
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any, /) -> Any:
+        ...
+
+
+class BinaryReader(Protocol):
+    """Binary stream the decompressed readers share"""
+
+    def read(self, size: int = -1, /) -> bytes:
+        ...
+
+    def __enter__(self) -> BinaryReader:
+        ...
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any, /) -> Any:
+        ...
+
+
+def open_compressed_writer(file: IO[bytes], compression: str) -> BinaryWriter:
+    """
+    Wraps file so that bytes written are compressed. Closing the returned writer
+    finishes the compressed stream, but leaves file open.
+    """
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=file, mode="wb", compresslevel=GZIP_COMPRESSION_LEVEL)
+    elif compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL).stream_writer(file, closefd=False)
+    raise ValueError(f"Invalid compression {compression}")
+
+
+def open_decompressed_reader(file: IO[bytes], content_encoding: str | None) -> BinaryReader:
+    """
+    Wraps file so that reads return its decompressed bytes, decompressing as it is read,
+    so the compressed object is never held in memory alongside the decompressed one
+    """
+    if content_encoding in (None, "", "identity"):
+        return file
+    elif content_encoding == "gzip":
+        return gzip.GzipFile(fileobj=file, mode="rb")
+    elif content_encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True, closefd=False)
+    raise ValueError(f"Invalid content encoding {content_encoding}")
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    file = io.BytesIO()
+    with open_compressed_writer(file, compression) as compressed_file:
+        compressed_file.write(data)
+    return file.getvalue()
+
+
 def get_date_parts_from_date(date: Date) -> tuple[str, str, str]:
     """
     Helper function to get different parts of a date as double-digit strings
@@ -46,6 +325,22 @@ def get_object_key(date: Date) -> str:
     return f"{partition_prefix}/{object_name}"
 
 
+def get_post_sentiments_object_key(date: Date) -> str:
+    """Key of the per-post sentiment scores of date, stored next to the metrics of date"""
+    return f"post_sentiments/{get_object_key(date)}"
+
+
+DAILY_OBJECT_KEY_PATTERN = re.compile(r"year=\d{4}/month=\d{2}/day=\d{2}\.json")
+
+
+def is_daily_object_key(object_key: str) -> bool:
+    """
+    Whether object_key is a key returned by get_object_key, as opposed to
+    auxiliary objects (e.g. indexes) stored in the same bucket
+    """
+    return DAILY_OBJECT_KEY_PATTERN.fullmatch(object_key) is not None
+
+
 def get_date(object_key: str) -> Date:
     year_str, month_str, day_str = object_key.split("/")
     year = int(year_str[5:9])
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import random
+import time
+from datetime import datetime
+from typing import cast
+from typing import Optional
+
+from common.models import SubredditWatermark
+from common.storage_client import AbstractBlobStorageClient
+from google.api_core.exceptions import NotFound
+from google.api_core.exceptions import PreconditionFailed
+
+
+WATERMARK_INDEX_OBJECT_KEY = "_index/watermarks.json"
+
+
+def load_watermarks(
+    storage_client: AbstractBlobStorageClient,
+    bucket_name: str,
+    object_key: str,
+) -> tuple[list[SubredditWatermark], int]:
+    """Stored watermarks and the generation of their object, which is 0 if none is stored"""
+    try:
+        watermarks, generation = storage_client.download_with_generation(
+            model_type=SubredditWatermark,
+            bucket_name=bucket_name,
+            object_key=object_key,
+        )
+    except NotFound:
+        return [], 0
+    return cast(list[SubredditWatermark], watermarks), generation
+
+
+class WatermarkIndex:
+    """
+    Index of the newest post extracted from each subreddit, persisted as a single object
+    so that incremental extracts can stop paging as soon as they reach known posts.
+
+    Saving merges the watermarks moved since loading into the latest stored index and writes it
+    only if no other extract wrote it in the meantime, retrying otherwise, so concurrent
+    extracts keep each other's watermarks.
+    """
+
+    def __init__(self, watermarks: list[SubredditWatermark]):
+        self.subreddit_to_watermark = {watermark.subreddit: watermark for watermark in watermarks}
+        self.updated_subreddits: set[str] = set()
+
+    @classmethod
+    def load(
+        cls,
+        storage_client: AbstractBlobStorageClient,
+        bucket_name: str,
+        object_key: str = WATERMARK_INDEX_OBJECT_KEY,
+    ) -> WatermarkIndex:
+        watermarks, _ = load_watermarks(storage_client, bucket_name, object_key)
+        return cls(watermarks)
+
+    def save(
+        self,
+        storage_client: AbstractBlobStorageClient,
+        bucket_name: str,
+        object_key: str = WATERMARK_INDEX_OBJECT_KEY,
+        max_attempts: int = 10,
+    ) -> None:
+        for attempt in range(max_attempts):
+            stored_watermarks, generation = load_watermarks(storage_client, bucket_name, object_key)
+            stored_index = WatermarkIndex(stored_watermarks)
+            for subreddit in self.updated_subreddits:
+                stored_index._set_if_newer(self.subreddit_to_watermark[subreddit])
+            try:
+                storage_client.upload(
+                    objects=list(stored_index.subreddit_to_watermark.values()),
+                    bucket_name=bucket_name,
+                    object_key=object_key,
+                    if_generation_match=generation,
+                )
+                break
+            except PreconditionFailed:
+                if attempt == max_attempts - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.1 * 2**attempt))
+        self.subreddit_to_watermark = stored_index.subreddit_to_watermark
+        self.updated_subreddits = set()
+
+    def get(self, subreddit: str) -> Optional[SubredditWatermark]:
+        return self.subreddit_to_watermark.get(subreddit)
+
+    def update(self, subreddit: str, submissions: list[dict]) -> None:
+        """Moves the watermark of subreddit to the newest of submissions, if it is newer"""
+        if not submissions:
+            return
+        newest_submission = max(submissions, key=lambda submission: submission["created_utc"])
+        watermark = SubredditWatermark(
+            date=datetime.utcfromtimestamp(newest_submission["created_utc"]).date(),
+            subreddit=subreddit,
+            post_id=newest_submission["id"],
+            created_utc=newest_submission["created_utc"],
+        )
+        if self._set_if_newer(watermark):
+            self.updated_subreddits.add(subreddit)
+
+    def _set_if_newer(self, watermark: SubredditWatermark) -> bool:
+        current_watermark = self.get(watermark.subreddit)
+        if current_watermark is not None and current_watermark.created_utc >= watermark.created_utc:
+            return False
+        self.subreddit_to_watermark[watermark.subreddit] = watermark
+        return True
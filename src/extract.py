@@ -1,23 +1,40 @@
 from __future__ import annotations
 
+import time
+from collections import defaultdict
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date as Date
 from datetime import datetime
+from functools import partial
+from typing import cast
+from typing import Iterator
 from typing import List
+from typing import Optional
 
 from common import config
 from common import logger
+from common.client_registry import client_registry
+from common.http_cache import ListingCache
 from common.middleware import LoggingMiddleware
 from common.models import RedditPost
+from common.rate_limiter import RateLimiter
 from common.reddit_client import AbstractRedditClient
+from common.reddit_client import AsyncRedditClient
 from common.reddit_client import RedditClient
+from common.storage_client import AbstractBlobStorageClient
 from common.storage_client import GoogleCloudStorageClient
 from common.utils import estimate_downvotes
 from common.utils import get_default_date_for_extract_call
 from common.utils import get_object_key
+from common.watermark_index import WatermarkIndex
 from fastapi import FastAPI
 from fastapi import HTTPException
 from fastapi import Request
 from fastapi import Response
+from google.api_core.exceptions import NotFound
+from starlette.concurrency import run_in_threadpool
 
 
 def convert_submission_to_reddit_post(submission: dict) -> RedditPost:
@@ -49,52 +66,410 @@ def convert_submission_to_reddit_post(submission: dict) -> RedditPost:
     return reddit_post
 
 
+def iter_posts_from_reddit(
+    reddit_client: AbstractRedditClient,
+    date: Date,
+    subreddits: list[str],
+    max_workers: int = 1,
+) -> Iterator[RedditPost]:
+    """
+    Yields the posts made on date from each subreddit, in the order of subreddits.
+    Up to max_workers subreddits are fetched ahead of the consumer, so memory use
+    doesn't grow with the number of subreddits.
+    """
+    fetch_submissions = partial(reddit_client.fetch_submissions_made_on_date, date=date)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending_fetches: deque[Future] = deque()
+        for subreddit in subreddits:
+            pending_fetches.append(executor.submit(fetch_submissions, subreddit))
+            if len(pending_fetches) < max_workers:
+                continue
+            for submission in pending_fetches.popleft().result():
+                yield convert_submission_to_reddit_post(submission)
+        while pending_fetches:
+            for submission in pending_fetches.popleft().result():
+                yield convert_submission_to_reddit_post(submission)
+
+
 def fetch_posts_from_reddit(
     reddit_client: AbstractRedditClient,
     date: Date,
     subreddits: list[str],
+    max_workers: int = 1,
+) -> List[RedditPost]:
+    """
+    Fetches the posts made on date from each subreddit, fetching up to max_workers subreddits at once.
+    Posts are returned in the order of subreddits, regardless of which subreddit finishes first.
+    """
+    return list(iter_posts_from_reddit(reddit_client, date, subreddits, max_workers))
+
+
+async def fetch_posts_from_reddit_async(
+    reddit_client: AsyncRedditClient,
+    date: Date,
+    subreddits: list[str],
 ) -> List[RedditPost]:
-    new_submissions = []
-    for subreddit in subreddits:
-        submissions = reddit_client.fetch_submissions_made_on_date(
+    submissions_of_each_subreddit = await reddit_client.fetch_submissions_for_subreddits(
+        subreddits=subreddits,
+        date=date,
+    )
+    return [
+        convert_submission_to_reddit_post(submission)
+        for submissions in submissions_of_each_subreddit
+        for submission in submissions
+    ]
+
+
+def fetch_posts_from_reddit_between_dates(
+    reddit_client: AbstractRedditClient,
+    start_date: Date,
+    end_date: Date,
+    subreddits: list[str],
+    max_workers: int = 1,
+) -> dict[Date, List[RedditPost]]:
+    """
+    Fetches the posts made from start_date to end_date inclusive, walking the listing of each subreddit once.
+    Returns the posts of each date in the order of subreddits.
+    """
+    fetch_submissions = partial(
+        reddit_client.fetch_submissions_made_between_dates,
+        start_date=start_date,
+        end_date=end_date,
+    )
+    date_to_posts: dict[Date, List[RedditPost]] = defaultdict(list)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for date_to_submissions in executor.map(fetch_submissions, subreddits):
+            for date, submissions in date_to_submissions.items():
+                date_to_posts[date] += [convert_submission_to_reddit_post(submission) for submission in submissions]
+    return dict(date_to_posts)
+
+
+def fetch_new_posts_from_reddit(
+    reddit_client: AbstractRedditClient,
+    watermark_index: WatermarkIndex,
+    default_since_date: Date,
+    subreddits: list[str],
+    max_workers: int = 1,
+) -> List[RedditPost]:
+    """
+    Fetches the posts that are newer than the watermark of each subreddit, and moves the watermarks forward.
+    Subreddits without a watermark are fetched from default_since_date onwards.
+    """
+
+    def fetch_submissions(subreddit: str) -> list[dict]:
+        watermark = watermark_index.get(subreddit)
+        return reddit_client.fetch_submissions_newer_than_watermark(
             subreddit=subreddit,
-            date=date,
+            watermark=watermark,
+            since_date=watermark.date if watermark is not None else default_since_date,
         )
-        new_submissions.extend(submissions)
 
-    return [convert_submission_to_reddit_post(submission) for submission in new_submissions]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        submissions_of_each_subreddit = list(executor.map(fetch_submissions, subreddits))
 
+    new_posts = []
+    for subreddit, submissions in zip(subreddits, submissions_of_each_subreddit):
+        watermark_index.update(subreddit, submissions)
+        new_posts += [convert_submission_to_reddit_post(submission) for submission in submissions]
+    return new_posts
 
-def extract(date: Date) -> None:
+
+def merge_posts_into_cloud(
+    storage_client: AbstractBlobStorageClient,
+    new_posts: List[RedditPost],
+    date: Date,
+) -> None:
+    """
+    Adds new_posts to the posts already stored for date. Posts that are already
+    stored are replaced with their newer copy in new_posts.
+    """
+    object_key = get_object_key(date)
+    stored_posts: list[RedditPost]
+    try:
+        stored_posts = cast(
+            list[RedditPost],
+            storage_client.download(
+                model_type=RedditPost,
+                bucket_name=config.GCS_RAW_BUCKET_NAME,
+                object_key=object_key,
+            ),
+        )
+    except NotFound:
+        stored_posts = []
+
+    post_id_to_post = {post.post_id: post for post in stored_posts}
+    post_id_to_post.update((post.post_id, post) for post in new_posts)
+    storage_client.upload(
+        objects=list(post_id_to_post.values()),
+        bucket_name=config.GCS_RAW_BUCKET_NAME,
+        object_key=object_key,
+    )
+
+
+def refresh_post_votes(
+    reddit_client: AbstractRedditClient,
+    posts: List[RedditPost],
+) -> List[RedditPost]:
+    """
+    Updates the votes and comment counts of already extracted posts, fetching them by id in batches.
+    Posts that no longer exist on Reddit are kept as they are.
+    """
+    submissions = reddit_client.fetch_submissions_by_ids([post.post_id for post in posts])
+    id_to_submission = {submission["id"]: submission for submission in submissions}
+
+    refreshed_posts = []
+    for post in posts:
+        submission = id_to_submission.get(post.post_id)
+        if submission is None:
+            refreshed_posts.append(post)
+            continue
+        refreshed_post = post.model_copy(
+            update={
+                "upvotes": submission["ups"],
+                "upvote_ratio": submission["upvote_ratio"],
+                "downvotes_estimated": estimate_downvotes(
+                    upvotes=submission["ups"],
+                    upvote_ratio=submission["upvote_ratio"],
+                ),
+                "comment_count": submission["num_comments"],
+            },
+        )
+        refreshed_posts.append(refreshed_post)
+    return refreshed_posts
+
+
+def store_posts_to_gcs(new_posts: List[RedditPost], date: Date) -> None:
+    google_storage_client = GoogleCloudStorageClient(
+        storage_format=config.STORAGE_FORMAT,
+        json_codec=config.JSON_CODEC,
+        compression=config.STORAGE_COMPRESSION,
+    )
+    object_key = get_object_key(date)
+    google_storage_client.upload(
+        objects=new_posts,
+        bucket_name=config.GCS_RAW_BUCKET_NAME,
+        object_key=object_key,
+    )
+
+
+def create_reddit_client() -> RedditClient:
+    listing_cache = None
+    if config.REDDIT_CACHE_DIR:
+        listing_cache = ListingCache(
+            directory=config.REDDIT_CACHE_DIR,
+            max_age_seconds=config.REDDIT_CACHE_MAX_AGE_SECONDS,
+            max_bytes=config.REDDIT_CACHE_MAX_BYTES,
+        )
+    return RedditClient(
+        reddit_client_id=config.REDDIT_CLIENT_ID,
+        reddit_client_secret=config.REDDIT_CLIENT_SECRET,
+        reddit_user_agent=config.REDDIT_USER_AGENT,
+        rate_limiter=RateLimiter(config.REDDIT_REQUESTS_PER_MINUTE),
+        raw_listings=config.REDDIT_RAW_LISTINGS,
+        listing_cache=listing_cache,
+        listing_cache_mode=config.REDDIT_CACHE_MODE,
+        listing_cache_fresh_seconds=config.REDDIT_CACHE_FRESH_SECONDS,
+    )
+
+
+def get_reddit_client() -> RedditClient:
+    """
+    Reddit client shared by every request this instance serves, so they share its rate limiter,
+    which tracks the quota left for the app's credentials
+    """
+    return client_registry.get("reddit", create_reddit_client)
+
+
+def get_rate_limiter_stats(rate_limiter: Optional[RateLimiter]) -> Optional[dict]:
+    return rate_limiter.stats() if rate_limiter is not None else None
+
+
+def log_rate_limiter_stats(
+    rate_limiter: Optional[RateLimiter],
+    start_time: float,
+    start_stats: Optional[dict] = None,
+) -> None:
+    """start_stats are the limiter's stats when the run started, as a shared limiter also counts earlier runs"""
+    if rate_limiter is None:
+        return
+    run_seconds = time.monotonic() - start_time
+    stats = rate_limiter.stats()
+    if start_stats is not None:
+        stats = {name: value - start_stats[name] for name, value in stats.items()}
+    logger.info(
+        f"Made {stats['requests']} Reddit requests in {run_seconds:.1f}s, "
+        f"{stats['delayed_requests']} of them waited on the rate limiter "
+        f"for a total of {stats['seconds_waited']:.1f}s across all workers",
+    )
+
+
+def log_extract_start(date: Date) -> float:
+    """Logs the start of an extract task and returns its monotonic start time"""
     logger.info(f"Starting extract task for {date}")
 
     exec_datetime = datetime.utcnow()
     logger.info(
         f"""Execution time (UTC): {exec_datetime.isoformat(sep=" ", timespec='seconds')}""",
     )
+    return time.monotonic()
+
+
+def extract(date: Date) -> None:
+    start_time = log_extract_start(date)
 
     logger.info("Connecting to Reddit API")
-    reddit_client = RedditClient(
+    reddit_client = get_reddit_client()
+    start_stats = get_rate_limiter_stats(reddit_client.rate_limiter)
+
+    if config.EXTRACT_STREAMING:
+        logger.info("Streaming posts from reddit to google cloud storage")
+        google_storage_client = GoogleCloudStorageClient(
+            storage_format=config.STORAGE_FORMAT,
+            json_codec=config.JSON_CODEC,
+            compression=config.STORAGE_COMPRESSION,
+        )
+        google_storage_client.upload_stream(
+            objects=iter_posts_from_reddit(
+                reddit_client=reddit_client,
+                date=date,
+                subreddits=config.SUBREDDITS,
+                max_workers=config.EXTRACT_MAX_WORKERS,
+            ),
+            bucket_name=config.GCS_RAW_BUCKET_NAME,
+            object_key=get_object_key(date),
+        )
+        log_rate_limiter_stats(reddit_client.rate_limiter, start_time, start_stats)
+        logger.info("Extract task done")
+        return
+
+    logger.info("Fetching posts from reddit")
+    new_posts = fetch_posts_from_reddit(
+        reddit_client=reddit_client,
+        date=date,
+        subreddits=config.SUBREDDITS,
+        max_workers=config.EXTRACT_MAX_WORKERS,
+    )
+    logger.info("Storing posts to google cloud storage")
+    store_posts_to_gcs(new_posts, date)
+
+    log_rate_limiter_stats(reddit_client.rate_limiter, start_time, start_stats)
+    logger.info("Extract task done")
+
+
+async def extract_async(date: Date) -> None:
+    start_time = log_extract_start(date)
+
+    reddit_client = AsyncRedditClient(
         reddit_client_id=config.REDDIT_CLIENT_ID,
         reddit_client_secret=config.REDDIT_CLIENT_SECRET,
         reddit_user_agent=config.REDDIT_USER_AGENT,
+        rate_limiter=RateLimiter(config.REDDIT_REQUESTS_PER_MINUTE),
+        max_concurrent_requests=config.EXTRACT_MAX_WORKERS,
     )
-    google_storage_client = GoogleCloudStorageClient()
 
     logger.info("Fetching posts from reddit")
-    new_posts = fetch_posts_from_reddit(
+    new_posts = await fetch_posts_from_reddit_async(
         reddit_client=reddit_client,
         date=date,
         subreddits=config.SUBREDDITS,
     )
     logger.info("Storing posts to google cloud storage")
+    await run_in_threadpool(store_posts_to_gcs, new_posts, date)
+
+    log_rate_limiter_stats(reddit_client.rate_limiter, start_time)
+    logger.info("Extract task done")
+
+
+def extract_range(start_date: Date, end_date: Date) -> None:
+    start_time = log_extract_start(start_date)
+
+    logger.info("Connecting to Reddit API")
+    reddit_client = get_reddit_client()
+    start_stats = get_rate_limiter_stats(reddit_client.rate_limiter)
+
+    logger.info(f"Fetching posts from reddit made from {start_date} to {end_date}")
+    date_to_posts = fetch_posts_from_reddit_between_dates(
+        reddit_client=reddit_client,
+        start_date=start_date,
+        end_date=end_date,
+        subreddits=config.SUBREDDITS,
+        max_workers=config.EXTRACT_MAX_WORKERS,
+    )
+    logger.info("Storing posts of each date to google cloud storage")
+    for date, new_posts in sorted(date_to_posts.items()):
+        store_posts_to_gcs(new_posts, date)
+
+    log_rate_limiter_stats(reddit_client.rate_limiter, start_time, start_stats)
+    logger.info("Extract task done")
+
+
+def extract_incremental() -> None:
+    default_since_date = get_default_date_for_extract_call()
+    start_time = log_extract_start(default_since_date)
+
+    logger.info("Connecting to Reddit API")
+    reddit_client = get_reddit_client()
+    start_stats = get_rate_limiter_stats(reddit_client.rate_limiter)
+    google_storage_client = GoogleCloudStorageClient(
+        storage_format=config.STORAGE_FORMAT,
+        json_codec=config.JSON_CODEC,
+        compression=config.STORAGE_COMPRESSION,
+    )
+    watermark_index = WatermarkIndex.load(google_storage_client, config.GCS_RAW_BUCKET_NAME)
+
+    logger.info("Fetching posts from reddit that are newer than the watermark of each subreddit")
+    new_posts = fetch_new_posts_from_reddit(
+        reddit_client=reddit_client,
+        watermark_index=watermark_index,
+        default_since_date=default_since_date,
+        subreddits=config.SUBREDDITS,
+        max_workers=config.EXTRACT_MAX_WORKERS,
+    )
+    date_to_new_posts: dict[Date, List[RedditPost]] = defaultdict(list)
+    for post in new_posts:
+        date_to_new_posts[post.date].append(post)
+
+    logger.info(f"Merging {len(new_posts)} new posts into google cloud storage")
+    for date, posts in sorted(date_to_new_posts.items()):
+        merge_posts_into_cloud(google_storage_client, posts, date)
+    watermark_index.save(google_storage_client, config.GCS_RAW_BUCKET_NAME)
+
+    log_rate_limiter_stats(reddit_client.rate_limiter, start_time, start_stats)
+    logger.info("Extract task done")
+
+
+def refresh(date: Date) -> None:
+    start_time = log_extract_start(date)
+
+    logger.info("Connecting to Reddit API")
+    reddit_client = get_reddit_client()
+    start_stats = get_rate_limiter_stats(reddit_client.rate_limiter)
+    google_storage_client = GoogleCloudStorageClient(
+        storage_format=config.STORAGE_FORMAT,
+        json_codec=config.JSON_CODEC,
+        compression=config.STORAGE_COMPRESSION,
+    )
+
+    logger.info("Fetching stored posts from google cloud storage")
     object_key = get_object_key(date)
+    stored_posts = cast(
+        list[RedditPost],
+        google_storage_client.download(
+            model_type=RedditPost,
+            bucket_name=config.GCS_RAW_BUCKET_NAME,
+            object_key=object_key,
+        ),
+    )
+
+    logger.info(f"Refreshing votes of {len(stored_posts)} posts")
+    refreshed_posts = refresh_post_votes(reddit_client, stored_posts)
     google_storage_client.upload(
-        objects=new_posts,
+        objects=refreshed_posts,
         bucket_name=config.GCS_RAW_BUCKET_NAME,
         object_key=object_key,
     )
 
+    log_rate_limiter_stats(reddit_client.rate_limiter, start_time, start_stats)
     logger.info("Extract task done")
 
 
@@ -122,7 +497,7 @@ async def add_logging_prefix(request: Request, call_next) -> Response:
 
 
 @app.get("/")
-def handle_event(date: str = None):
+async def handle_event(date: str = None):
     if date:
         try:
             date_to_extract = parse_and_check_date(date)
@@ -131,4 +506,35 @@ def handle_event(date: str = None):
     else:
         date_to_extract = get_default_date_for_extract_call()
 
-    extract(date=date_to_extract)
+    if config.REDDIT_CLIENT_BACKEND == "async":
+        await extract_async(date=date_to_extract)
+    else:
+        await run_in_threadpool(extract, date=date_to_extract)
+
+
+@app.get("/backfill")
+async def handle_backfill_event(start_date: str, end_date: str):
+    try:
+        start_date_to_extract = parse_and_check_date(start_date)
+        end_date_to_extract = parse_and_check_date(end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if start_date_to_extract > end_date_to_extract:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+
+    await run_in_threadpool(extract_range, start_date=start_date_to_extract, end_date=end_date_to_extract)
+
+
+@app.get("/refresh")
+async def handle_refresh_event(date: str):
+    try:
+        date_to_refresh = parse_and_check_date(date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await run_in_threadpool(refresh, date=date_to_refresh)
+
+
+@app.get("/incremental")
+async def handle_incremental_event():
+    await run_in_threadpool(extract_incremental)
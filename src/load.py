@@ -1,21 +1,31 @@
 from __future__ import annotations
 
 import math
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date as Date
 from datetime import datetime
+from datetime import timedelta
+from typing import cast
 
 from common import config
 from common import logger
+from common.bigquery_client import AbstractBigQueryClient
 from common.bigquery_client import BigQueryClient
 from common.bigquery_client import BigQueryInsertError
 from common.middleware import LoggingMiddleware
 from common.models import SubredditMetrics
+from common.storage_client import AbstractBlobStorageClient
 from common.storage_client import GoogleCloudStorageClient
 from common.utils import get_date
 from common.utils import get_object_key
+from common.utils import is_daily_object_key
 from fastapi import FastAPI
+from fastapi import HTTPException
 from fastapi import Request
 from fastapi import Response
+from fastapi.concurrency import run_in_threadpool
+from google.api_core.exceptions import NotFound
+from pydantic import BaseModel
 
 
 def parse_subreddit_metrics_to_bigquery_row_dict(
@@ -33,11 +43,11 @@ def parse_subreddit_metrics_to_bigquery_row_dict(
 
 
 def load_subreddit_metrics_into_bigquery(
-    bigquery_client: BigQueryClient,
+    bigquery_client: AbstractBigQueryClient,
     subreddit_metrics_list: list[SubredditMetrics],
-    project_id: int,
-    dataset_id: int,
-    table_id: int,
+    project_id: str,
+    dataset_id: str,
+    table_id: str,
 ) -> None:
     subreddit_metrics_dicts = [
         parse_subreddit_metrics_to_bigquery_row_dict(
@@ -54,6 +64,94 @@ def load_subreddit_metrics_into_bigquery(
     )
 
 
+def download_subreddit_metrics_of_objects(
+    storage_client: AbstractBlobStorageClient,
+    bucket_name: str,
+    object_keys: list[str],
+    max_workers: int,
+) -> list[SubredditMetrics]:
+    """
+    Downloads the metrics of every object concurrently, in the order of object_keys.
+    Objects that don't exist are skipped.
+    """
+
+    def download(object_key: str) -> list[SubredditMetrics]:
+        try:
+            subreddit_metrics = storage_client.download(
+                model_type=SubredditMetrics,
+                bucket_name=bucket_name,
+                object_key=object_key,
+            )
+            return cast(list[SubredditMetrics], subreddit_metrics)
+        except NotFound:
+            logger.warning(f"Skipping object {object_key} as it does not exist")
+            return []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [metrics for metrics_list in executor.map(download, object_keys) for metrics in metrics_list]
+
+
+def load_objects_into_bigquery(
+    bigquery_client: AbstractBigQueryClient,
+    storage_client: AbstractBlobStorageClient,
+    object_keys: list[str],
+    max_workers: int,
+) -> None:
+    """Loads the metrics of all the objects with a single upsert"""
+    subreddit_metrics = download_subreddit_metrics_of_objects(
+        storage_client=storage_client,
+        bucket_name=config.GCS_TRANSFORMED_BUCKET_NAME,
+        object_keys=object_keys,
+        max_workers=max_workers,
+    )
+    if not subreddit_metrics:
+        logger.info("No metrics to load")
+        return
+    logger.info(f"Loading {len(subreddit_metrics)} metrics of {len(object_keys)} objects to BigQuery")
+    load_subreddit_metrics_into_bigquery(
+        bigquery_client=bigquery_client,
+        subreddit_metrics_list=subreddit_metrics,
+        project_id=config.BIGQUERY_PROJECT_ID,
+        dataset_id=config.BIGQUERY_DATASET_ID,
+        table_id=config.BIGQUERY_TABLE_ID,
+    )
+
+
+def create_bigquery_client() -> BigQueryClient:
+    return BigQueryClient(
+        upsert_strategy=config.BIGQUERY_UPSERT_STRATEGY,
+        insert_mode=config.BIGQUERY_INSERT_MODE,
+        staging_bucket_name=config.GCS_TRANSFORMED_BUCKET_NAME,
+    )
+
+
+def create_cloud_storage_client() -> GoogleCloudStorageClient:
+    return GoogleCloudStorageClient(
+        storage_format=config.STORAGE_FORMAT,
+        json_codec=config.JSON_CODEC,
+        compression=config.STORAGE_COMPRESSION,
+    )
+
+
+def load_objects(object_keys: list[str]) -> None:
+    logger.info(f"Starting load task for {len(object_keys)} objects")
+    try:
+        load_objects_into_bigquery(
+            bigquery_client=create_bigquery_client(),
+            storage_client=create_cloud_storage_client(),
+            object_keys=object_keys,
+            max_workers=config.LOAD_MAX_WORKERS,
+        )
+        logger.info("Load task done")
+    except BigQueryInsertError as e:
+        logger.critical(f"Load task encountered error(s): {e}")
+
+
+def load_range(start_date: Date, end_date: Date) -> None:
+    num_days = (end_date - start_date).days + 1
+    load_objects([get_object_key(start_date + timedelta(days=i)) for i in range(num_days)])
+
+
 def load(date: Date) -> None:
     logger.info(f"Starting load task for {date}")
 
@@ -62,8 +160,8 @@ def load(date: Date) -> None:
         f"""Execution time (UTC): {exec_datetime.isoformat(sep=" ", timespec='seconds')}""",
     )
 
-    bigquery_client = BigQueryClient()
-    cloud_storage_client = GoogleCloudStorageClient()
+    bigquery_client = create_bigquery_client()
+    cloud_storage_client = create_cloud_storage_client()
 
     logger.info("Fetching metrics from google cloud storage")
     object_key = get_object_key(date)
@@ -101,6 +199,51 @@ async def add_logging_prefix(request: Request, call_next) -> Response:
 async def handle_event(request: Request):
     event = await request.json()
     object_name = event["message"]["attributes"]["objectId"]
+    if not is_daily_object_key(object_name):
+        logger.info(f"Ignoring object {object_name} as it does not hold a day of data")
+        return Response(status_code=200)
     date_to_load = get_date(object_name)
     load(date=date_to_load)
     return Response(status_code=200)
+
+
+class LoadObjectsRequest(BaseModel):
+    object_keys: list[str]
+
+
+@app.get("/load_range")
+async def handle_load_range_event(start_date: str, end_date: str):
+    try:
+        start_date_to_load = datetime.strptime(start_date, "%d/%m/%Y").date()
+        end_date_to_load = datetime.strptime(end_date, "%d/%m/%Y").date()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if start_date_to_load > end_date_to_load:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    if (end_date_to_load - start_date_to_load).days + 1 > config.LOAD_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Load at most {config.LOAD_MAX_DAYS} days at once, split longer ranges into several calls",
+        )
+
+    await run_in_threadpool(load_range, start_date=start_date_to_load, end_date=end_date_to_load)
+    return Response(status_code=200)
+
+
+@app.post("/load_objects")
+async def handle_load_objects_event(load_objects_request: LoadObjectsRequest):
+    object_keys = [key for key in load_objects_request.object_keys if is_daily_object_key(key)]
+    if len(object_keys) < len(load_objects_request.object_keys):
+        logger.info("Ignoring objects that do not hold a day of data")
+    for object_key in object_keys:
+        try:
+            get_date(object_key)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Object {object_key} is not of a valid date")
+    if len(object_keys) > config.LOAD_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Load at most {config.LOAD_MAX_DAYS} objects at once, split them into several calls",
+        )
+    await run_in_threadpool(load_objects, object_keys=object_keys)
+    return Response(status_code=200)
@@ -1,26 +1,48 @@
 from __future__ import annotations
 
-import copy
 from datetime import date as Date
 from datetime import datetime
-from statistics import mean
+from datetime import timedelta
+from typing import Optional
 from typing import Set
 
+import numpy as np
 import pandas as pd
 from common import config
 from common import logger
+from common.client_registry import client_registry
 from common.middleware import LoggingMiddleware
+from common.models import PostSentiment
 from common.models import RedditPost
 from common.models import SubredditMetrics
 from common.nlp_client import AbstractNLPClient
+from common.nlp_client import GoogleNLPClient
 from common.nlp_client import HuggingFaceNLPClient
+from common.nlp_client import LocalNLPClient
+from common.rate_limiter import RateLimiter
+from common.sentiment_cache import CachingNLPClient
+from common.sentiment_cache import InMemorySentimentCache
+from common.sentiment_cache import SqliteSentimentCache
 from common.storage_client import AbstractBlobStorageClient
 from common.storage_client import GoogleCloudStorageClient
+from common.topics import build_document_term_matrix
+from common.topics import compute_distinctive_terms
+from common.topics import DocumentFrequencyIndex
 from common.utils import get_date
 from common.utils import get_object_key
+from common.utils import get_post_sentiments_object_key
+from common.utils import is_daily_object_key
 from fastapi import FastAPI
+from fastapi import HTTPException
 from fastapi import Request
 from fastapi import Response
+from google.api_core.exceptions import NotFound
+from pydantic import TypeAdapter
+from starlette.concurrency import run_in_threadpool
+
+
+subreddit_metrics_list_adapter = TypeAdapter(list[SubredditMetrics])
+post_sentiments_list_adapter = TypeAdapter(list[PostSentiment])
 
 
 def fetch_reddit_posts_dataframe_from_cloud(
@@ -28,101 +50,237 @@ def fetch_reddit_posts_dataframe_from_cloud(
     bucket_name: str,
     object_key: str,
 ) -> pd.DataFrame:
-    reddit_posts = storage_client.download(
+    return storage_client.download_dataframe(
         model_type=RedditPost,
         bucket_name=bucket_name,
         object_key=object_key,
     )
-    return pd.DataFrame([post.__dict__ for post in reddit_posts])
 
 
-def compute_sentiment_score(
+def compute_common_topics(
+    reddit_posts: pd.DataFrame,
+    document_frequency_index: Optional[DocumentFrequencyIndex] = None,
+    num_topics: int = config.TOPICS_PER_SUBREDDIT,
+) -> dict[str, list[str]]:
+    """
+    Finds the most distinctive terms in the posts of each subreddit by TF-IDF. The document
+    frequencies of the posts are added to document_frequency_index, if given, before computing IDF.
+    """
+    if document_frequency_index is None:
+        document_frequency_index = DocumentFrequencyIndex.empty(max_terms=config.TOPICS_VOCABULARY_SIZE)
+
+    document_term_matrix, terms = build_document_term_matrix(reddit_posts.title + " " + reddit_posts.body)
+    for date in reddit_posts.date.unique():
+        is_on_date = (reddit_posts.date == date).to_numpy(dtype=np.int32)
+        term_document_counts = document_term_matrix.T @ is_on_date
+        document_frequency_index.update(date, terms, term_document_counts, int(is_on_date.sum()))
+
+    return compute_distinctive_terms(
+        document_term_matrix=document_term_matrix,
+        terms=terms,
+        groups=reddit_posts.subreddit.to_numpy(),
+        inverse_document_frequencies=document_frequency_index.get_inverse_document_frequencies(terms),
+        num_terms=num_topics,
+    )
+
+
+def compute_sentiment_scores_of_posts(
     nlp_client: AbstractNLPClient,
     reddit_posts: pd.DataFrame,
-) -> float:
+) -> pd.Series:
+    """Scores every title in one call. Titles that cannot be scored get NaN"""
     scores_of_each_post = nlp_client.compute_sentiment_scores(
         list(reddit_posts.title),
     )
-    scores_of_each_post = [score for score in scores_of_each_post if score is not None]
-    return mean(scores_of_each_post)
+    return pd.Series(scores_of_each_post, index=reddit_posts.index, dtype=float)
 
 
-# TODO
-def compute_common_topics(
-    reddit_posts: pd.DataFrame,
-) -> list[str]:
-    return ["sample-topic"]
+def fetch_post_sentiments_dataframe_from_cloud(
+    storage_client: AbstractBlobStorageClient,
+    bucket_name: str,
+    object_key: str,
+) -> pd.DataFrame:
+    post_sentiments = storage_client.download(
+        model_type=PostSentiment,
+        bucket_name=bucket_name,
+        object_key=object_key,
+    )
+    return pd.DataFrame(
+        [post.__dict__ for post in post_sentiments],
+        columns=list(PostSentiment.model_fields),
+    )
 
 
-def calculate_subreddit_metrics(
-    nlp_client: AbstractNLPClient,
+def get_post_sentiments_list_from_posts_df(
+    scored_posts_df: pd.DataFrame,
+    date: Date,
+) -> list[PostSentiment]:
+    post_sentiments_df = scored_posts_df[["post_id", "subreddit", "sentiment_score"]].assign(date=date)
+    return post_sentiments_list_adapter.validate_python(post_sentiments_df.to_dict("records"))
+
+
+def merge_post_sentiments_into_posts_df(
     reddit_posts_df: pd.DataFrame,
+    post_sentiments_df: pd.DataFrame,
 ) -> pd.DataFrame:
-    groupby_subreddit = reddit_posts_df.groupby(["subreddit"])
-    grouped_df = groupby_subreddit[
-        [
-            "upvotes",
-            "downvotes_estimated",
-        ]
-    ].agg("sum")
-    subreddit_to_df = dict(tuple(groupby_subreddit))
-
-    subreddit_to_sentiment_scores = {
-        subreddit[0]: compute_sentiment_score(nlp_client, df) for subreddit, df in subreddit_to_df.items()
-    }
-    grouped_df["sentiment_score"] = subreddit_to_sentiment_scores
-
-    subreddit_to_topics = {
-        subreddit[0]: compute_common_topics(
-            df,
-        )
-        for subreddit, df in subreddit_to_df.items()
-    }
-    grouped_df["topics"] = subreddit_to_topics
+    """
+    Posts without a stored sentiment score, e.g. extracted after the transform, get NaN.
+    A post stored more than once gets its last stored score.
+    """
+    scores = post_sentiments_df.drop_duplicates("post_id", keep="last").set_index("post_id").sentiment_score
+    return reddit_posts_df.assign(
+        sentiment_score=reddit_posts_df.post_id.map(scores).astype(float),
+    )
+
+
+def aggregate_subreddit_metrics(
+    scored_posts_df: pd.DataFrame,
+    document_frequency_index: Optional[DocumentFrequencyIndex] = None,
+) -> pd.DataFrame:
+    """
+    Aggregates posts that already have a sentiment_score column into metrics of each subreddit.
+    A subreddit none of whose posts could be scored gets a sentiment_score of NaN.
+    """
+    groupby_subreddit = scored_posts_df.groupby("subreddit")
+    grouped_df = groupby_subreddit.agg(
+        upvotes=("upvotes", "sum"),
+        downvotes_estimated=("downvotes_estimated", "sum"),
+        sentiment_score=("sentiment_score", "mean"),  # NaN scores are skipped
+        posts=("subreddit", "size"),
+    )
+
+    subreddit_to_topics = compute_common_topics(scored_posts_df, document_frequency_index)
+    grouped_df["topics"] = pd.Series(subreddit_to_topics)
 
     grouped_votes = grouped_df.upvotes + grouped_df.downvotes_estimated
     grouped_df["upvote_ratio"] = grouped_df.upvotes / grouped_votes
 
-    grouped_df["posts"] = groupby_subreddit.size()
-    return grouped_df.reset_index()
+    columns = ["upvotes", "downvotes_estimated", "sentiment_score", "topics", "upvote_ratio", "posts"]
+    return grouped_df[columns].reset_index()
+
+
+def calculate_subreddit_metrics(
+    nlp_client: AbstractNLPClient,
+    reddit_posts_df: pd.DataFrame,
+    document_frequency_index: Optional[DocumentFrequencyIndex] = None,
+) -> pd.DataFrame:
+    scored_posts_df = reddit_posts_df.assign(
+        sentiment_score=compute_sentiment_scores_of_posts(nlp_client, reddit_posts_df),
+    )
+    return aggregate_subreddit_metrics(scored_posts_df, document_frequency_index)
+
+
+SUBREDDIT_WITH_NO_POSTS_METRICS = {
+    "upvotes": 0,
+    "downvotes_estimated": 0,
+    "upvote_ratio": 1,
+    "posts": 0,
+    "sentiment_score": 0,
+}
 
 
 def get_subreddit_metrics_list_from_metrics_df(
     metrics_df: pd.DataFrame,
     date: Date,
     all_subreddits: Set[str],
+    validate: bool = True,
 ) -> list[SubredditMetrics]:
-    subreddits_with_no_posts = copy.deepcopy(all_subreddits)
-    subreddit_metrics = []
-    for _, row in metrics_df.iterrows():
-        metrics = SubredditMetrics(
-            date=date,
-            subreddit=row.subreddit,
-            upvotes=row.upvotes,
-            downvotes=row.downvotes_estimated,
-            upvote_ratio=row.upvote_ratio,
-            posts=row.posts,
-            sentiment_score=row.sentiment_score,
-            topics=row.topics,
-            transformed_utc=datetime.utcnow().timestamp(),
+    """
+    Converts the metrics of each subreddit into SubredditMetrics, adding empty metrics for
+    subreddits in all_subreddits that had no posts. With validate=False, the objects are
+    constructed without pydantic validation, so metrics_df must already have the right types.
+    """
+    subreddits_with_no_posts = sorted(set(all_subreddits) - set(metrics_df.subreddit))
+    metrics_df = metrics_df.set_index("subreddit").reindex(
+        [*metrics_df.subreddit, *subreddits_with_no_posts],
+    )
+
+    has_no_posts = metrics_df.index.isin(subreddits_with_no_posts)
+    for column, value in SUBREDDIT_WITH_NO_POSTS_METRICS.items():
+        metrics_df.loc[has_no_posts, column] = value
+    metrics_df["topics"] = [[] if no_posts else topics for topics, no_posts in zip(metrics_df.topics, has_no_posts)]
+    metrics_df = metrics_df.astype({"upvotes": int, "downvotes_estimated": int, "posts": int})
+
+    metrics_df = metrics_df.reset_index().rename(columns={"downvotes_estimated": "downvotes"})
+    metrics_df["date"] = date
+    metrics_df["transformed_utc"] = datetime.utcnow().timestamp()
+    records = metrics_df[list(SubredditMetrics.model_fields)].to_dict("records")
+
+    if validate:
+        return subreddit_metrics_list_adapter.validate_python(records)
+    return [SubredditMetrics.model_construct(**record) for record in records]
+
+
+def create_persistent_sentiment_cache() -> Optional[SqliteSentimentCache]:
+    if not config.SENTIMENT_CACHE_PATH:
+        return None
+    return SqliteSentimentCache(
+        path=config.SENTIMENT_CACHE_PATH,
+        max_age_seconds=config.SENTIMENT_CACHE_MAX_AGE_SECONDS,
+        max_entries=config.SENTIMENT_CACHE_MAX_ENTRIES,
+    )
+
+
+def get_memory_sentiment_cache() -> InMemorySentimentCache:
+    """Sentiment scores shared by every transform run handled by this instance"""
+    return client_registry.get(
+        "memory_sentiment_cache",
+        lambda: InMemorySentimentCache(max_entries=config.SENTIMENT_CACHE_MEMORY_ENTRIES),
+    )
+
+
+def get_persistent_sentiment_cache() -> Optional[SqliteSentimentCache]:
+    """Opened on first use rather than at import, so importing transform doesn't touch the disk"""
+    return client_registry.get("persistent_sentiment_cache", create_persistent_sentiment_cache)
+
+
+def create_nlp_client() -> CachingNLPClient:
+    nlp_client: AbstractNLPClient
+    cache_model_name = config.HUGGINGFACE_MODEL
+    if config.NLP_BACKEND == "local":
+        nlp_client = LocalNLPClient(
+            model=config.HUGGINGFACE_MODEL,
+            batch_size=config.LOCAL_NLP_BATCH_SIZE,
+            quantize=config.LOCAL_NLP_QUANTIZE,
         )
-        subreddit_metrics.append(metrics)
-        subreddits_with_no_posts.remove(row.subreddit)
-
-    for subreddit in subreddits_with_no_posts:
-        metrics = SubredditMetrics(
-            date=date,
-            subreddit=subreddit,
-            upvotes=0,
-            downvotes=0,
-            upvote_ratio=1,
-            posts=0,
-            sentiment_score=0,
-            topics=[],
-            transformed_utc=datetime.utcnow().timestamp(),
+        if config.LOCAL_NLP_QUANTIZE:  # Quantized scores differ slightly from the original model's
+            cache_model_name = f"{config.HUGGINGFACE_MODEL}:int8"
+    elif config.NLP_BACKEND == "google":
+        nlp_client = GoogleNLPClient(
+            max_concurrent_requests=config.GOOGLE_NLP_MAX_CONCURRENT_REQUESTS,
+            rate_limiter=RateLimiter(requests_per_minute=config.GOOGLE_NLP_REQUESTS_PER_MINUTE),
         )
-        subreddit_metrics.append(metrics)
-    return subreddit_metrics
+        cache_model_name = "google-cloud-language"
+    else:
+        nlp_client = HuggingFaceNLPClient(
+            model=config.HUGGINGFACE_MODEL,
+            api_token=config.HUGGINGFACE_TOKEN,
+            batch_size=config.HUGGINGFACE_BATCH_SIZE,
+            max_concurrent_requests=config.HUGGINGFACE_MAX_CONCURRENT_REQUESTS,
+        )
+    return CachingNLPClient(
+        nlp_client=nlp_client,
+        model=cache_model_name,
+        memory_cache=get_memory_sentiment_cache(),
+        persistent_cache=get_persistent_sentiment_cache(),
+    )
+
+
+def get_nlp_client() -> CachingNLPClient:
+    """NLP client shared by every request this instance serves, with its HTTP connections and model"""
+    return client_registry.get("nlp", create_nlp_client)
+
+
+def store_post_sentiments_list_to_gcs(
+    storage_client: AbstractBlobStorageClient,
+    post_sentiments_list: list[PostSentiment],
+    date: Date,
+) -> None:
+    storage_client.upload(
+        objects=post_sentiments_list,
+        bucket_name=config.GCS_TRANSFORMED_BUCKET_NAME,
+        object_key=get_post_sentiments_object_key(date),
+    )
 
 
 def store_metrics_list_to_gcs(
@@ -146,11 +304,12 @@ def transform(date: Date) -> None:
         f"""Execution time (UTC): {exec_datetime.isoformat(sep=" ", timespec='seconds')}""",
     )
 
-    google_storage_client = GoogleCloudStorageClient()
-    huggingface_nlp_client = HuggingFaceNLPClient(
-        model=config.HUGGINGFACE_MODEL,
-        api_token=config.HUGGINGFACE_TOKEN,
+    google_storage_client = GoogleCloudStorageClient(
+        storage_format=config.STORAGE_FORMAT,
+        json_codec=config.JSON_CODEC,
+        compression=config.STORAGE_COMPRESSION,
     )
+    nlp_client = get_nlp_client()
     object_key = get_object_key(date)
 
     logger.info("Fetching reddit posts from Google Cloud Storage")
@@ -160,10 +319,47 @@ def transform(date: Date) -> None:
         object_key=object_key,
     )
 
+    document_frequency_index = DocumentFrequencyIndex.load(
+        storage_client=google_storage_client,
+        bucket_name=config.GCS_TRANSFORMED_BUCKET_NAME,
+        max_terms=config.TOPICS_VOCABULARY_SIZE,
+    )
+
+    logger.info("Computing sentiment scores of posts")
+    # The client is shared with earlier runs, so this run's counters are the change since now
+    start_stats = nlp_client.stats()
+    scored_posts_df = reddit_posts_df.assign(
+        sentiment_score=compute_sentiment_scores_of_posts(nlp_client, reddit_posts_df),
+    )
+    run_stats = {name: value - start_stats[name] for name, value in nlp_client.stats().items()}
+    logger.info(f"Sentiment cache stats: {run_stats}")
+
+    logger.info("Storing post sentiment scores to Google Cloud Storage")
+    store_post_sentiments_list_to_gcs(
+        storage_client=google_storage_client,
+        post_sentiments_list=get_post_sentiments_list_from_posts_df(scored_posts_df, date),
+        date=date,
+    )
+
+    aggregate_and_store_metrics(
+        storage_client=google_storage_client,
+        scored_posts_df=scored_posts_df,
+        document_frequency_index=document_frequency_index,
+        date=date,
+    )
+    logger.info("Transform task done")
+
+
+def aggregate_and_store_metrics(
+    storage_client: AbstractBlobStorageClient,
+    scored_posts_df: pd.DataFrame,
+    document_frequency_index: DocumentFrequencyIndex,
+    date: Date,
+) -> None:
     logger.info("Calculating subreddit metrics")
-    metrics_df = calculate_subreddit_metrics(
-        nlp_client=huggingface_nlp_client,
-        reddit_posts_df=reddit_posts_df,
+    metrics_df = aggregate_subreddit_metrics(
+        scored_posts_df=scored_posts_df,
+        document_frequency_index=document_frequency_index,
     )
 
     logger.info(
@@ -176,12 +372,63 @@ def transform(date: Date) -> None:
     )
     logger.info("Storing metrics to Google Cloud Storage")
     store_metrics_list_to_gcs(
-        storage_client=google_storage_client,
+        storage_client=storage_client,
         metrics_list=metrics_list,
         date=date,
     )
 
-    logger.info("Transform task done")
+    document_frequency_index.save(
+        storage_client=storage_client,
+        bucket_name=config.GCS_TRANSFORMED_BUCKET_NAME,
+    )
+
+
+def reaggregate(date: Date) -> None:
+    """
+    Recomputes the metrics of date from the stored posts and their stored sentiment scores,
+    without calling the NLP client
+    """
+    logger.info(f"Starting reaggregation for {date}")
+    google_storage_client = GoogleCloudStorageClient(
+        storage_format=config.STORAGE_FORMAT,
+        json_codec=config.JSON_CODEC,
+        compression=config.STORAGE_COMPRESSION,
+    )
+
+    reddit_posts_df = fetch_reddit_posts_dataframe_from_cloud(
+        storage_client=google_storage_client,
+        bucket_name=config.GCS_RAW_BUCKET_NAME,
+        object_key=get_object_key(date),
+    )
+    post_sentiments_df = fetch_post_sentiments_dataframe_from_cloud(
+        storage_client=google_storage_client,
+        bucket_name=config.GCS_TRANSFORMED_BUCKET_NAME,
+        object_key=get_post_sentiments_object_key(date),
+    )
+    scored_posts_df = merge_post_sentiments_into_posts_df(reddit_posts_df, post_sentiments_df)
+
+    document_frequency_index = DocumentFrequencyIndex.load(
+        storage_client=google_storage_client,
+        bucket_name=config.GCS_TRANSFORMED_BUCKET_NAME,
+        max_terms=config.TOPICS_VOCABULARY_SIZE,
+    )
+    aggregate_and_store_metrics(
+        storage_client=google_storage_client,
+        scored_posts_df=scored_posts_df,
+        document_frequency_index=document_frequency_index,
+        date=date,
+    )
+    logger.info(f"Reaggregation for {date} done")
+
+
+def reaggregate_range(start_date: Date, end_date: Date) -> None:
+    date = start_date
+    while date <= end_date:
+        try:
+            reaggregate(date)
+        except NotFound:
+            logger.warning(f"Skipping reaggregation for {date} as its posts or sentiment scores are not stored")
+        date += timedelta(days=1)
 
 
 app = FastAPI()
@@ -198,6 +445,30 @@ async def add_logging_prefix(request: Request, call_next) -> Response:
 async def handle_event(request: Request):
     event = await request.json()
     object_name = event["message"]["attributes"]["objectId"]
+    if not is_daily_object_key(object_name):
+        logger.info(f"Ignoring object {object_name} as it does not hold a day of data")
+        return Response(status_code=200)
     date_to_transform = get_date(object_name)
     transform(date=date_to_transform)
     return Response(status_code=200)
+
+
+@app.get("/reaggregate")
+async def handle_reaggregate_event(start_date: str, end_date: str):
+    try:
+        start_date_to_reaggregate = datetime.strptime(start_date, "%d/%m/%Y").date()
+        end_date_to_reaggregate = datetime.strptime(end_date, "%d/%m/%Y").date()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if start_date_to_reaggregate > end_date_to_reaggregate:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    if (end_date_to_reaggregate - start_date_to_reaggregate).days + 1 > config.REAGGREGATE_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"Reaggregate at most {config.REAGGREGATE_MAX_DAYS} days at once, "
+                "split longer ranges into several calls"
+            ),
+        )
+
+    await run_in_threadpool(reaggregate_range, start_date=start_date_to_reaggregate, end_date=end_date_to_reaggregate)
@@ -27,7 +27,16 @@ resource "google_bigquery_table" "subreddit_metrics" {
     env = "default"
   }
 
-  clustering = ["date"]
+  # Keeps an apply that would replace the table from deleting its rows
+  deletion_protection = true
+
+  # Changing the partitioning of an existing table replaces it, so tables created without
+  # it are migrated in place first with migrations/partition_subreddit_metrics_table.sh
+  time_partitioning {
+    type  = "DAY"
+    field = "date"
+  }
+  clustering = ["subreddit"]
   schema     = <<-EOF
   [
     {
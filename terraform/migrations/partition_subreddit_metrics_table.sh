@@ -0,0 +1,31 @@
+#!/usr/bin/env bash
+# Partitions an existing subreddit_metrics table by date and clusters it by subreddit in place,
+# so that terraform apply updates the table instead of destroying and recreating it.
+#
+# Run it once per workspace before applying the time_partitioning change, with the pipeline paused:
+#   ./partition_subreddit_metrics_table.sh <workspace> [project_id]
+# Once it is done, terraform plan shows no replacement of google_bigquery_table.subreddit_metrics.
+set -euo pipefail
+
+workspace="$1"
+project_id="${2:-university-subreddits}"
+dataset="subreddit_metrics_${workspace}"
+table="subreddit_metrics_${workspace}"
+backup_table="${table}_unpartitioned_backup"
+partitioned_table="${table}_partitioned"
+
+# Kept until the migrated table has been checked, then removed with bq rm
+bq cp --no_clobber "${project_id}:${dataset}.${table}" "${project_id}:${dataset}.${backup_table}"
+
+bq query --use_legacy_sql=false --project_id="${project_id}" \
+  "CREATE TABLE \`${project_id}.${dataset}.${partitioned_table}\`
+   PARTITION BY date
+   CLUSTER BY subreddit
+   AS SELECT * FROM \`${project_id}.${dataset}.${table}\`"
+
+# A copy keeps the partitioning and clustering of its source
+bq rm -f -t "${project_id}:${dataset}.${table}"
+bq cp --no_clobber "${project_id}:${dataset}.${partitioned_table}" "${project_id}:${dataset}.${table}"
+bq rm -f -t "${project_id}:${dataset}.${partitioned_table}"
+
+echo "Partitioned ${dataset}.${table}, the unpartitioned rows are kept in ${dataset}.${backup_table}"
@@ -1,20 +1,31 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import threading
 from collections import defaultdict
 from datetime import date as Date
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Optional
 from typing import Union
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
 
 from common.bigquery_client import AbstractBigQueryClient
 from common.models import AbstractModel
 from common.nlp_client import AbstractNLPClient
 from common.reddit_client import AbstractRedditClient
 from common.storage_client import AbstractBlobStorageClient
+from google.api_core.exceptions import NotFound
+from google.api_core.exceptions import PreconditionFailed
 
 
 class FakeBigQueryClient(AbstractBigQueryClient):
     def __init__(self):
         self.data = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+        self.num_insert_calls = 0
 
     def insert_rows(
         self,
@@ -24,14 +35,17 @@ class FakeBigQueryClient(AbstractBigQueryClient):
         row_dicts: list[dict],
         enforce_unique_on: list[str],
     ) -> None:
+        self.num_insert_calls += 1
         self.data[project_id][dataset_id][table_id] += row_dicts
 
 
 class FakeNLPClient(AbstractNLPClient):
     def __init__(self, text_to_sentiment_score):
         self.text_to_sentiment_score = text_to_sentiment_score
+        self.requested_texts: list[str] = []
 
     def compute_sentiment_scores(self, texts: list[str]) -> list[Union[float, None]]:
+        self.requested_texts.extend(texts)
         return [self.text_to_sentiment_score[text] for text in texts]
 
 
@@ -47,19 +61,31 @@ class FakeRedditClient(AbstractRedditClient):
                 filtered_submissions.append(submission)
         return filtered_submissions
 
+    def fetch_submissions_by_ids(self, post_ids: list[str]) -> list[dict]:
+        id_to_submission = {submission["id"]: submission for submission in self.submissions}
+        return [id_to_submission[post_id] for post_id in post_ids if post_id in id_to_submission]
+
 
 class FakeCloudStorageClient(AbstractBlobStorageClient):
     def __init__(self):
         self.buckets = defaultdict(dict)
+        self.generations = defaultdict(dict)
+        self.num_generations = 0
 
     def upload(
         self,
         objects: list[AbstractModel],
         bucket_name: str,
         object_key: str,
+        if_generation_match: Optional[int] = None,
     ) -> None:
+        generation = self.generations[bucket_name].get(object_key, 0)
+        if if_generation_match is not None and if_generation_match != generation:
+            raise PreconditionFailed(f"Object {bucket_name}:{object_key} is at generation {generation}")
         bucket_dict = self.buckets[bucket_name]
         bucket_dict[object_key] = objects
+        self.num_generations += 1
+        self.generations[bucket_name][object_key] = self.num_generations
 
     def download(
         self,
@@ -68,4 +94,145 @@ class FakeCloudStorageClient(AbstractBlobStorageClient):
         object_key: str,
     ) -> list[AbstractModel]:
         bucket_dict = self.buckets[bucket_name]
+        if object_key not in bucket_dict:
+            raise NotFound(f"Object {bucket_name}:{object_key} not found")
         return bucket_dict[object_key]
+
+    def download_with_generation(
+        self,
+        model_type: type[AbstractModel],
+        bucket_name: str,
+        object_key: str,
+    ) -> tuple[list[AbstractModel], int]:
+        objects = self.download(model_type, bucket_name, object_key)
+        return objects, self.generations[bucket_name][object_key]
+
+
+class RacingStorageClient(FakeCloudStorageClient):
+    """Runs a competing write right after the first download, as a concurrent request would"""
+
+    def __init__(self, competing_write):
+        super().__init__()
+        self.competing_write = competing_write
+        self.num_rejected_uploads = 0
+
+    def upload(self, objects, bucket_name, object_key, if_generation_match=None):
+        try:
+            super().upload(objects, bucket_name, object_key, if_generation_match)
+        except PreconditionFailed:
+            self.num_rejected_uploads += 1
+            raise
+
+    def download_with_generation(self, model_type, bucket_name, object_key):
+        objects_and_generation = super().download_with_generation(model_type, bucket_name, object_key)
+        competing_write, self.competing_write = self.competing_write, None
+        if competing_write is not None:
+            competing_write(self)
+        return objects_and_generation
+
+
+class FakeRedditServer:
+    """
+    Local HTTP server serving Reddit's OAuth token and /r/{subreddit}/new listing endpoints,
+    newest submission first, from a list of submission dicts.
+    """
+
+    def __init__(self, submissions, page_size=100, forbidden_subreddits=()):
+        self.submissions = sorted(submissions, key=lambda submission: submission["created_utc"], reverse=True)
+        self.page_size = page_size
+        self.forbidden_subreddits = set(forbidden_subreddits)
+        self.requested_paths = []
+        self.response_statuses = []
+        self.http_server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+
+    @property
+    def url(self):
+        host, port = self.http_server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def _info(self, fullnames):
+        post_ids = {fullname.removeprefix("t3_") for fullname in fullnames}
+        posts = [self._to_post_data(submission) for submission in self.submissions if submission["id"] in post_ids]
+        return {"kind": "Listing", "data": {"children": [{"kind": "t3", "data": post} for post in posts]}}
+
+    def _to_post_data(self, submission):
+        return {
+            "id": submission["id"],
+            "title": submission["title"],
+            "selftext": submission["body"],
+            "subreddit": submission["subreddit_display_name"],
+            "upvote_ratio": submission["upvote_ratio"],
+            "ups": submission["ups"],
+            "downs": submission["downs"],
+            "total_awards_received": submission["total_awards_received"],
+            "num_comments": submission["num_comments"],
+            "created_utc": submission["created_utc"],
+        }
+
+    def _listing(self, subreddit, params):
+        posts = [
+            self._to_post_data(submission)
+            for submission in self.submissions
+            if submission["subreddit_display_name"] == subreddit
+        ]
+        limit = min(int(params.get("limit", [self.page_size])[0]), self.page_size)
+        start = 0
+        if "after" in params:
+            after_id = params["after"][0].removeprefix("t3_")
+            start = next(i for i, post in enumerate(posts) if post["id"] == after_id) + 1
+        end = start + limit
+        page = posts[start:end]
+        return {"kind": "Listing", "data": {"children": [{"kind": "t3", "data": post} for post in page]}}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send_json(self, status, body):
+                encoded_body = json.dumps(body).encode("utf-8")
+                etag = f'"{hashlib.md5(encoded_body).hexdigest()}"'
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    server.response_statuses.append(304)
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                server.response_statuses.append(status)
+                self.send_response(status)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded_body)))
+                self.send_header("X-Ratelimit-Remaining", "600")
+                self.send_header("X-Ratelimit-Reset", "600")
+                self.end_headers()
+                self.wfile.write(encoded_body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self._send_json(200, {"access_token": "token", "token_type": "bearer", "expires_in": 86400})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                server.requested_paths.append(self.path)
+                if url.path == "/api/info":
+                    fullnames = parse_qs(url.query)["id"][0].split(",")
+                    self._send_json(200, server._info(fullnames))
+                    return
+                _, _, subreddit, _ = url.path.split("/")
+                if subreddit in server.forbidden_subreddits:
+                    self._send_json(403, {"error": 403})
+                else:
+                    self._send_json(200, server._listing(subreddit, parse_qs(url.query)))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+from itertools import product
+
+import pytest
+from common.rate_limiter import RateLimiter
+from common.reddit_client import AsyncRedditClient
+from fakes import FakeRedditClient
+from fakes import FakeRedditServer
+
+
+def without_extracted_utc(submissions):
+    return [{key: value for key, value in submission.items() if key != "extracted_utc"} for submission in submissions]
+
+
+@pytest.fixture
+def fake_reddit_server(submissions):
+    with FakeRedditServer(submissions, page_size=1, forbidden_subreddits=["private"]) as server:
+        yield server
+
+
+@pytest.fixture
+def async_reddit_client(fake_reddit_server):
+    return AsyncRedditClient(
+        reddit_client_id="client_id",
+        reddit_client_secret="client_secret",
+        reddit_user_agent="UserAgent",
+        auth_url=f"{fake_reddit_server.url}/api/v1/access_token",
+        api_url=fake_reddit_server.url,
+    )
+
+
+def test_fetch_submissions_made_on_date(async_reddit_client, submissions, date_to_submissions):
+    fake_reddit_client = FakeRedditClient(submissions)
+    for date, subreddit in product(date_to_submissions, ["cats", "dogs"]):
+        fetched_submissions = async_reddit_client.fetch_submissions_made_on_date(subreddit, date)
+        expected_submissions = fake_reddit_client.fetch_submissions_made_on_date(subreddit, date)
+        assert without_extracted_utc(fetched_submissions) == without_extracted_utc(expected_submissions)
+
+
+def test_fetch_submissions_for_subreddits_keeps_order(async_reddit_client, submissions, date_to_submissions):
+    fake_reddit_client = FakeRedditClient(submissions)
+    subreddits = ["dogs", "private", "cats"]
+    for date in date_to_submissions:
+        fetched = asyncio.run(async_reddit_client.fetch_submissions_for_subreddits(subreddits, date))
+        expected = [fake_reddit_client.fetch_submissions_made_on_date(subreddit, date) for subreddit in subreddits]
+        assert [without_extracted_utc(submissions) for submissions in fetched] == [
+            without_extracted_utc(submissions) for submissions in expected
+        ]
+
+
+def test_fetch_submissions_stops_paging_before_date(async_reddit_client, fake_reddit_server, date_to_submissions):
+    newest_date = max(date_to_submissions)
+    async_reddit_client.fetch_submissions_made_on_date("dogs", newest_date)
+    # Both dog posts are on the newest date, so the third page (empty) ends the walk
+    assert len(fake_reddit_server.requested_paths) == 3
+
+
+def test_fetch_submissions_forbidden_subreddit(async_reddit_client, date_to_submissions):
+    for date in date_to_submissions:
+        assert async_reddit_client.fetch_submissions_made_on_date("private", date) == []
+
+
+def test_fetch_submissions_made_between_dates(
+    async_reddit_client,
+    fake_reddit_server,
+    submissions,
+    date_to_submissions,
+):
+    dates = sorted(date_to_submissions)
+    fake_reddit_client = FakeRedditClient(submissions)
+    date_to_fetched = async_reddit_client.fetch_submissions_made_between_dates("dogs", dates[0], dates[-1])
+    assert sorted(date_to_fetched) == dates
+    for date, fetched_submissions in date_to_fetched.items():
+        expected_submissions = fake_reddit_client.fetch_submissions_made_on_date("dogs", date)
+        assert without_extracted_utc(fetched_submissions) == without_extracted_utc(expected_submissions)
+    # Two dog posts at one post per page, then an empty page
+    assert len(fake_reddit_server.requested_paths) == 3
+
+
+def test_fetch_submissions_paces_requests_with_rate_limit_headers(fake_reddit_server, date_to_submissions):
+    rate_limiter = RateLimiter(requests_per_minute=1)
+    async_reddit_client = AsyncRedditClient(
+        reddit_client_id="client_id",
+        reddit_client_secret="client_secret",
+        reddit_user_agent="UserAgent",
+        rate_limiter=rate_limiter,
+        auth_url=f"{fake_reddit_server.url}/api/v1/access_token",
+        api_url=fake_reddit_server.url,
+    )
+    # At one request per minute, only the quota reported by the server lets this finish quickly
+    async_reddit_client.fetch_submissions_made_on_date("dogs", max(date_to_submissions))
+    stats = rate_limiter.stats()
+    assert stats["requests"] == 3
+    assert stats["seconds_waited"] < 5
+
+
+def test_fetch_submissions_by_ids(async_reddit_client, fake_reddit_server, submissions):
+    post_ids = [submission["id"] for submission in submissions] + ["deleted"]
+    fetched_submissions = async_reddit_client.fetch_submissions_by_ids(post_ids)
+    assert sorted(without_extracted_utc(fetched_submissions), key=lambda s: s["id"]) == sorted(
+        without_extracted_utc(submissions),
+        key=lambda s: s["id"],
+    )
+    assert len(fake_reddit_server.requested_paths) == 1
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import json
+from datetime import date as Date
+from types import SimpleNamespace
+
+import pytest
+from common.bigquery_client import BigQueryClient
+from common.bigquery_client import BigQueryInsertError
+from google.api_core.exceptions import BadRequest
+from google.cloud import bigquery
+
+
+SCHEMA = [
+    bigquery.SchemaField("date", "DATE"),
+    bigquery.SchemaField("subreddit", "STRING"),
+    bigquery.SchemaField("posts", "INTEGER"),
+    bigquery.SchemaField("transformed_utc", "TIMESTAMP"),
+    bigquery.SchemaField("topics", "STRING", mode="REPEATED"),
+]
+
+
+class FakeBigQueryApiClient:
+    """Records the tables, load jobs and queries a BigQueryClient asks the BigQuery API for"""
+
+    def __init__(self, failing_query: bool = False, query_results: tuple[dict, ...] = ()):
+        self.failing_query = failing_query
+        self.query_results = query_results
+        self.created_tables: list[bigquery.Table] = []
+        self.deleted_tables: list[bigquery.Table] = []
+        self.loaded_rows: dict[str, list[dict] | str] = {}
+        self.queries: list[str] = []
+        self.query_job_configs: list[bigquery.QueryJobConfig] = []
+        self.streamed_rows: list[dict] = []
+        self.num_get_table_calls = 0
+
+    def get_table(self, table_ref):
+        self.num_get_table_calls += 1
+        table = bigquery.Table(table_ref, schema=SCHEMA)
+        table.time_partitioning = bigquery.TimePartitioning(field="date")
+        return table
+
+    def dataset(self, dataset_id: str):
+        return bigquery.DatasetReference("project", dataset_id)
+
+    def insert_rows(self, table_ref, rows, selected_fields):
+        self.streamed_rows.extend(rows)
+        return []
+
+    def create_table(self, table: bigquery.Table) -> bigquery.Table:
+        self.created_tables.append(table)
+        return table
+
+    def delete_table(self, table: bigquery.Table, not_found_ok: bool = False) -> None:
+        self.deleted_tables.append(table)
+
+    def load_table_from_json(self, rows, destination: bigquery.Table, job_config: bigquery.LoadJobConfig):
+        self.loaded_rows[destination.table_id] = list(rows)
+        return SimpleNamespace(result=lambda: None)
+
+    def load_table_from_uri(self, source_uri: str, destination: bigquery.Table, job_config: bigquery.LoadJobConfig):
+        self.loaded_rows[destination.table_id] = source_uri
+        return SimpleNamespace(result=lambda: None)
+
+    def query(self, query: str, job_config=None):
+        self.queries.append(query)
+        self.query_job_configs.append(job_config)
+
+        def result():
+            if self.failing_query:
+                raise BadRequest("MERGE failed")
+            return list(self.query_results) if query.strip().startswith("SELECT") else []
+
+        return SimpleNamespace(result=result)
+
+
+class FakeGcsClient:
+    """Stores uploaded objects as strings by bucket and object name"""
+
+    def __init__(self):
+        self.objects: dict[tuple[str, str], str] = {}
+        self.uploaded_objects: dict[tuple[str, str], str] = {}
+
+    def bucket(self, bucket_name: str):
+        return SimpleNamespace(blob=lambda blob_name: FakeBlob(self, bucket_name, blob_name))
+
+
+class FakeBlob:
+    def __init__(self, gcs_client: FakeGcsClient, bucket_name: str, name: str):
+        self.gcs_client = gcs_client
+        self.key = (bucket_name, name)
+        self.name = name
+
+    def upload_from_string(self, data: str, content_type: str) -> None:
+        self.gcs_client.objects[self.key] = data
+        self.gcs_client.uploaded_objects[self.key] = data
+
+    def delete(self) -> None:
+        del self.gcs_client.objects[self.key]
+
+
+def make_row_dict(subreddit: str, posts: int) -> dict:
+    return {
+        "subreddit": subreddit,
+        "date": "2023-07-28",
+        "posts": posts,
+        "transformed_utc": 1690502400.0,
+        "topics": ["exam"],
+    }
+
+
+def test_merge_upsert_stages_rows_and_runs_one_merge():
+    api_client = FakeBigQueryApiClient()
+    client = BigQueryClient(bigquery_client=api_client, upsert_strategy="merge")
+
+    client.insert_rows(
+        project_id="project",
+        dataset_id="dataset",
+        table_id="table",
+        row_dicts=[make_row_dict(f"subreddit{i}", i) for i in range(300)] + [make_row_dict("subreddit0", 7)],
+        enforce_unique_on=["subreddit", "date"],
+    )
+
+    (staging_table,) = api_client.created_tables
+    assert staging_table.table_id.startswith("table_staging_")
+    assert staging_table.expires is not None
+    assert [field.name for field in staging_table.schema] == ["date", "subreddit", "posts", "transformed_utc", "topics"]
+
+    staged_rows = api_client.loaded_rows[staging_table.table_id]
+    assert len(staged_rows) == 300
+    assert staged_rows[0] == {
+        "date": "2023-07-28",
+        "subreddit": "subreddit0",
+        "posts": 7,
+        "transformed_utc": "2023-07-28T00:00:00+00:00",
+        "topics": ["exam"],
+    }
+
+    (query,) = api_client.queries
+    assert "MERGE `project.dataset.table` AS target" in query
+    assert f"USING `project.dataset.{staging_table.table_id}` AS source" in query
+    assert (
+        "ON target.date IN UNNEST(@partition_values) AND target.subreddit = source.subreddit "
+        "AND target.date = source.date" in query
+    )
+    (partition_values_parameter,) = api_client.query_job_configs[0].query_parameters
+    assert partition_values_parameter.values == [Date(2023, 7, 28)]
+    assert "INSERT (date, subreddit, posts, transformed_utc, topics)" in query
+    assert api_client.deleted_tables == [staging_table]
+
+
+def test_merge_upsert_deletes_staging_table_when_merge_fails():
+    api_client = FakeBigQueryApiClient(failing_query=True)
+    client = BigQueryClient(bigquery_client=api_client, upsert_strategy="merge")
+
+    with pytest.raises(BigQueryInsertError):
+        client.insert_rows(
+            project_id="project",
+            dataset_id="dataset",
+            table_id="table",
+            row_dicts=[make_row_dict("subreddit0", 1)],
+            enforce_unique_on=["subreddit", "date"],
+        )
+    assert api_client.deleted_tables == api_client.created_tables
+
+
+def test_merge_upsert_of_no_rows_runs_no_jobs():
+    api_client = FakeBigQueryApiClient()
+    BigQueryClient(bigquery_client=api_client, upsert_strategy="merge").insert_rows(
+        project_id="project",
+        dataset_id="dataset",
+        table_id="table",
+        row_dicts=[],
+        enforce_unique_on=["subreddit", "date"],
+    )
+    assert api_client.created_tables == []
+    assert api_client.queries == []
+
+
+def test_bigquery_client_rejects_unknown_upsert_strategy():
+    with pytest.raises(ValueError):
+        BigQueryClient(bigquery_client=FakeBigQueryApiClient(), upsert_strategy="replace")
+
+
+def test_batch_insert_mode_loads_staging_table_from_staging_bucket():
+    api_client = FakeBigQueryApiClient()
+    gcs_client = FakeGcsClient()
+    client = BigQueryClient(
+        bigquery_client=api_client,
+        upsert_strategy="merge",
+        insert_mode="batch",
+        staging_bucket_name="transformed",
+        gcs_client=gcs_client,
+    )
+
+    client.insert_rows(
+        project_id="project",
+        dataset_id="dataset",
+        table_id="table",
+        row_dicts=[make_row_dict("subreddit0", 1), make_row_dict("subreddit1", 2)],
+        enforce_unique_on=["subreddit", "date"],
+    )
+
+    (staging_table,) = api_client.created_tables
+    object_name = f"_staging/{staging_table.table_id}.json"
+    assert api_client.loaded_rows[staging_table.table_id] == f"gs://transformed/{object_name}"
+    ndjson = gcs_client.uploaded_objects[("transformed", object_name)]
+    assert [json.loads(line)["subreddit"] for line in ndjson.splitlines()] == ["subreddit0", "subreddit1"]
+    assert gcs_client.objects == {}
+    assert len(api_client.queries) == 1
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"insert_mode": "append"},
+        {"insert_mode": "batch", "upsert_strategy": "update", "staging_bucket_name": "transformed"},
+        {"insert_mode": "batch", "upsert_strategy": "merge"},
+    ],
+)
+def test_bigquery_client_rejects_invalid_insert_mode(kwargs):
+    with pytest.raises(ValueError):
+        BigQueryClient(bigquery_client=FakeBigQueryApiClient(), gcs_client=FakeGcsClient(), **kwargs)
+
+
+def test_duplicate_lookup_matches_exact_keys_within_their_partitions():
+    api_client = FakeBigQueryApiClient()
+    client = BigQueryClient(bigquery_client=api_client)
+    row_dicts = [make_row_dict("cats", 1), {**make_row_dict("dogs", 2), "date": "2023-07-29"}]
+
+    client._get_duplicate_rows(
+        project_id="project",
+        dataset_id="dataset",
+        table_id="table",
+        row_dicts=row_dicts,
+        key_columns=["subreddit", "date"],
+    )
+
+    (query,) = api_client.queries
+    assert "SELECT subreddit, date\n" in query
+    assert "WHERE date IN UNNEST(@partition_values) AND (subreddit, date) IN UNNEST(@keys)" in query
+    keys_parameter, partition_values_parameter = api_client.query_job_configs[0].query_parameters
+    assert [key.struct_values for key in keys_parameter.values] == [
+        {"subreddit": "cats", "date": Date(2023, 7, 28)},
+        {"subreddit": "dogs", "date": Date(2023, 7, 29)},
+    ]
+    assert dict(keys_parameter.values[0].struct_types) == {"subreddit": "STRING", "date": "DATE"}
+    assert partition_values_parameter.array_type == "DATE"
+    assert partition_values_parameter.values == [Date(2023, 7, 28), Date(2023, 7, 29)]
+
+
+def test_update_strategy_updates_duplicate_rows_with_incoming_values():
+    api_client = FakeBigQueryApiClient(query_results=({"subreddit": "cats", "date": Date(2023, 7, 28)},))
+    client = BigQueryClient(bigquery_client=api_client)
+
+    client.insert_rows(
+        project_id="project",
+        dataset_id="dataset",
+        table_id="table",
+        row_dicts=[make_row_dict("cats", 5), make_row_dict("dogs", 2)],
+        enforce_unique_on=["subreddit", "date"],
+    )
+
+    _, update_query = api_client.queries
+    assert "SET subreddit = 'cats', date = '2023-07-28', posts = 5" in update_query
+    assert [row_dict["subreddit"] for row_dict in api_client.streamed_rows] == ["dogs"]
+
+
+def test_table_metadata_is_reused_across_clients():
+    api_client = FakeBigQueryApiClient()
+    for _ in range(3):
+        BigQueryClient(bigquery_client=api_client, upsert_strategy="merge").insert_rows(
+            project_id="project",
+            dataset_id="dataset",
+            table_id="table",
+            row_dicts=[make_row_dict("cats", 1)],
+            enforce_unique_on=["subreddit", "date"],
+        )
+    assert api_client.num_get_table_calls == 1
+    assert len(api_client.queries) == 3
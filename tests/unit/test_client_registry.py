@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import threading
+
+from common.client_registry import ClientRegistry
+from common.client_registry import TTLCache
+
+
+def test_client_registry_creates_each_client_once():
+    registry = ClientRegistry()
+    created = []
+
+    def create():
+        created.append(object())
+        return created[-1]
+
+    threads = [threading.Thread(target=registry.get, args=("gcs", create)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert registry.get("gcs", create) is created[0]
+    registry.clear()
+    assert registry.get("gcs", create) is created[1]
+
+
+def test_ttl_cache_reloads_expired_values():
+    now = [0.0]
+    cache = TTLCache(ttl_seconds=60, clock=lambda: now[0])
+    loads = []
+
+    def load():
+        loads.append(now[0])
+        return len(loads)
+
+    assert cache.get("bucket", load) == 1
+    now[0] = 59
+    assert cache.get("bucket", load) == 1
+    now[0] = 60
+    assert cache.get("bucket", load) == 2
+    cache.invalidate("bucket")
+    assert cache.get("bucket", load) == 3
+    assert cache.get("other-bucket", load) == 4
+
+
+def test_client_registry_creates_clients_built_from_other_clients():
+    registry = ClientRegistry()
+    client = registry.get("nlp", lambda: {"cache": registry.get("cache", dict)})
+    assert client["cache"] is registry.get("cache", dict)
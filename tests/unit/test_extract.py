@@ -2,9 +2,18 @@ from __future__ import annotations
 
 from itertools import product
 
+from common import config
 from common.reddit_client import RedditClient
+from common.utils import get_object_key
+from common.watermark_index import WatermarkIndex
 from extract import convert_submission_to_reddit_post
+from extract import fetch_new_posts_from_reddit
 from extract import fetch_posts_from_reddit
+from extract import fetch_posts_from_reddit_between_dates
+from extract import iter_posts_from_reddit
+from extract import merge_posts_into_cloud
+from extract import refresh_post_votes
+from fakes import FakeCloudStorageClient
 from fakes import FakeRedditClient
 
 
@@ -42,3 +51,99 @@ def test_fetch_posts_from_reddit(submissions, date_to_reddit_posts, subreddit_to
         )
 
         assert set(correct_reddit_posts) == set(fetched_reddit_posts)
+
+
+def test_fetch_posts_from_reddit_concurrently_keeps_subreddit_order(submissions, date_to_reddit_posts):
+    fake_reddit_client = FakeRedditClient(submissions)
+
+    for date in date_to_reddit_posts:
+        subreddits = ["dogs", "cats", "dogs"]
+        sequential_posts = fetch_posts_from_reddit(
+            reddit_client=fake_reddit_client,
+            date=date,
+            subreddits=subreddits,
+        )
+        concurrent_posts = fetch_posts_from_reddit(
+            reddit_client=fake_reddit_client,
+            date=date,
+            subreddits=subreddits,
+            max_workers=3,
+        )
+        assert concurrent_posts == sequential_posts
+
+
+def test_fetch_posts_from_reddit_between_dates(submissions, date_to_reddit_posts):
+    fake_reddit_client = FakeRedditClient(submissions)
+    dates = sorted(date_to_reddit_posts)
+
+    date_to_posts = fetch_posts_from_reddit_between_dates(
+        reddit_client=fake_reddit_client,
+        start_date=dates[0],
+        end_date=dates[-1],
+        subreddits=["cats", "dogs"],
+        max_workers=2,
+    )
+    assert sorted(date_to_posts) == dates
+    for date, posts in date_to_posts.items():
+        assert set(posts) == set(date_to_reddit_posts[date])
+
+
+def test_fetch_new_posts_from_reddit_and_merge(submissions, date_to_reddit_posts, bucket_name, monkeypatch):
+    monkeypatch.setattr(config, "GCS_RAW_BUCKET_NAME", bucket_name)
+    fake_reddit_client = FakeRedditClient(submissions)
+    fake_storage_client = FakeCloudStorageClient()
+    dates = sorted(date_to_reddit_posts)
+    watermark_index = WatermarkIndex([])
+    watermark_index.update("dogs", [submission for submission in submissions if submission["id"] == "3"])
+
+    new_posts = fetch_new_posts_from_reddit(
+        reddit_client=fake_reddit_client,
+        watermark_index=watermark_index,
+        default_since_date=dates[0],
+        subreddits=["cats", "dogs"],
+    )
+    assert sorted(post.post_id for post in new_posts) == ["1", "2", "4"]
+    assert watermark_index.get("dogs").post_id == "4"
+    assert watermark_index.get("cats").post_id == "2"
+
+    merge_posts_into_cloud(fake_storage_client, date_to_reddit_posts[dates[-1]][:1], dates[-1])
+    merge_posts_into_cloud(fake_storage_client, date_to_reddit_posts[dates[-1]], dates[-1])
+    stored_posts = fake_storage_client.buckets[bucket_name][get_object_key(dates[-1])]
+    assert set(stored_posts) == set(date_to_reddit_posts[dates[-1]])
+
+
+def test_iter_posts_from_reddit_fetches_lazily(submissions, date_to_reddit_posts):
+    fake_reddit_client = FakeRedditClient(submissions)
+    fetched_subreddits = []
+    fetch_submissions_made_on_date = fake_reddit_client.fetch_submissions_made_on_date
+
+    def counting_fetch_submissions_made_on_date(subreddit, date):
+        fetched_subreddits.append(subreddit)
+        return fetch_submissions_made_on_date(subreddit, date)
+
+    fake_reddit_client.fetch_submissions_made_on_date = counting_fetch_submissions_made_on_date
+    date = max(date_to_reddit_posts)
+    posts = iter_posts_from_reddit(
+        reddit_client=fake_reddit_client,
+        date=date,
+        subreddits=["dogs"] * 10,
+        max_workers=2,
+    )
+    first_post = next(posts)
+    assert first_post in date_to_reddit_posts[date]
+    assert len(fetched_subreddits) <= 3
+    assert len(list(posts)) == 10 * 2 - 1
+
+
+def test_refresh_post_votes(submissions, reddit_posts):
+    updated_submissions = [dict(submission, ups=submission["ups"] + 10, num_comments=20) for submission in submissions]
+    fake_reddit_client = FakeRedditClient(updated_submissions[1:])
+
+    refreshed_posts = refresh_post_votes(fake_reddit_client, reddit_posts)
+
+    assert refreshed_posts[0] == reddit_posts[0]
+    for refreshed_post, post in zip(refreshed_posts[1:], reddit_posts[1:]):
+        assert refreshed_post.upvotes == post.upvotes + 10
+        assert refreshed_post.comment_count == 20
+        assert refreshed_post.downvotes_estimated > post.downvotes_estimated
+        assert refreshed_post.title == post.title
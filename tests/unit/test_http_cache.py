@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import os
+import time
+
+import pytest
+from common.http_cache import CacheMissError
+from common.http_cache import CachingSession
+from common.http_cache import ListingCache
+from common.rate_limiter import RateLimiter
+from fakes import FakeRedditServer
+
+
+@pytest.fixture
+def fake_reddit_server(submissions):
+    with FakeRedditServer(submissions, page_size=1) as server:
+        yield server
+
+
+@pytest.fixture
+def listing_cache(tmp_path):
+    return ListingCache(directory=str(tmp_path), max_age_seconds=3600, max_bytes=1024 * 1024)
+
+
+def get_listing_page(session, server, after=None, limit=1):
+    params = {"limit": limit}
+    if after is not None:
+        params["after"] = after
+    response = session.get(f"{server.url}/r/dogs/new", params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def test_fresh_pages_are_served_from_cache(fake_reddit_server, listing_cache):
+    session = CachingSession(listing_cache, fresh_seconds=60)
+    first_page = get_listing_page(session, fake_reddit_server)
+    assert get_listing_page(session, fake_reddit_server) == first_page
+    assert len(fake_reddit_server.requested_paths) == 1
+
+
+def test_pages_are_keyed_by_after_cursor(fake_reddit_server, listing_cache):
+    session = CachingSession(listing_cache, fresh_seconds=60)
+    first_page = get_listing_page(session, fake_reddit_server)
+    second_page = get_listing_page(session, fake_reddit_server, after="t3_4")
+    assert first_page != second_page
+    assert len(fake_reddit_server.requested_paths) == 2
+
+
+def test_pages_are_keyed_by_whole_query_string(fake_reddit_server, listing_cache):
+    session = CachingSession(listing_cache, fresh_seconds=60)
+    get_listing_page(session, fake_reddit_server, limit=1)
+    get_listing_page(session, fake_reddit_server, limit=2)
+    assert len(fake_reddit_server.requested_paths) == 2
+
+
+def test_only_requests_sent_to_reddit_wait_for_rate_limiter(fake_reddit_server, listing_cache):
+    rate_limiter = RateLimiter(requests_per_minute=60000)
+    session = CachingSession(listing_cache, fresh_seconds=60, rate_limiter=rate_limiter)
+    for _ in range(3):
+        get_listing_page(session, fake_reddit_server)
+
+    replay_session = CachingSession(listing_cache, mode="replay", rate_limiter=rate_limiter)
+    get_listing_page(replay_session, fake_reddit_server)
+    assert rate_limiter.stats()["requests"] == 1
+
+
+def test_stale_pages_are_revalidated_with_etag(fake_reddit_server, listing_cache):
+    session = CachingSession(listing_cache, fresh_seconds=0)
+    first_page = get_listing_page(session, fake_reddit_server)
+    assert get_listing_page(session, fake_reddit_server) == first_page
+    assert fake_reddit_server.response_statuses == [200, 304]
+
+
+def test_record_then_replay(fake_reddit_server, listing_cache):
+    recorded_page = get_listing_page(CachingSession(listing_cache, mode="record"), fake_reddit_server)
+
+    replay_session = CachingSession(listing_cache, mode="replay")
+    assert get_listing_page(replay_session, fake_reddit_server) == recorded_page
+    assert len(fake_reddit_server.requested_paths) == 1
+    with pytest.raises(CacheMissError):
+        get_listing_page(replay_session, fake_reddit_server, after="t3_4")
+
+
+def test_evicts_expired_entries(tmp_path):
+    listing_cache = ListingCache(directory=str(tmp_path), max_age_seconds=60, max_bytes=1024 * 1024)
+    listing_cache.put("dogs:", None, {}, "{}")
+    expired_time = time.time() - 120
+    for path in tmp_path.glob("*.json"):
+        os.utime(path, (expired_time, expired_time))
+    listing_cache.evict()
+    assert list(tmp_path.glob("*.json")) == []
+
+
+def test_evicts_oldest_entries_beyond_max_bytes(tmp_path):
+    listing_cache = ListingCache(directory=str(tmp_path), max_age_seconds=3600, max_bytes=300)
+    for i in range(3):
+        listing_cache.put(f"dogs:t3_{i}", None, {}, "x" * 100)
+        modified_time = time.time() - 10 + i
+        os.utime(listing_cache._get_path(f"dogs:t3_{i}"), (modified_time, modified_time))
+    listing_cache.evict()
+    assert listing_cache.get("dogs:t3_0") is None
+    assert listing_cache.get("dogs:t3_2") is not None
+
+
+def test_put_scans_directory_only_when_cache_outgrows_max_bytes(tmp_path, monkeypatch):
+    listing_cache = ListingCache(
+        directory=str(tmp_path),
+        max_age_seconds=3600,
+        max_bytes=1000,
+        eviction_interval_seconds=3600,
+    )
+    listing_cache.evict()
+    num_evictions = 0
+    evict = listing_cache.evict
+
+    def counting_evict():
+        nonlocal num_evictions
+        num_evictions += 1
+        evict()
+
+    monkeypatch.setattr(listing_cache, "evict", counting_evict)
+    for i in range(3):
+        listing_cache.put(f"dogs:t3_{i}", None, {}, "x" * 100)
+    assert num_evictions == 0
+    for i in range(3, 10):
+        listing_cache.put(f"dogs:t3_{i}", None, {}, "x" * 100)
+    assert num_evictions > 0
+    assert sum(path.stat().st_size for path in tmp_path.glob("*.json")) <= 1000
@@ -2,9 +2,18 @@ from __future__ import annotations
 
 import math
 from datetime import date as Date
+from datetime import timedelta
 from itertools import product
 
+import load
+import pytest
+from common import config
+from common.utils import get_object_key
 from fakes import FakeBigQueryClient
+from fakes import FakeCloudStorageClient
+from fastapi.testclient import TestClient
+from load import download_subreddit_metrics_of_objects
+from load import load_objects_into_bigquery
 from load import load_subreddit_metrics_into_bigquery
 from load import parse_subreddit_metrics_to_bigquery_row_dict
 
@@ -37,3 +46,91 @@ def test_load_subreddit_metrics_into_bigquery(
         )
         stored_data = fake_bigquery_client.data[project_id][dataset_id][table_id]
         assert stored_data == subreddit_metrics_bigquery_rows
+
+
+def test_download_subreddit_metrics_of_objects_skips_missing_objects(subreddit_metrics_list):
+    fake_storage_client = FakeCloudStorageClient()
+    object_keys = [get_object_key(Date(2023, 7, day)) for day in range(1, 5)]
+    for object_key, metrics in zip(object_keys[:3], subreddit_metrics_list):
+        fake_storage_client.upload([metrics], "bucket", object_key)
+
+    downloaded_metrics = download_subreddit_metrics_of_objects(
+        storage_client=fake_storage_client,
+        bucket_name="bucket",
+        object_keys=object_keys,
+        max_workers=2,
+    )
+    assert downloaded_metrics == subreddit_metrics_list[:3]
+
+
+def test_load_objects_into_bigquery_upserts_all_days_at_once(subreddit_metrics_list, subreddit_metrics_bigquery_rows):
+    fake_bigquery_client = FakeBigQueryClient()
+    fake_storage_client = FakeCloudStorageClient()
+    object_keys = [get_object_key(Date(2023, 7, day)) for day in range(1, len(subreddit_metrics_list) + 1)]
+    for object_key, metrics in zip(object_keys, subreddit_metrics_list):
+        fake_storage_client.upload([metrics], config.GCS_TRANSFORMED_BUCKET_NAME, object_key)
+
+    load_objects_into_bigquery(
+        bigquery_client=fake_bigquery_client,
+        storage_client=fake_storage_client,
+        object_keys=object_keys,
+        max_workers=4,
+    )
+
+    assert fake_bigquery_client.num_insert_calls == 1
+    stored_data = fake_bigquery_client.data[config.BIGQUERY_PROJECT_ID][config.BIGQUERY_DATASET_ID]
+    assert stored_data[config.BIGQUERY_TABLE_ID] == subreddit_metrics_bigquery_rows
+
+
+@pytest.fixture
+def loaded_object_keys(monkeypatch) -> list[list[str]]:
+    """Object keys of each load_objects call the endpoints make"""
+    calls: list[list[str]] = []
+
+    def load_objects(object_keys: list[str]) -> None:
+        calls.append(object_keys)
+
+    monkeypatch.setattr(load, "load_objects", load_objects)
+    return calls
+
+
+def test_load_range_endpoint_loads_each_day_of_range(loaded_object_keys):
+    response = TestClient(load.app).get("/load_range", params={"start_date": "30/07/2023", "end_date": "01/08/2023"})
+    assert response.status_code == 200
+    dates = [Date(2023, 7, 30), Date(2023, 7, 31), Date(2023, 8, 1)]
+    assert loaded_object_keys == [[get_object_key(date) for date in dates]]
+
+
+@pytest.mark.parametrize(
+    "start_date, end_date",
+    [
+        ("2023-07-30", "01/08/2023"),
+        ("02/08/2023", "01/08/2023"),
+        ("01/01/2023", "01/08/2023"),
+    ],
+)
+def test_load_range_endpoint_rejects_invalid_ranges(loaded_object_keys, start_date, end_date):
+    response = TestClient(load.app).get("/load_range", params={"start_date": start_date, "end_date": end_date})
+    assert response.status_code == 400
+    assert loaded_object_keys == []
+
+
+def test_load_objects_endpoint_ignores_objects_not_holding_a_day(loaded_object_keys):
+    object_keys = [get_object_key(Date(2023, 7, 30)), "_staging/table.json"]
+    response = TestClient(load.app).post("/load_objects", json={"object_keys": object_keys})
+    assert response.status_code == 200
+    assert loaded_object_keys == [object_keys[:1]]
+
+
+def test_load_objects_endpoint_rejects_too_many_objects(loaded_object_keys):
+    object_keys = [get_object_key(Date(2023, 1, 1) + timedelta(days=i)) for i in range(config.LOAD_MAX_DAYS + 1)]
+    response = TestClient(load.app).post("/load_objects", json={"object_keys": object_keys})
+    assert response.status_code == 400
+    assert loaded_object_keys == []
+
+
+def test_load_objects_endpoint_rejects_objects_of_invalid_dates(loaded_object_keys):
+    object_keys = [get_object_key(Date(2023, 7, 30)), "year=2023/month=07/day=99.json"]
+    response = TestClient(load.app).post("/load_objects", json={"object_keys": object_keys})
+    assert response.status_code == 400
+    assert loaded_object_keys == []
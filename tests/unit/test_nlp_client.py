@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+from common.nlp_client import compute_integrated_sentiment_score
+from common.nlp_client import get_backoff_delay
+from common.nlp_client import GoogleNLPClient
+from common.nlp_client import HuggingFaceNLPClient
+from common.nlp_client import InferenceException
+from common.nlp_client import InferenceRateLimitException
+from common.nlp_client import LocalNLPClient
+from common.rate_limiter import RateLimiter
+from google.api_core.exceptions import InvalidArgument
+from google.api_core.exceptions import ResourceExhausted
+
+
+def make_response(status_code: int, body) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode("utf-8")
+    return response
+
+
+def make_sentiment(score: float) -> list[dict]:
+    return [
+        {"label": "POS", "score": score},
+        {"label": "NEG", "score": 0.0},
+        {"label": "NEU", "score": 0.0},
+    ]
+
+
+class FakeInferenceSession:
+    """Scores each text by its length, after answering with the given error responses"""
+
+    def __init__(self, error_responses: tuple[requests.Response, ...] = ()):
+        self.error_responses = list(error_responses)
+        self.batches: list[list[str]] = []
+        self._lock = threading.Lock()
+
+    def post(self, url: str, data: bytes) -> requests.Response:
+        with self._lock:
+            if self.error_responses:
+                return self.error_responses.pop(0)
+            texts = json.loads(data)
+            self.batches.append(texts)
+        return make_response(200, [make_sentiment(len(text) / 100) for text in texts])
+
+
+def make_client(session: FakeInferenceSession, **kwargs) -> HuggingFaceNLPClient:
+    client = HuggingFaceNLPClient(model="model", api_token="token", backoff_base_seconds=0, **kwargs)
+    client.session = session  # type: ignore
+    return client
+
+
+def test_huggingface_client_batches_texts_and_preserves_order():
+    session = FakeInferenceSession()
+    client = make_client(session, batch_size=3, max_concurrent_requests=4)
+    texts = ["a" * i for i in range(10)]
+
+    scores = client.compute_sentiment_scores(texts)
+
+    assert scores == pytest.approx([i / 100 for i in range(10)])
+    assert sorted(len(batch) for batch in session.batches) == [1, 3, 3, 3]
+
+
+def test_huggingface_client_sends_no_request_for_no_texts():
+    session = FakeInferenceSession()
+    client = make_client(session)
+    assert client.compute_sentiment_scores([]) == []
+    assert session.batches == []
+
+
+def test_huggingface_client_retries_when_rate_limited_or_loading():
+    loading = make_response(503, {"error": "Model is currently loading", "estimated_time": 0})
+    session = FakeInferenceSession([make_response(429, {"error": "Rate limited"}), loading])
+    client = make_client(session)
+
+    assert client.compute_sentiment_scores(["ab"]) == pytest.approx([0.02])
+
+
+def test_huggingface_client_gives_up_after_max_retries():
+    session = FakeInferenceSession([make_response(429, {"error": "Rate limited"})] * 3)
+    client = make_client(session, max_retries=2)
+
+    with pytest.raises(InferenceRateLimitException):
+        client.compute_sentiment_scores(["ab"])
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        delay = get_backoff_delay(attempt, base_seconds=1, max_seconds=8)
+        assert 0 <= delay <= min(8, 2**attempt)
+
+
+def test_integrated_sentiment_score():
+    label_scores = [
+        {"label": "POS", "score": 0.5},
+        {"label": "NEG", "score": 0.1},
+        {"label": "NEU", "score": 0.4},
+    ]
+    assert compute_integrated_sentiment_score(label_scores) == pytest.approx(0.4 / 0.6)
+
+
+def test_integrated_sentiment_score_rejects_missing_label():
+    with pytest.raises(InferenceException):
+        compute_integrated_sentiment_score([{"label": "POS", "score": 1.0}])
+
+
+def make_tiny_sentiment_model(directory) -> str:
+    transformers = pytest.importorskip("transformers")
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "good", "bad", "day"]
+    vocab_path = directory / "vocab.txt"
+    vocab_path.write_text("\n".join(vocab))
+    transformers.BertTokenizer(vocab_file=str(vocab_path)).save_pretrained(directory)
+
+    model_config = transformers.BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=8,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=16,
+        num_labels=3,
+        id2label={0: "NEG", 1: "NEU", 2: "POS"},
+        label2id={"NEG": 0, "NEU": 1, "POS": 2},
+    )
+    transformers.BertForSequenceClassification(model_config).save_pretrained(directory)
+    return str(directory)
+
+
+def test_local_client_matches_unbatched_scores(tmp_path):
+    torch = pytest.importorskip("torch")
+    model = make_tiny_sentiment_model(tmp_path)
+    texts = ["good day", "bad", "good good good day", "day", "bad day"]
+
+    client = LocalNLPClient(model=model, batch_size=2)
+    scores = client.compute_sentiment_scores(texts)
+
+    for text, score in zip(texts, scores):
+        inputs = client.tokenizer([text], return_tensors="pt")
+        with torch.inference_mode():
+            neg, neu, pos = torch.softmax(client.model(**inputs).logits, dim=-1)[0].tolist()
+        assert score == pytest.approx((pos - neg) / (1 - neu), abs=1e-5)
+
+
+def test_local_client_loads_model_once(tmp_path):
+    pytest.importorskip("torch")
+    model = make_tiny_sentiment_model(tmp_path)
+    assert LocalNLPClient(model=model).model is LocalNLPClient(model=model).model
+
+
+class FakeLanguageServiceClient:
+    """Scores each text by its length, failing the first calls with the given exceptions"""
+
+    def __init__(self, exceptions: tuple[Exception, ...] = ()):
+        self.exceptions = list(exceptions)
+        self.num_in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def analyze_sentiment(self, request: dict):
+        with self._lock:
+            if self.exceptions:
+                raise self.exceptions.pop(0)
+            self.num_in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.num_in_flight)
+        time.sleep(0.01)
+        with self._lock:
+            self.num_in_flight -= 1
+
+        content = request["document"]["content"]
+        if content == "autre langue":
+            raise InvalidArgument("Unsupported language")
+        return SimpleNamespace(document_sentiment=SimpleNamespace(score=len(content) / 100))
+
+
+def test_google_client_scores_texts_concurrently_in_order():
+    language_client = FakeLanguageServiceClient()
+    client = GoogleNLPClient(language_client=language_client, max_concurrent_requests=4)  # type: ignore
+    texts = ["a" * i for i in range(1, 17)]
+
+    assert client.compute_sentiment_scores(texts) == pytest.approx([i / 100 for i in range(1, 17)])
+    assert 1 < language_client.max_in_flight <= 4
+
+
+def test_google_client_returns_none_for_unsupported_language():
+    client = GoogleNLPClient(language_client=FakeLanguageServiceClient())  # type: ignore
+    assert client.compute_sentiment_scores(["ab", "autre langue"]) == [0.02, None]
+
+
+def test_google_client_retries_when_quota_is_exhausted():
+    language_client = FakeLanguageServiceClient((ResourceExhausted("Quota exceeded"),) * 2)
+    rate_limiter = RateLimiter(requests_per_minute=60000)
+    client = GoogleNLPClient(
+        language_client=language_client,  # type: ignore
+        rate_limiter=rate_limiter,
+        backoff_base_seconds=0,
+    )
+
+    assert client.compute_sentiment_scores(["ab"]) == [0.02]
+    assert rate_limiter.stats()["requests"] == 3
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from common.rate_limiter import RateLimiter
+
+
+def test_rate_limiter_spaces_reservations():
+    rate_limiter = RateLimiter(requests_per_minute=60)
+    delays = [rate_limiter.reserve() for _ in range(3)]
+    assert delays[0] == 0
+    assert delays[1] == pytest.approx(1, abs=0.05)
+    assert delays[2] == pytest.approx(2, abs=0.05)
+
+
+def test_rate_limiter_is_shared_between_threads():
+    rate_limiter = RateLimiter(requests_per_minute=600)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        delays = sorted(executor.map(lambda _: rate_limiter.reserve(), range(8)))
+    for i, delay in enumerate(delays):
+        assert delay == pytest.approx(i * 0.1, abs=0.05)
+
+
+def test_rate_limiter_rejects_non_positive_rate():
+    with pytest.raises(ValueError):
+        RateLimiter(requests_per_minute=0)
+
+
+def test_rate_limiter_spreads_remaining_quota_over_window():
+    rate_limiter = RateLimiter(requests_per_minute=1)
+    rate_limiter.update_from_headers({"x-ratelimit-remaining": "10", "x-ratelimit-reset": "5"})
+    delays = [rate_limiter.reserve() for _ in range(3)]
+    assert delays[0] == 0
+    assert delays[1] == pytest.approx(0.5, abs=0.05)
+    assert delays[2] == pytest.approx(1.0, abs=0.05)
+
+
+def test_rate_limiter_waits_for_reset_when_quota_is_used_up():
+    rate_limiter = RateLimiter(requests_per_minute=600)
+    rate_limiter.update_from_headers({"x-ratelimit-remaining": "0", "x-ratelimit-reset": "3"})
+    assert rate_limiter.reserve() == pytest.approx(3, abs=0.05)
+
+
+def test_rate_limiter_spaces_requests_waiting_for_reset():
+    rate_limiter = RateLimiter(requests_per_minute=600)
+    rate_limiter.update_from_headers({"x-ratelimit-remaining": "0", "x-ratelimit-reset": "10"})
+    delays = [rate_limiter.reserve() for _ in range(5)]
+    assert delays == pytest.approx([10.0, 10.1, 10.2, 10.3, 10.4], abs=0.05)
+
+
+def test_rate_limiter_ignores_responses_without_headers():
+    rate_limiter = RateLimiter(requests_per_minute=60)
+    rate_limiter.update_from_headers({})
+    rate_limiter.reserve()
+    assert rate_limiter.reserve() == pytest.approx(1, abs=0.05)
+
+
+def test_rate_limiter_stats():
+    rate_limiter = RateLimiter(requests_per_minute=60)
+    delays = [rate_limiter.reserve() for _ in range(3)]
+    stats = rate_limiter.stats()
+    assert stats["requests"] == 3
+    assert stats["delayed_requests"] == 2
+    assert stats["seconds_waited"] == pytest.approx(sum(delays))
@@ -5,6 +5,8 @@ from datetime import timedelta
 from unittest.mock import MagicMock
 
 import pytest
+from common.models import SubredditWatermark
+from common.reddit_client import bucket_submissions_by_date
 from common.reddit_client import RedditClient
 from prawcore.exceptions import Forbidden
 from requests import Response
@@ -85,3 +87,103 @@ def test_fetch_submissions_made_on_date_no_posts(reddit_client, subreddit_new_mo
     subreddit_new_mock.return_value = []
     result = reddit_client.fetch_submissions_made_on_date("test_subreddit", datetime(2023, 7, 28))
     assert result == []
+
+
+def test_bucket_submissions_by_date():
+    submissions = [
+        {"created_utc": 1633393174},  # 5th Oct 2021
+        {"created_utc": 1633306774},  # 4th Oct 2021
+        {"created_utc": 1633220374},  # 3rd Oct 2021
+    ]
+    result = bucket_submissions_by_date(
+        submissions,
+        start_date=datetime(2021, 10, 4).date(),
+        end_date=datetime(2021, 10, 6).date(),
+    )
+    assert result == {
+        datetime(2021, 10, 4).date(): [{"created_utc": 1633306774}],
+        datetime(2021, 10, 5).date(): [{"created_utc": 1633393174}],
+        datetime(2021, 10, 6).date(): [],
+    }
+
+
+def test_fetch_submissions_made_between_dates_walks_listing_once(reddit_client, subreddit_new_mock, post_data):
+    subreddit_new_mock.side_effect = [post_data[::-1], []]
+    result = reddit_client.fetch_submissions_made_between_dates(
+        "test_subreddit",
+        start_date=datetime(2023, 7, 28).date(),
+        end_date=datetime(2023, 7, 29).date(),
+    )
+    assert subreddit_new_mock.call_count == 2
+    assert [submission["id"] for submission in result[datetime(2023, 7, 28).date()]] == ["post1"]
+    assert [submission["id"] for submission in result[datetime(2023, 7, 29).date()]] == ["post2"]
+
+
+def test_fetch_submissions_newer_than_watermark_stops_at_watermark(reddit_client, subreddit_new_mock, post_data):
+    subreddit_new_mock.side_effect = [post_data[::-1], post_data[::-1]]
+    watermark = SubredditWatermark(
+        date=datetime(2023, 7, 28).date(),
+        subreddit="test_subreddit",
+        post_id="post1",
+        created_utc=post_data[0].created_utc,
+    )
+    result = reddit_client.fetch_submissions_newer_than_watermark(
+        "test_subreddit",
+        watermark=watermark,
+        since_date=datetime(2023, 7, 1).date(),
+    )
+    assert subreddit_new_mock.call_count == 1
+    assert [submission["id"] for submission in result] == ["post2"]
+
+
+def test_fetch_submissions_made_on_date_from_raw_listings(post_data):
+    reddit_client = RedditClient(
+        reddit_client_id="YOUR_CLIENT_ID",
+        reddit_client_secret="YOUR_CLIENT_SECRET",
+        reddit_user_agent="YOUR_USER_AGENT",
+        raw_listings=True,
+    )
+    listing = {
+        "kind": "Listing",
+        "data": {
+            "children": [
+                {
+                    "kind": "t3",
+                    "data": {
+                        "id": post.id,
+                        "title": post.title,
+                        "selftext": post.selftext,
+                        "subreddit": post.subreddit.display_name,
+                        "upvote_ratio": post.upvote_ratio,
+                        "ups": post.ups,
+                        "downs": post.downs,
+                        "total_awards_received": post.total_awards_received,
+                        "num_comments": post.num_comments,
+                        "created_utc": post.created_utc,
+                    },
+                }
+                for post in post_data[::-1]
+            ],
+        },
+    }
+    reddit_client.reddit_client.request = MagicMock(side_effect=[listing, {"data": {"children": []}}])
+    result = reddit_client.fetch_submissions_made_on_date("test_subreddit", datetime(2023, 7, 28).date())
+
+    assert reddit_client.reddit_client.request.call_count == 2
+    assert len(result) == 1
+    submission = result[0]
+    assert submission["id"] == "post1"
+    assert submission["body"] == "This is test post 1."
+    assert submission["subreddit_display_name"] == "test_subreddit"
+    assert submission["total_awards_received"] == 1
+
+
+def test_fetch_submissions_by_ids_batches_requests(reddit_client, post_data):
+    reddit_client.reddit_client.info = MagicMock(return_value=post_data)
+    post_ids = [f"id{i}" for i in range(250)]
+    result = reddit_client.fetch_submissions_by_ids(post_ids)
+
+    assert reddit_client.reddit_client.info.call_count == 3
+    first_batch = reddit_client.reddit_client.info.call_args_list[0].kwargs["fullnames"]
+    assert first_batch == [f"t3_id{i}" for i in range(100)]
+    assert len(result) == 3 * len(post_data)
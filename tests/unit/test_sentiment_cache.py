@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import time
+
+from common.sentiment_cache import CachingNLPClient
+from common.sentiment_cache import get_sentiment_cache_key
+from common.sentiment_cache import InMemorySentimentCache
+from common.sentiment_cache import SqliteSentimentCache
+from fakes import FakeNLPClient
+
+
+def make_sqlite_cache(tmp_path, max_age_seconds=3600, max_entries=100) -> SqliteSentimentCache:
+    return SqliteSentimentCache(
+        path=str(tmp_path / "sentiments.sqlite3"),
+        max_age_seconds=max_age_seconds,
+        max_entries=max_entries,
+    )
+
+
+def test_cache_key_normalizes_whitespace_and_includes_model():
+    assert get_sentiment_cache_key("model", " Hello   world\n") == get_sentiment_cache_key("model", "Hello world")
+    assert get_sentiment_cache_key("model", "Hello") != get_sentiment_cache_key("other-model", "Hello")
+    assert get_sentiment_cache_key("model", "Hello") != get_sentiment_cache_key("model", "hello")
+
+
+def test_in_memory_cache_evicts_least_recently_used():
+    cache = InMemorySentimentCache(max_entries=2)
+    cache.put_many({"a": 0.1, "b": 0.2})
+    cache.get_many(["a"])
+    cache.put_many({"c": None})
+    assert cache.get_many(["a", "b", "c"]) == {"a": 0.1, "c": None}
+
+
+def test_sqlite_cache_evicts_old_and_excess_entries(tmp_path):
+    cache = make_sqlite_cache(tmp_path, max_entries=2)
+    cache.put_many({"a": 0.1})
+    time.sleep(0.01)
+    cache.put_many({"b": None, "c": 0.3})
+    assert cache.get_many(["a", "b", "c"]) == {"b": None, "c": 0.3}
+
+    expired_cache = make_sqlite_cache(tmp_path, max_age_seconds=0)
+    assert expired_cache.get_many(["b", "c"]) == {}
+
+
+def test_caching_client_only_scores_unseen_texts(tmp_path):
+    fake_nlp_client = FakeNLPClient({"good": 0.5, "bad": -0.5, "other language": None})
+    caching_client = CachingNLPClient(
+        nlp_client=fake_nlp_client,
+        model="model",
+        memory_cache=InMemorySentimentCache(max_entries=100),
+        persistent_cache=make_sqlite_cache(tmp_path),
+    )
+
+    assert caching_client.compute_sentiment_scores(["good", "other language", "good"]) == [0.5, None, 0.5]
+    assert caching_client.compute_sentiment_scores(["bad", "other language", "good"]) == [-0.5, None, 0.5]
+    assert fake_nlp_client.requested_texts == ["good", "other language", "bad"]
+    assert caching_client.stats() == {"memory_hits": 2, "persistent_hits": 0, "misses": 3}
+
+
+def test_caching_client_reads_through_persistent_cache(tmp_path):
+    fake_nlp_client = FakeNLPClient({"good": 0.5})
+    first_client = CachingNLPClient(
+        nlp_client=fake_nlp_client,
+        model="model",
+        memory_cache=InMemorySentimentCache(max_entries=100),
+        persistent_cache=make_sqlite_cache(tmp_path),
+    )
+    first_client.compute_sentiment_scores(["good"])
+
+    restarted_client = CachingNLPClient(
+        nlp_client=fake_nlp_client,
+        model="model",
+        memory_cache=InMemorySentimentCache(max_entries=100),
+        persistent_cache=make_sqlite_cache(tmp_path),
+    )
+    assert restarted_client.compute_sentiment_scores(["good"]) == [0.5]
+    assert fake_nlp_client.requested_texts == ["good"]
+    assert restarted_client.stats() == {"memory_hits": 0, "persistent_hits": 1, "misses": 0}
+
+
+def test_sqlite_cache_only_evicts_once_it_may_exceed_max_entries(tmp_path, monkeypatch):
+    cache = make_sqlite_cache(tmp_path, max_entries=3)
+    cache.eviction_interval_seconds = 3600
+    cache.evict()
+    num_evictions = 0
+    evict = cache.evict
+
+    def counting_evict():
+        nonlocal num_evictions
+        num_evictions += 1
+        evict()
+
+    monkeypatch.setattr(cache, "evict", counting_evict)
+    cache.put_many({"a": 0.1, "b": 0.2})
+    cache.put_many({"c": 0.3})
+    assert num_evictions == 0
+    cache.put_many({"d": 0.4})
+    assert num_evictions == 1
+    assert cache.get_many(["a", "b", "c", "d"]) == {"b": 0.2, "c": 0.3, "d": 0.4}
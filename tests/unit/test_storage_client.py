@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import io
+
+import pytest
+from common.models import RedditPost
+from common.storage_client import GoogleCloudStorageClient
+from google.api_core.exceptions import NotFound
+
+
+class FakeBucket:
+    """Stores objects as bytes by name, with their content encoding and generation"""
+
+    def __init__(self):
+        self.objects: dict[str, tuple[bytes, str | None, int]] = {}
+        self.num_generations = 0
+
+    def blob(self, name: str, chunk_size: int | None = None) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str) -> FakeBlob | None:
+        if name not in self.objects:
+            return None
+        blob = FakeBlob(self, name)
+        _, blob.content_encoding, blob.generation = self.objects[name]
+        return blob
+
+    def store(self, name: str, data: bytes, content_encoding: str | None) -> None:
+        self.num_generations += 1
+        self.objects[name] = (data, content_encoding, self.num_generations)
+
+    def copy_blob(self, blob: FakeBlob, destination_bucket: FakeBucket, new_name: str) -> None:
+        data, content_encoding, _ = self.objects[blob.name]
+        destination_bucket.store(new_name, data, content_encoding)
+
+
+class FakeBlob:
+    def __init__(self, bucket: FakeBucket, name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_encoding: str | None = None
+        self.generation = 0
+
+    def open(self, mode: str, **kwargs) -> io.BytesIO:
+        if mode == "rb":
+            return io.BytesIO(self.bucket.objects[self.name][0])
+        return FakeBlobWriter(self)
+
+    def upload_from_string(self, data: str | bytes, **kwargs) -> None:
+        self.bucket.store(self.name, data.encode("utf-8") if isinstance(data, str) else data, self.content_encoding)
+
+    def download_as_bytes(self, **kwargs) -> bytes:
+        return self.bucket.objects[self.name][0]
+
+    def delete(self) -> None:
+        if self.bucket.objects.pop(self.name, None) is None:
+            raise NotFound(f"Object {self.name} not found")
+
+
+class FakeBlobWriter(io.BytesIO):
+    """Like the library's BlobWriter, finalizes the object on close, even when closed by an error"""
+
+    def __init__(self, blob: FakeBlob):
+        super().__init__()
+        self.blob = blob
+
+    def close(self) -> None:
+        if not self.closed:
+            self.blob.bucket.store(self.blob.name, self.getvalue(), self.blob.content_encoding)
+        super().close()
+
+
+class FakeGcsClient:
+    def __init__(self):
+        self.bucket = FakeBucket()
+
+    def get_bucket(self, bucket_name: str) -> FakeBucket:
+        return self.bucket
+
+
+@pytest.fixture
+def gcs_client() -> FakeGcsClient:
+    return FakeGcsClient()
+
+
+def test_upload_stream_copies_complete_upload_to_object_key(gcs_client, reddit_posts):
+    storage_client = GoogleCloudStorageClient(compression="gzip", gcs_client=gcs_client)
+    storage_client.upload_stream(iter(reddit_posts), "bucket", "year=2023/month=07/day=28.json")
+
+    assert list(gcs_client.bucket.objects) == ["year=2023/month=07/day=28.json"]
+    assert storage_client.download(RedditPost, "bucket", "year=2023/month=07/day=28.json") == reddit_posts
+
+
+@pytest.mark.parametrize("storage_format", ["json", "parquet"])
+def test_upload_stream_leaves_object_key_unchanged_when_objects_fail(gcs_client, reddit_posts, storage_format):
+    storage_client = GoogleCloudStorageClient(storage_format=storage_format, compression="gzip", gcs_client=gcs_client)
+    storage_client.upload(reddit_posts, "bucket", "year=2023/month=07/day=28.json")
+    stored_object = gcs_client.bucket.objects["year=2023/month=07/day=28.json"]
+
+    def iter_posts_failing_partway():
+        yield from reddit_posts[:2]
+        raise ConnectionError("Reddit went away")
+
+    with pytest.raises(ConnectionError):
+        storage_client.upload_stream(iter_posts_failing_partway(), "bucket", "year=2023/month=07/day=28.json")
+
+    assert gcs_client.bucket.objects == {"year=2023/month=07/day=28.json": stored_object}
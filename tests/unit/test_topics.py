@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from datetime import date as Date
+
+import numpy as np
+import pytest
+from common.topics import build_document_term_matrix
+from common.topics import compute_distinctive_terms
+from common.topics import DocumentFrequencyIndex
+from common.topics import tokenize
+from fakes import FakeCloudStorageClient
+from fakes import RacingStorageClient
+
+
+def test_tokenize_drops_stop_words_and_short_tokens():
+    assert tokenize("Is the CS41 exam hard? I'm asking for a friend's sake!") == [
+        "cs41",
+        "exam",
+        "hard",
+        "asking",
+        "friend's",
+        "sake",
+    ]
+
+
+def test_build_document_term_matrix_is_binary():
+    matrix, terms = build_document_term_matrix(["exam exam results", "results", ""])
+    term_to_column = {term: column for column, term in enumerate(terms)}
+    assert matrix.shape == (3, 2)
+    assert matrix[0, term_to_column["exam"]] == 1
+    assert matrix[0].nnz == 2
+    assert matrix[1, term_to_column["results"]] == 1
+    assert matrix[1].nnz == 1
+    assert matrix[2].nnz == 0
+
+
+def test_document_frequency_index_replaces_counts_of_a_date_updated_again():
+    index = DocumentFrequencyIndex.empty(max_terms=10)
+    terms = np.array(["exam", "housing"], dtype=object)
+    index.update(Date(2023, 7, 1), terms, np.array([2, 1]), num_documents=3)
+    index.update(Date(2023, 7, 1), terms, np.array([3, 0]), num_documents=4)
+    index.update(Date(2023, 7, 2), terms, np.array([1, 0]), num_documents=1)
+
+    assert index.document_frequencies.num_documents == 5
+    assert index.document_frequencies.document_frequencies == {"exam": 4}
+    assert index.document_frequencies.counted_dates == [Date(2023, 7, 1), Date(2023, 7, 2)]
+    idfs = index.get_inverse_document_frequencies(np.array(["exam", "housing", "unseen"], dtype=object))
+    assert idfs[0] < idfs[1] == idfs[2]
+
+
+def test_stored_document_frequency_index_replaces_counts_of_a_retransformed_date():
+    storage_client = FakeCloudStorageClient()
+    terms = np.array(["exam", "housing"], dtype=object)
+    for term_document_counts, num_documents in ((np.array([2, 1]), 3), (np.array([5, 0]), 6)):
+        index = DocumentFrequencyIndex.load(storage_client, "bucket", max_terms=10)
+        index.update(Date(2023, 7, 1), terms, term_document_counts, num_documents)
+        index.save(storage_client, "bucket")
+
+    loaded_index = DocumentFrequencyIndex.load(storage_client, "bucket", max_terms=10)
+    assert loaded_index.document_frequencies.num_documents == 6
+    assert loaded_index.document_frequencies.document_frequencies == {"exam": 5}
+
+
+def test_concurrent_saves_keep_each_others_updates():
+    terms = np.array(["exam", "housing"], dtype=object)
+
+    def save_first_index(storage_client):
+        first_index = DocumentFrequencyIndex.load(storage_client, "bucket", max_terms=10)
+        first_index.update(Date(2023, 7, 1), terms, np.array([2, 0]), num_documents=2)
+        first_index.save(storage_client, "bucket")
+
+    storage_client = RacingStorageClient(competing_write=None)
+    DocumentFrequencyIndex.empty(max_terms=10).save(storage_client, "bucket")
+    second_index = DocumentFrequencyIndex.load(storage_client, "bucket", max_terms=10)
+    second_index.update(Date(2023, 7, 2), terms, np.array([1, 1]), num_documents=1)
+    storage_client.competing_write = save_first_index
+    second_index.save(storage_client, "bucket")
+
+    loaded_index = DocumentFrequencyIndex.load(storage_client, "bucket", max_terms=10)
+    assert loaded_index.document_frequencies.num_documents == 3
+    assert loaded_index.document_frequencies.document_frequencies == {"exam": 3, "housing": 1}
+    assert loaded_index.document_frequencies.counted_dates == [Date(2023, 7, 1), Date(2023, 7, 2)]
+    assert storage_client.num_rejected_uploads == 1
+
+
+def test_document_frequency_index_keeps_most_frequent_terms():
+    index = DocumentFrequencyIndex.empty(max_terms=2)
+    terms = np.array(["exam", "housing", "parking"], dtype=object)
+    index.update(Date(2023, 7, 1), terms, np.array([3, 1, 2]), num_documents=3)
+    assert index.document_frequencies.document_frequencies == {"exam": 3, "parking": 2}
+
+
+def test_document_frequency_index_save_and_load():
+    storage_client = FakeCloudStorageClient()
+    assert DocumentFrequencyIndex.load(storage_client, "bucket", max_terms=10).document_frequencies.num_documents == 0
+
+    index = DocumentFrequencyIndex.empty(max_terms=10)
+    index.update(Date(2023, 7, 1), np.array(["exam"], dtype=object), np.array([2]), num_documents=2)
+    index.save(storage_client, "bucket")
+
+    loaded_index = DocumentFrequencyIndex.load(storage_client, "bucket", max_terms=10)
+    assert loaded_index.document_frequencies == index.document_frequencies
+
+
+def test_compute_distinctive_terms_ranks_terms_within_each_group():
+    texts = [
+        "exam results",
+        "exam stress",
+        "campus housing",
+        "housing prices results",
+        "housing waitlist results",
+    ]
+    groups = np.array(["cs", "cs", "dorms", "dorms", "dorms"], dtype=object)
+    matrix, terms = build_document_term_matrix(texts)
+    index = DocumentFrequencyIndex.empty(max_terms=100)
+    index.update(Date(2023, 7, 1), terms, np.asarray(matrix.sum(axis=0)).ravel(), num_documents=len(texts))
+
+    group_to_terms = compute_distinctive_terms(
+        document_term_matrix=matrix,
+        terms=terms,
+        groups=groups,
+        inverse_document_frequencies=index.get_inverse_document_frequencies(terms),
+        num_terms=2,
+    )
+
+    assert group_to_terms == {"cs": ["exam"], "dorms": ["housing", "results"]}
+
+
+@pytest.mark.parametrize("min_document_count", [1, 3])
+def test_compute_distinctive_terms_min_document_count(min_document_count):
+    matrix, terms = build_document_term_matrix(["exam", "exam", "stress"])
+    group_to_terms = compute_distinctive_terms(
+        document_term_matrix=matrix,
+        terms=terms,
+        groups=np.array(["cs", "cs", "cs"], dtype=object),
+        inverse_document_frequencies=np.ones(len(terms)),
+        num_terms=5,
+        min_document_count=min_document_count,
+    )
+    assert group_to_terms == {"cs": ["exam", "stress"] if min_document_count == 1 else []}
@@ -1,12 +1,30 @@
 from __future__ import annotations
 
+import math
+from datetime import date as Date
+from datetime import timedelta
 from statistics import mean
 
+import pandas as pd
+import pytest
+import transform
+from common import config
+from common.topics import DocumentFrequencyIndex
+from common.utils import get_post_sentiments_object_key
 from fakes import FakeCloudStorageClient
 from fakes import FakeNLPClient
+from fastapi.testclient import TestClient
 from pandas.testing import assert_frame_equal
-from transform import compute_sentiment_score
+from transform import aggregate_subreddit_metrics
+from transform import calculate_subreddit_metrics
+from transform import compute_common_topics
+from transform import compute_sentiment_scores_of_posts
+from transform import fetch_post_sentiments_dataframe_from_cloud
 from transform import fetch_reddit_posts_dataframe_from_cloud
+from transform import get_post_sentiments_list_from_posts_df
+from transform import get_subreddit_metrics_list_from_metrics_df
+from transform import merge_post_sentiments_into_posts_df
+from transform import store_post_sentiments_list_to_gcs
 
 
 def test_fetch_reddit_posts_dataframe_from_gcs(bucket_name, object_key, reddit_posts, reddit_posts_df):
@@ -25,11 +43,187 @@ def test_fetch_reddit_posts_dataframe_from_gcs(bucket_name, object_key, reddit_p
     assert_frame_equal(reddit_posts_df, fetched_df)
 
 
-def test_compute_sentiment_score(text_to_sentiment_score, reddit_posts_df):
+def test_calculate_subreddit_metrics_scores_all_titles_in_one_call(reddit_posts_df):
+    text_to_sentiment_score = {title: 0.5 for title in reddit_posts_df.title}
+    text_to_sentiment_score[reddit_posts_df.title.iloc[0]] = None
     fake_nlp_client = FakeNLPClient(text_to_sentiment_score)
-    computed_sentiment_score = compute_sentiment_score(
+
+    metrics_df = calculate_subreddit_metrics(
         nlp_client=fake_nlp_client,
-        reddit_posts=reddit_posts_df,
+        reddit_posts_df=reddit_posts_df,
+    ).set_index("subreddit")
+
+    assert fake_nlp_client.requested_texts == list(reddit_posts_df.title)
+    for subreddit, posts_df in reddit_posts_df.groupby("subreddit"):
+        scores = [text_to_sentiment_score[title] for title in posts_df.title]
+        scores = [score for score in scores if score is not None]
+        metrics = metrics_df.loc[subreddit]
+        assert metrics.posts == len(posts_df)
+        assert metrics.upvotes == posts_df.upvotes.sum()
+        assert metrics.downvotes_estimated == posts_df.downvotes_estimated.sum()
+        if scores:
+            assert metrics.sentiment_score == mean(scores)
+        else:
+            assert math.isnan(metrics.sentiment_score)
+
+
+def test_subreddit_with_no_scored_posts_gets_nan_sentiment_score(reddit_posts_df):
+    unscored_subreddit = reddit_posts_df.subreddit.iloc[0]
+    text_to_sentiment_score = {
+        title: None if subreddit == unscored_subreddit else 0.5
+        for title, subreddit in zip(reddit_posts_df.title, reddit_posts_df.subreddit)
+    }
+
+    metrics_df = calculate_subreddit_metrics(
+        nlp_client=FakeNLPClient(text_to_sentiment_score),
+        reddit_posts_df=reddit_posts_df,
+    ).set_index("subreddit")
+
+    assert math.isnan(metrics_df.loc[unscored_subreddit].sentiment_score)
+    assert (metrics_df.drop(index=unscored_subreddit).sentiment_score == 0.5).all()
+
+
+def test_get_subreddit_metrics_list_fills_in_subreddits_with_no_posts(date):
+    metrics_df = pd.DataFrame(
+        {
+            "subreddit": ["cats", "dogs"],
+            "upvotes": [13, 5],
+            "downvotes_estimated": [7, 0],
+            "sentiment_score": [0.5, float("NaN")],
+            "topics": [["cat"], ["dog"]],
+            "upvote_ratio": [0.65, 1.0],
+            "posts": [2, 1],
+        },
+    )
+
+    metrics_list = get_subreddit_metrics_list_from_metrics_df(
+        metrics_df=metrics_df,
+        date=date,
+        all_subreddits={"cats", "dogs", "birds"},
+    )
+
+    assert [metrics.subreddit for metrics in metrics_list] == ["cats", "dogs", "birds"]
+    assert metrics_list[0].upvotes == 13 and metrics_list[0].topics == ["cat"]
+    assert math.isnan(metrics_list[1].sentiment_score)
+    birds = metrics_list[2]
+    assert (birds.upvotes, birds.downvotes, birds.upvote_ratio, birds.posts) == (0, 0, 1, 0)
+    assert (birds.sentiment_score, birds.topics, birds.date) == (0, [], date)
+    assert len({metrics.transformed_utc for metrics in metrics_list}) == 1
+
+
+def test_get_subreddit_metrics_list_without_validation_matches_validated(
+    date,
+    reddit_posts_df,
+    text_to_sentiment_score,
+):
+    metrics_df = calculate_subreddit_metrics(
+        nlp_client=FakeNLPClient(text_to_sentiment_score),
+        reddit_posts_df=reddit_posts_df,
+    )
+    all_subreddits = {*reddit_posts_df.subreddit, "birds"}
+
+    validated = get_subreddit_metrics_list_from_metrics_df(metrics_df, date, all_subreddits)
+    constructed = get_subreddit_metrics_list_from_metrics_df(metrics_df, date, all_subreddits, validate=False)
+
+    for validated_metrics, constructed_metrics in zip(validated, constructed):
+        validated_dict = validated_metrics.model_dump(exclude={"transformed_utc"})
+        constructed_dict = constructed_metrics.model_dump(exclude={"transformed_utc"})
+        assert list(validated_dict.items()) == list(constructed_dict.items())
+        assert all(type(constructed_dict[field]) == type(value) for field, value in validated_dict.items())
+
+
+def test_compute_common_topics_updates_document_frequency_index(reddit_posts_df):
+    document_frequency_index = DocumentFrequencyIndex.empty(max_terms=100)
+    subreddit_to_topics = compute_common_topics(reddit_posts_df, document_frequency_index, num_topics=3)
+
+    assert set(subreddit_to_topics) == set(reddit_posts_df.subreddit)
+    assert all(len(topics) <= 3 for topics in subreddit_to_topics.values())
+    assert document_frequency_index.document_frequencies.num_documents == len(reddit_posts_df)
+    assert set(document_frequency_index.document_frequencies.counted_dates) == set(reddit_posts_df.date)
+
+
+def test_reaggregating_stored_post_sentiments_matches_transform(date, reddit_posts_df, text_to_sentiment_score):
+    fake_nlp_client = FakeNLPClient(text_to_sentiment_score)
+    scored_posts_df = reddit_posts_df.assign(
+        sentiment_score=compute_sentiment_scores_of_posts(fake_nlp_client, reddit_posts_df),
     )
-    actual_sentiment_score = mean(text_to_sentiment_score[text] for text in reddit_posts_df.title)
-    assert computed_sentiment_score == actual_sentiment_score
+    fake_storage_client = FakeCloudStorageClient()
+    store_post_sentiments_list_to_gcs(
+        storage_client=fake_storage_client,
+        post_sentiments_list=get_post_sentiments_list_from_posts_df(scored_posts_df, date),
+        date=date,
+    )
+
+    post_sentiments_df = fetch_post_sentiments_dataframe_from_cloud(
+        storage_client=fake_storage_client,
+        bucket_name=config.GCS_TRANSFORMED_BUCKET_NAME,
+        object_key=get_post_sentiments_object_key(date),
+    )
+    rescored_posts_df = merge_post_sentiments_into_posts_df(reddit_posts_df, post_sentiments_df)
+
+    assert_frame_equal(
+        aggregate_subreddit_metrics(rescored_posts_df),
+        calculate_subreddit_metrics(fake_nlp_client, reddit_posts_df),
+    )
+    assert len(fake_nlp_client.requested_texts) == 2 * len(reddit_posts_df)
+
+
+def test_merge_post_sentiments_leaves_unscored_posts_as_nan(reddit_posts_df):
+    post_sentiments_df = pd.DataFrame(
+        {
+            "post_id": [reddit_posts_df.post_id.iloc[0]],
+            "subreddit": [reddit_posts_df.subreddit.iloc[0]],
+            "sentiment_score": [0.5],
+        },
+    )
+    scored_posts_df = merge_post_sentiments_into_posts_df(reddit_posts_df, post_sentiments_df)
+    assert scored_posts_df.sentiment_score.iloc[0] == 0.5
+    assert scored_posts_df.sentiment_score.iloc[1:].isna().all()
+
+
+def test_merge_post_sentiments_uses_last_score_of_duplicate_posts(reddit_posts_df):
+    post_id = reddit_posts_df.post_id.iloc[0]
+    post_sentiments_df = pd.DataFrame(
+        {
+            "post_id": [post_id, post_id],
+            "subreddit": [reddit_posts_df.subreddit.iloc[0]] * 2,
+            "sentiment_score": [0.5, -0.5],
+        },
+    )
+    scored_posts_df = merge_post_sentiments_into_posts_df(reddit_posts_df, post_sentiments_df)
+    assert scored_posts_df.sentiment_score.iloc[0] == -0.5
+
+
+@pytest.fixture
+def reaggregated_ranges(monkeypatch) -> list[tuple[Date, Date]]:
+    """Date ranges of each reaggregate_range call the endpoint makes"""
+    calls: list[tuple[Date, Date]] = []
+
+    def reaggregate_range(start_date: Date, end_date: Date) -> None:
+        calls.append((start_date, end_date))
+
+    monkeypatch.setattr(transform, "reaggregate_range", reaggregate_range)
+    return calls
+
+
+def test_reaggregate_endpoint_reaggregates_range(reaggregated_ranges):
+    start_date = Date(2023, 7, 1)
+    end_date = start_date + timedelta(days=config.REAGGREGATE_MAX_DAYS - 1)
+    params = {"start_date": start_date.strftime("%d/%m/%Y"), "end_date": end_date.strftime("%d/%m/%Y")}
+    response = TestClient(transform.app).get("/reaggregate", params=params)
+    assert response.status_code == 200
+    assert reaggregated_ranges == [(start_date, end_date)]
+
+
+@pytest.mark.parametrize(
+    "start_date, end_date",
+    [
+        ("2023-07-30", "01/08/2023"),
+        ("02/08/2023", "01/08/2023"),
+        ("01/01/2023", "01/08/2023"),
+    ],
+)
+def test_reaggregate_endpoint_rejects_invalid_ranges(reaggregated_ranges, start_date, end_date):
+    response = TestClient(transform.app).get("/reaggregate", params={"start_date": start_date, "end_date": end_date})
+    assert response.status_code == 400
+    assert reaggregated_ranges == []
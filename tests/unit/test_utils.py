@@ -1,13 +1,29 @@
 from __future__ import annotations
 
+import io
+import math
 from datetime import date
 
 import pytest
+from common.models import DocumentFrequencies
+from common.models import RedditPost
+from common.models import SubredditMetrics
+from common.utils import compress
+from common.utils import deserialize_parquet_to_dataframe
+from common.utils import deserialize_parquet_to_objects
 from common.utils import deserialize_single_json_to_objects
 from common.utils import estimate_downvotes
 from common.utils import get_date_parts_from_date
+from common.utils import get_json_codec
 from common.utils import get_object_key
+from common.utils import is_daily_object_key
+from common.utils import is_parquet
+from common.utils import open_compressed_writer
+from common.utils import open_decompressed_reader
+from common.utils import serialize_objects_to_parquet
 from common.utils import serialize_objects_to_single_json
+from common.utils import StdlibJsonCodec
+from pandas.testing import assert_frame_equal
 
 
 @pytest.mark.parametrize(
@@ -48,6 +64,17 @@ def test_deserialize_single_json_to_objects(json_string, model_type, expected_ob
     assert result_objects == expected_objects
 
 
+@pytest.mark.parametrize(
+    "data",
+    [
+        b'[{"name": "Alice", "age": "30"}, {"name": "Bob", "age": "25"}]',
+        b'{"name": "Alice", "age": "30"}\n{"name": "Bob", "age": "25"}\n',
+    ],
+)
+def test_codec_decodes_single_json_and_ndjson(data):
+    assert StdlibJsonCodec().decode(data, dict) == [{"name": "Alice", "age": "30"}, {"name": "Bob", "age": "25"}]
+
+
 @pytest.mark.parametrize(
     "date_input, expected_parts",
     [
@@ -72,6 +99,18 @@ def test_get_object_key(date_input, expected_key):
     assert result_key == expected_key
 
 
+@pytest.mark.parametrize(
+    "object_key, expected_result",
+    [
+        ("year=2023/month=07/day=01.json", True),
+        ("_index/watermarks.json", False),
+        ("year=2023/month=07/day=01.json.tmp", False),
+    ],
+)
+def test_is_daily_object_key(object_key, expected_result):
+    assert is_daily_object_key(object_key) == expected_result
+
+
 @pytest.mark.parametrize(
     "upvotes, upvote_ratio, expected_downvotes",
     [
@@ -82,3 +121,119 @@ def test_get_object_key(date_input, expected_key):
 def test_estimate_downvotes(upvotes, upvote_ratio, expected_downvotes):
     result_downvotes = estimate_downvotes(upvotes, upvote_ratio)
     assert result_downvotes == expected_downvotes
+
+
+def test_parquet_round_trip_of_objects(reddit_posts):
+    data = serialize_objects_to_parquet(reddit_posts, RedditPost)
+    assert is_parquet(data)
+    assert deserialize_parquet_to_objects(data, RedditPost) == reddit_posts
+
+
+def test_parquet_round_trip_of_list_and_nan_fields(subreddit_metrics_list):
+    data = serialize_objects_to_parquet(subreddit_metrics_list, SubredditMetrics)
+    deserialized = deserialize_parquet_to_objects(data, SubredditMetrics)
+    assert [metrics.topics for metrics in deserialized] == [metrics.topics for metrics in subreddit_metrics_list]
+    assert [math.isnan(metrics.sentiment_score) for metrics in deserialized] == [
+        math.isnan(metrics.sentiment_score) for metrics in subreddit_metrics_list
+    ]
+
+
+def test_parquet_dataframe_matches_dataframe_of_objects(reddit_posts, reddit_posts_df):
+    data = serialize_objects_to_parquet(reddit_posts, RedditPost)
+    assert_frame_equal(deserialize_parquet_to_dataframe(data), reddit_posts_df)
+
+
+def test_parquet_round_trip_of_dict_fields():
+    document_frequencies = [
+        DocumentFrequencies(
+            date=date(2023, 7, 2),
+            num_documents=3,
+            counted_dates=[date(2023, 7, 1), date(2023, 7, 2)],
+            document_frequencies={"exam": 3, "housing": 1},
+        ),
+        DocumentFrequencies(date=date(2023, 7, 3), num_documents=0, counted_dates=[], document_frequencies={}),
+    ]
+    data = serialize_objects_to_parquet(document_frequencies, DocumentFrequencies)
+    assert deserialize_parquet_to_objects(data, DocumentFrequencies) == document_frequencies
+
+
+def test_json_is_not_parquet():
+    assert not is_parquet(serialize_objects_to_single_json([]).encode("utf-8"))
+
+
+def test_stdlib_codec_writes_the_same_bytes_as_before(reddit_posts, subreddit_metrics_list):
+    codec = StdlibJsonCodec()
+    for objects in (reddit_posts, subreddit_metrics_list):
+        assert codec.encode(objects) == serialize_objects_to_single_json(objects).encode("utf-8")
+        assert codec.encode_line(objects[0]) == serialize_objects_to_single_json(objects[:1])[1:-1] + "\n"
+
+
+@pytest.mark.parametrize("codec_name", ["stdlib", "orjson"])
+def test_codec_round_trip(codec_name, reddit_posts):
+    codec = get_json_codec(codec_name)
+    assert codec.decode(codec.encode(reddit_posts), RedditPost) == reddit_posts
+    ndjson = "".join(codec.encode_line(post) for post in reddit_posts).encode("utf-8")
+    assert codec.decode(ndjson, RedditPost) == reddit_posts
+
+
+@pytest.mark.parametrize("codec_name", ["stdlib", "orjson"])
+def test_codec_round_trip_of_nan(codec_name, subreddit_metrics_list):
+    codec = get_json_codec(codec_name)
+    for data in (
+        codec.encode(subreddit_metrics_list),
+        "".join(codec.encode_line(metrics) for metrics in subreddit_metrics_list).encode("utf-8"),
+    ):
+        decoded = codec.decode(data, SubredditMetrics)
+        assert [math.isnan(metrics.sentiment_score) for metrics in decoded] == [
+            math.isnan(metrics.sentiment_score) for metrics in subreddit_metrics_list
+        ]
+
+
+def test_codec_decodes_objects_written_by_the_previous_serializer(reddit_posts):
+    json_string = serialize_objects_to_single_json(reddit_posts)
+    assert StdlibJsonCodec().decode(json_string.encode("utf-8"), RedditPost) == deserialize_single_json_to_objects(
+        json_string,
+        RedditPost,
+    )
+
+
+def test_get_json_codec_rejects_unknown_codec():
+    with pytest.raises(ValueError):
+        get_json_codec("yaml")
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compress_round_trip(compression, reddit_posts):
+    data = StdlibJsonCodec().encode(reddit_posts * 100)
+    compressed_data = compress(data, compression)
+    assert len(compressed_data) < len(data)
+    with open_decompressed_reader(io.BytesIO(compressed_data), compression) as reader:
+        assert reader.read() == data
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_writer_and_decompressed_reader_stream(compression):
+    lines = [f'{{"post_id": "p{i}"}}\n'.encode("utf-8") for i in range(1000)]
+    file = io.BytesIO()
+    with open_compressed_writer(file, compression) as writer:
+        for line in lines:
+            writer.write(line)
+    assert not file.closed
+
+    file.seek(0)
+    with open_decompressed_reader(file, compression) as reader:
+        assert reader.read(10) == lines[0][:10]
+        assert reader.read() == b"".join(lines)[10:]
+
+
+@pytest.mark.parametrize("content_encoding", [None, "", "identity"])
+def test_decompressed_reader_of_uncompressed_data(content_encoding):
+    with open_decompressed_reader(io.BytesIO(b"[]"), content_encoding) as reader:
+        assert reader.read() == b"[]"
+
+
+def test_compression_rejects_unknown_encoding():
+    with pytest.raises(ValueError):
+        compress(b"[]", "brotli")
+    with pytest.raises(ValueError):
+        open_decompressed_reader(io.BytesIO(b"[]"), "brotli")
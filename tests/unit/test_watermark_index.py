@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from datetime import date
+
+from common.watermark_index import WATERMARK_INDEX_OBJECT_KEY
+from common.watermark_index import WatermarkIndex
+from fakes import FakeCloudStorageClient
+from fakes import RacingStorageClient
+
+
+def test_load_missing_index_is_empty(bucket_name):
+    watermark_index = WatermarkIndex.load(FakeCloudStorageClient(), bucket_name)
+    assert watermark_index.get("cats") is None
+
+
+def test_update_keeps_newest_submission(submissions):
+    watermark_index = WatermarkIndex([])
+    watermark_index.update("cats", submissions[2:])
+    watermark_index.update("cats", submissions)
+    watermark_index.update("cats", submissions[3:])
+
+    watermark = watermark_index.get("cats")
+    assert watermark.post_id == submissions[0]["id"]
+    assert watermark.created_utc == submissions[0]["created_utc"]
+    assert watermark.date == date(2020, 10, 5)
+
+
+def test_save_and_load_index(bucket_name, submissions):
+    fake_storage_client = FakeCloudStorageClient()
+    watermark_index = WatermarkIndex([])
+    watermark_index.update("cats", submissions)
+    watermark_index.save(fake_storage_client, bucket_name)
+
+    loaded_watermark_index = WatermarkIndex.load(fake_storage_client, bucket_name)
+    assert loaded_watermark_index.get("cats") == watermark_index.get("cats")
+
+
+def test_concurrent_saves_keep_each_others_watermarks(bucket_name, submissions):
+    def save_dogs_watermark(storage_client):
+        dogs_index = WatermarkIndex.load(storage_client, bucket_name)
+        dogs_index.update("dogs", submissions[1:])
+        dogs_index.save(storage_client, bucket_name)
+
+    storage_client = RacingStorageClient(competing_write=save_dogs_watermark)
+    storage_client.upload([], bucket_name, WATERMARK_INDEX_OBJECT_KEY)
+    cats_index = WatermarkIndex([])
+    cats_index.update("cats", submissions)
+    cats_index.save(storage_client, bucket_name)
+
+    assert storage_client.num_rejected_uploads == 1
+    stored_index = WatermarkIndex.load(storage_client, bucket_name)
+    assert stored_index.get("cats").post_id == submissions[0]["id"]
+    assert stored_index.get("dogs").post_id == submissions[1]["id"]